@@ -1,3 +1,19 @@
+import sys
+import types
+
 from delft.sequenceLabelling.tagger import Tagger
-from delft.sequenceLabelling.trainer import Trainer
 from delft.sequenceLabelling.wrapper import Sequence
+
+
+class _SequenceLabellingModule(types.ModuleType):
+    """
+    The Trainer, which imports Keras, is imported at its first access
+    """
+    def __getattr__(self, name):
+        if name == 'Trainer':
+            from delft.sequenceLabelling.trainer import Trainer
+            return Trainer
+        raise AttributeError("module '" + self.__name__ + "' has no attribute '" + name + "'")
+
+
+sys.modules[__name__].__class__ = _SequenceLabellingModule
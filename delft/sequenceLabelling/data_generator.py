@@ -2,7 +2,7 @@ import numpy as np
 # seed is fixed for reproducibility
 np.random.seed(7)
 import keras
-from delft.sequenceLabelling.preprocess import to_vector_single, to_casing_single, to_vector_elmo, to_vector_simple_with_elmo, to_vector_bert, to_vector_simple_with_bert
+from delft.sequenceLabelling.preprocess import to_vector_batch, to_casing_single, to_vector_elmo, to_vector_simple_with_elmo, to_vector_bert, to_vector_simple_with_bert
 from delft.utilities.Tokenizer import tokenizeAndFilterSimple
 import tensorflow as tf
 tf.set_random_seed(7)
@@ -111,13 +111,12 @@ class DataGenerator(keras.utils.Sequence):
         elif self.embeddings.use_BERT:     
             #batch_x = to_vector_bert(x_tokenized, self.embeddings, max_length_x)
             batch_x = to_vector_simple_with_bert(x_tokenized, self.embeddings, max_length_x)
+        else:
+            # static embeddings of the whole batch with a single lookup
+            batch_x = to_vector_batch(x_tokenized, self.embeddings, max_length_x)
             
         # generate data
         for i in range(0, max_iter):
-            # store sample embeddings
-            if not self.embeddings.use_ELMo and not self.embeddings.use_BERT:    
-                batch_x[i] = to_vector_single(x_tokenized[i], self.embeddings, max_length_x)
-
             if self.preprocessor.return_casing:
                 batch_a[i] = to_casing_single(x_tokenized[i], max_length_x)
 
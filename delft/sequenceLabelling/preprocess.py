@@ -6,8 +6,6 @@ np.random.seed(7)
 #set_random_seed(7)
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.externals import joblib
-import tensorflow as tf
-tf.set_random_seed(7)
 
 # this is derived from https://github.com/Hironsan/anago/blob/master/anago/preprocess.py
 
@@ -226,16 +224,36 @@ def to_vector_single(tokens, embeddings, maxlen=300, lowercase=False, num_norm=T
     window = tokens[-maxlen:]
 
     # TBD: use better initializers (uniform, etc.) 
-    x = np.zeros((maxlen, embeddings.embed_size), )
+    x = np.zeros((maxlen, embeddings.embed_size), dtype=np.float32)
 
     # TBD: padding should be left and which vector do we use for padding? 
     # and what about masking padding later for RNN?
-    for i, word in enumerate(window):
-        if lowercase:
-            word = _lower(word)
-        if num_norm:
-            word = _normalize_num(word)
-        x[i,:] = embeddings.get_word_vector(word).astype('float32')
+    words = [_normalize_word(word, lowercase, num_norm) for word in window]
+    embeddings.get_word_vectors(words, out=x)
+
+    return x
+
+
+def to_vector_batch(token_lists, embeddings, maxlen=300, lowercase=False, num_norm=True):
+    """
+    Batch version of to_vector_single: the static embeddings of all the tokens of 
+    the batch are retrieved with a single lookup
+    """
+    x = np.zeros((len(token_lists), maxlen, embeddings.embed_size), dtype=np.float32)
+
+    words = []
+    lengths = []
+    for tokens in token_lists:
+        window = tokens[-maxlen:]
+        lengths.append(len(window))
+        for word in window:
+            words.append(_normalize_word(word, lowercase, num_norm))
+    vectors = embeddings.get_word_vectors(words)
+
+    offset = 0
+    for i, length in enumerate(lengths):
+        x[i, :length] = vectors[offset:offset+length]
+        offset += length
 
     return x
 
@@ -369,3 +387,11 @@ def _normalize_num(word):
     return re.sub(r'[0-9０１２３４５６７８９]', r'0', word)
 
 
+def _normalize_word(word, lowercase=False, num_norm=True):
+    if lowercase:
+        word = _lower(word)
+    if num_norm:
+        word = _normalize_num(word)
+    return word
+
+
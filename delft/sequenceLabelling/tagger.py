@@ -1,7 +1,6 @@
 from collections import defaultdict
 import numpy as np
 import datetime
-from delft.sequenceLabelling.data_generator import DataGenerator
 from delft.utilities.Tokenizer import tokenizeAndFilter
 
 
@@ -34,6 +33,8 @@ class Tagger(object):
         if (len(texts)>0 and isinstance(texts[0], str)):
             tokeniz = True
 
+        # imported with Keras only when tagging
+        from delft.sequenceLabelling.data_generator import DataGenerator
         predict_generator = DataGenerator(texts, None, 
             batch_size=self.model_config.batch_size, 
             preprocessor=self.preprocessor, 
@@ -81,7 +81,8 @@ class Trainer(object):
             callbacks = get_callbacks(log_dir=self.checkpoint_path,
                                       eary_stopping=True,
                                       patience=self.training_config.patience,
-                                      valid=(validation_generator, self.preprocessor))
+                                      valid=(validation_generator, self.preprocessor),
+                                      embeddings=self.embeddings)
         else:
             x_train = np.concatenate((x_train, x_valid), axis=0)
             y_train = np.concatenate((y_train, y_valid), axis=0)
@@ -92,7 +93,8 @@ class Trainer(object):
                 embeddings=self.embeddings, shuffle=True)
 
             callbacks = get_callbacks(log_dir=self.checkpoint_path,
-                                      eary_stopping=False)
+                                      eary_stopping=False,
+                                      embeddings=self.embeddings)
         nb_workers = 6
         multiprocessing = True
         # multiple workers will not work with ELMo due to GPU memory limit (with GTX 1080Ti 11GB)
@@ -159,7 +161,7 @@ class Trainer(object):
             self.models[fold_id] = foldModel
 
 
-def get_callbacks(log_dir=None, valid=(), eary_stopping=True, patience=5):
+def get_callbacks(log_dir=None, valid=(), eary_stopping=True, patience=5, embeddings=None):
     """
     Get callbacks.
 
@@ -167,6 +169,7 @@ def get_callbacks(log_dir=None, valid=(), eary_stopping=True, patience=5):
         log_dir (str): the destination to save logs
         valid (tuple): data for validation.
         eary_stopping (bool): whether to use early stopping.
+        embeddings (Embeddings): embeddings whose lookup stats are printed at each epoch.
 
     Returns:
         list: list of callbacks
@@ -176,6 +179,9 @@ def get_callbacks(log_dir=None, valid=(), eary_stopping=True, patience=5):
     if valid:
         callbacks.append(Scorer(*valid))
 
+    if embeddings is not None:
+        callbacks.append(EmbeddingsStatsLogger(embeddings))
+
     if log_dir:
         if not os.path.exists(log_dir):
             print('Successfully made a directory: {}'.format(log_dir))
@@ -193,6 +199,23 @@ def get_callbacks(log_dir=None, valid=(), eary_stopping=True, patience=5):
     return callbacks
 
 
+class EmbeddingsStatsLogger(Callback):
+    """
+    Print the lookup counters and timings of the embeddings during each epoch, to tell the time 
+    spent in the embeddings backend from the time spent in the model
+    """
+    def __init__(self, embeddings):
+        super(EmbeddingsStatsLogger, self).__init__()
+        self.embeddings = embeddings
+        self.epoch_stats = None
+
+    def on_epoch_begin(self, epoch, logs={}):
+        self.epoch_stats = self.embeddings.lookup_stats.snapshot()
+
+    def on_epoch_end(self, epoch, logs={}):
+        self.embeddings.print_stats(since=self.epoch_stats)
+
+
 class Scorer(Callback):
 
     def __init__(self, validation_generator, preprocessor=None, evaluation=False):
@@ -1,5 +1,6 @@
 import os
 
+import itertools
 from itertools import islice
 import time
 import json
@@ -13,23 +14,17 @@ np.random.seed(7)
 # ask tensorflow to be quiet and not print hundred lines of logs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2' 
 
-import tensorflow as tf
-tf.set_random_seed(7)
-
-import keras.backend as K
+# TensorFlow and Keras are imported with the models, the trainer and the data generator, only 
+# when a model is built, trained or evaluated (their modules fix the TensorFlow seed)
 # Initialize Keras session
 #sess = tf.Session()
 #K.set_session(sess)
 
 from delft.sequenceLabelling.config import ModelConfig, TrainingConfig
-from delft.sequenceLabelling.models import get_model
-from delft.sequenceLabelling.preprocess import prepare_preprocessor, WordPreprocessor
+from delft.sequenceLabelling.preprocess import prepare_preprocessor, WordPreprocessor, _normalize_word
 from delft.sequenceLabelling.tagger import Tagger
-from delft.sequenceLabelling.trainer import Trainer
-from delft.sequenceLabelling.data_generator import DataGenerator
-from delft.sequenceLabelling.trainer import Scorer
 
-from delft.utilities.Embeddings import Embeddings
+from delft.utilities.Embeddings import shared_embeddings, release_embeddings
 
 # initially derived from https://github.com/Hironsan/anago/blob/master/anago/wrapper.py
 # with various modifications
@@ -40,6 +35,7 @@ class Sequence(object):
     config_file = 'config.json'
     weight_file = 'model_weights.hdf5'
     preprocessor_file = 'preprocessor.pkl'
+    embeddings_dir = 'embeddings'
 
     # number of parallel worker for the data generator when not using ELMo
     nb_workers = 6
@@ -76,10 +72,13 @@ class Sequence(object):
         self.p = None
         self.log_dir = log_dir
         self.embeddings_name = embeddings_name
+        # tokens seen in training, to save the subset of the embeddings covering them
+        self.training_tokens = None
 
         word_emb_size = 0
         if embeddings_name is not None:
-            self.embeddings = Embeddings(embeddings_name, use_ELMo=use_ELMo, use_BERT=use_BERT) 
+            # models of the process using the same embeddings share a single instance
+            self.embeddings = shared_embeddings(embeddings_name, use_ELMo=use_ELMo, use_BERT=use_BERT) 
             word_emb_size = self.embeddings.embed_size
 
         self.model_config = ModelConfig(model_name=model_name, 
@@ -106,12 +105,19 @@ class Sequence(object):
                                               max_checkpoints_to_keep)
 
     def train(self, x_train, y_train, x_valid=None, y_valid=None):
+        from delft.sequenceLabelling.models import get_model
+        from delft.sequenceLabelling.trainer import Trainer
+
         # TBD if valid is None, segment train to get one
         x_all = np.concatenate((x_train, x_valid), axis=0)
         y_all = np.concatenate((y_train, y_valid), axis=0)
         self.p = prepare_preprocessor(x_all, y_all, self.model_config)
         self.model_config.char_vocab_size = len(self.p.vocab_char)
         self.model_config.case_vocab_size = len(self.p.vocab_case)
+        self.training_tokens = set(itertools.chain(*x_all))
+        self.embeddings.begin_training()
+        if self.embeddings.use_ELMo:
+            self.embeddings.dump_ELMo_token_embeddings(self.training_tokens)
 
         self.model = get_model(self.model_config, self.p, len(self.p.vocab_tag))
         trainer = Trainer(self.model, 
@@ -123,18 +129,24 @@ class Sequence(object):
                           preprocessor=self.p
                           )
         trainer.train(x_train, y_train, x_valid, y_valid)
-        if self.embeddings.use_ELMo:
-            self.embeddings.clean_ELMo_cache()
-        if self.embeddings.use_BERT:
-            self.embeddings.clean_BERT_cache()
+        # the training caches are deleted at the end of the last training using the embeddings
+        self.embeddings.end_training()
 
     def train_nfold(self, x_train, y_train, x_valid=None, y_valid=None, fold_number=10):
+        from delft.sequenceLabelling.models import get_model
+        from delft.sequenceLabelling.trainer import Trainer
+
         if x_valid is not None and y_valid is not None:
             x_all = np.concatenate((x_train, x_valid), axis=0)
             y_all = np.concatenate((y_train, y_valid), axis=0)
             self.p = prepare_preprocessor(x_all, y_all, self.model_config)
+            self.training_tokens = set(itertools.chain(*x_all))
         else:
             self.p = prepare_preprocessor(x_train, y_train, self.model_config)
+            self.training_tokens = set(itertools.chain(*x_train))
+        self.embeddings.begin_training()
+        if self.embeddings.use_ELMo:
+            self.embeddings.dump_ELMo_token_embeddings(self.training_tokens)
         self.model_config.char_vocab_size = len(self.p.vocab_char)
         self.model_config.case_vocab_size = len(self.p.vocab_case)
         self.p.return_lengths = True
@@ -155,18 +167,19 @@ class Sequence(object):
                           preprocessor=self.p
                           )
         trainer.train_nfold(x_train, y_train, x_valid, y_valid)
-        if self.embeddings.use_ELMo:
-            self.embeddings.clean_ELMo_cache()
-        if self.embeddings.use_BERT:
-            self.embeddings.clean_BERT_cache()
+        # the training caches are deleted at the end of the last training using the embeddings
+        self.embeddings.end_training()
 
     def eval(self, x_test, y_test):
         if self.model_config.fold_number > 1 and self.models and len(self.models) == self.model_config.fold_number:
-            self.eval_nfold(x_test, y_test)
+            return self.eval_nfold(x_test, y_test)
         else:
-            self.eval_single(x_test, y_test)
+            return self.eval_single(x_test, y_test)
 
     def eval_single(self, x_test, y_test):   
+        from delft.sequenceLabelling.data_generator import DataGenerator
+        from delft.sequenceLabelling.trainer import Scorer
+
         if self.model:
             # Prepare test data(steps, generator)
             test_generator = DataGenerator(x_test, y_test, 
@@ -179,10 +192,14 @@ class Sequence(object):
             scorer = Scorer(test_generator, self.p, evaluation=True)
             scorer.model = self.model
             scorer.on_epoch_end(epoch=-1) 
+            return scorer.f1
         else:
             raise (OSError('Could not find a model.'))
 
     def eval_nfold(self, x_test, y_test):
+        from delft.sequenceLabelling.data_generator import DataGenerator
+        from delft.sequenceLabelling.trainer import Scorer
+
         if self.models is not None:
             total_f1 = 0
             best_f1 = 0
@@ -286,6 +303,7 @@ class Sequence(object):
             self.model = self.models[best_index]
             print("\n** Best ** model scores -")
             print(reports[best_index])
+            return macro_f1
 
     def tag(self, texts, output_format):
         # annotate a list of sentences, return the list of annotations in the 
@@ -389,7 +407,7 @@ class Sequence(object):
         else:
             raise (OSError('Could not find a model.'))
 
-    def save(self, dir_path='data/models/sequenceLabelling/'):
+    def save(self, dir_path='data/models/sequenceLabelling/', prune_embeddings=False, embeddings_top_n=10000):
         # create subfolder for the model if not already exists
         directory = os.path.join(dir_path, self.model_config.model_name)
         if not os.path.exists(directory):
@@ -404,18 +422,47 @@ class Sequence(object):
         self.model.save(os.path.join(directory, self.weight_file))
         print('model saved')
 
+        if prune_embeddings:
+            # the static embeddings of the training tokens and of the embeddings_top_n most frequent 
+            # words are saved with the model, and used instead of the full embeddings when loading it
+            words = []
+            if self.training_tokens is not None:
+                # tokens are normalized as for the embeddings lookup
+                words = [_normalize_word(token) for token in self.training_tokens]
+            self.embeddings.save_subset(os.path.join(directory, self.embeddings_dir), words, embeddings_top_n)
+            print('embeddings subset saved')
+
     def load(self, dir_path='data/models/sequenceLabelling/'):
+        from delft.sequenceLabelling.models import get_model
+
         self.p = WordPreprocessor.load(os.path.join(dir_path, self.model_config.model_name, self.preprocessor_file))
 
         self.model_config = ModelConfig.load(os.path.join(dir_path, self.model_config.model_name, self.config_file))
 
-        # load embeddings
-        self.embeddings = Embeddings(self.model_config.embeddings_name, use_ELMo=self.model_config.use_ELMo, use_BERT=self.model_config.use_BERT) 
+        # load embeddings, the pruned ones saved with the model if present
+        subset_path = os.path.join(dir_path, self.model_config.model_name, self.embeddings_dir)
+        if not os.path.isdir(subset_path):
+            subset_path = None
+        embeddings = shared_embeddings(self.model_config.embeddings_name, use_ELMo=self.model_config.use_ELMo, 
+            use_BERT=self.model_config.use_BERT, subset_path=subset_path) 
+        # the instance obtained at the creation of the model, usually the same one, is released
+        if getattr(self, 'embeddings', None) is not None:
+            release_embeddings(self.embeddings)
+        self.embeddings = embeddings
         self.model_config.word_embedding_size = self.embeddings.embed_size
 
         self.model = get_model(self.model_config, self.p, ntags=len(self.p.vocab_tag))
         self.model.load(filepath=os.path.join(dir_path, self.model_config.model_name, self.weight_file))
 
+    def close(self):
+        """
+        Release the embeddings of the model, they are closed when no other model of the process 
+        shares them
+        """
+        if getattr(self, 'embeddings', None) is not None:
+            release_embeddings(self.embeddings)
+            self.embeddings = None
+
 
 def next_n_lines(file_opened, N):
     return [x.strip() for x in islice(file_opened, N)]
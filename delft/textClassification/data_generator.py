@@ -4,7 +4,7 @@ np.random.seed(7)
 from tensorflow import set_random_seed
 set_random_seed(7)
 import keras
-from delft.textClassification.preprocess import to_vector_single, to_vector_simple_with_elmo, to_vector_simple_with_bert
+from delft.textClassification.preprocess import to_vector_batch, to_vector_simple_with_elmo, to_vector_simple_with_bert
 from delft.utilities.Tokenizer import tokenizeAndFilterSimple
 
 # generate batch of data to feed text classification model, both for training and prediction
@@ -70,12 +70,12 @@ class DataGenerator(keras.utils.Sequence):
         if self.embeddings.use_BERT:     
             batch_x = to_vector_simple_with_bert(x_tokenized, self.embeddings, self.maxlen)
 
+        if not self.embeddings.use_ELMo and not self.embeddings.use_BERT:
+            # static embeddings of the whole batch with a single lookup
+            batch_x = to_vector_batch(sub_x, self.embeddings, self.maxlen)
+
         # Generate data
         for i in range(0, max_iter):
-            # Store sample
-            if not self.embeddings.use_ELMo and not self.embeddings.use_BERT:    
-                batch_x[i] = to_vector_single(self.x[(index*self.batch_size)+i], self.embeddings, self.maxlen)
-
             # Store class
             # classes are numerical, so nothing to vectorize for y
             if self.y is not None:
@@ -7,12 +7,9 @@
 import pandas as pd
 import numpy as np
 import pandas as pd
-import sys, os
+import sys
 import argparse
 import math
-import json
-import time
-import shutil
 
 from delft.textClassification.data_generator import DataGenerator
 
@@ -30,20 +27,13 @@ from keras.callbacks import EarlyStopping, ModelCheckpoint
 
 from sklearn.metrics import log_loss, roc_auc_score, r2_score
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import precision_score, precision_recall_fscore_support
+from sklearn.metrics import precision_score
 
 #import utilities.Attention
 from delft.utilities.Attention import Attention
 #from ToxicAttentionAlternative import AttentionAlternative
 #from ToxicAttentionWeightedAverage import AttentionWeightedAverage
 
-from delft.textClassification.preprocess import BERT_classifier_processor
-
-from delft.utilities.bert.run_classifier_delft import *
-import delft.utilities.bert.modeling as modeling
-import delft.utilities.bert.optimization as optimization
-import delft.utilities.bert.tokenization as tokenization
-
 # seed is fixed for reproducibility
 from numpy.random import seed
 seed(7)
@@ -633,6 +623,8 @@ def getModel(model_config, training_config):
 
     # for BERT models, parameters are set at class level
     if model_config.model_type.find('bert') != -1:
+        # the BERT fine-tuning modules are only imported for the bert model types
+        from delft.textClassification.bert_classifier import BERT_classifier
         print("model_config.maxlen: " + str(model_config.maxlen))
         print("model_config.batch_size: " + str(model_config.batch_size))
         model = BERT_classifier(model_config, 
@@ -702,6 +694,7 @@ def train_model(model, list_classes, batch_size, max_epoch, use_roc_auc, class_w
     current_epoch = 1
 
     while current_epoch <= max_epoch:
+        epoch_stats = training_generator.embeddings.lookup_stats.snapshot()
 
         #model.fit(train_x, train_y, batch_size=batch_size, epochs=1)
         nb_workers = 6
@@ -722,6 +715,10 @@ def train_model(model, list_classes, batch_size, max_epoch, use_roc_auc, class_w
             use_multiprocessing=multiprocessing,
             workers=nb_workers)
 
+        # lookup counters and timings of the embeddings during the epoch, to tell the time spent 
+        # in the embeddings backend from the time spent in the model
+        training_generator.embeddings.print_stats(since=epoch_stats)
+
         total_loss = 0.0
         total_roc_auc = 0.0
 
@@ -883,405 +880,3 @@ def predict_folds(models, predict_generator, use_ELMo=False, use_BERT=False, use
     y_predicts **= (1. / len(y_predicts_list))
 
     return y_predicts    
-
-
-class BERT_classifier():
-    """
-    BERT classifier model with fine-tuning.
-
-    Implementation is an adaptation of the official repository: 
-    https://github.com/google-research/bert
-
-    For reference:
-    --
-    @article{devlin2018bert,
-      title={BERT: Pre-training of Deep Bidirectional Transformers for Language Understanding},
-      author={Devlin, Jacob and Chang, Ming-Wei and Lee, Kenton and Toutanova, Kristina},
-      journal={arXiv preprint arXiv:1810.04805},
-      year={2018}
-    }
-    """
-
-    def __init__(self, config, model_name=None, fold_count=1, labels=None, class_weights=None):
-        self.graph = tf.get_default_graph()
-
-        print("config.maxlen: ", config.maxlen)
-        print("config.batch_size: ", config.batch_size)
-
-        if model_name is not None:
-            self.model_name = model_name
-        else:
-            self.model_name = config.model_name
-        self.model_type = config.model_type
-
-        # we get the BERT pretrained files from the embeddings registry
-        description = _get_description(self.model_type)
-        self.class_weights = class_weights
-
-        if description is None:
-            raise Exception('no embeddings description found for ' + self.model_type)
-
-        self.fold_count = fold_count
-
-        self.config_file = description["path-config"]
-        self.weight_file = description["path-weights"] # init_checkpoint
-        self.vocab_file = description["path-vocab"]
-
-        self.labels = labels
-
-        self.do_lower_case = False
-        self.max_seq_length= config.maxlen
-        self.train_batch_size = config.batch_size
-        self.predict_batch_size = config.batch_size
-        self.learning_rate = 2e-5 
-        self.num_train_epochs = 1.0
-        self.warmup_proportion = 0.1
-        self.master = None
-        self.save_checkpoints_steps = 99999999 # <----- don't want to save any checkpoints
-        self.iterations_per_loop = 1000
-
-        self.tokenizer = tokenization.FullTokenizer(vocab_file=self.vocab_file, do_lower_case=self.do_lower_case)
-        #self.processor = BERT_classifier_processor(labels=labels)
-
-        self.bert_config = modeling.BertConfig.from_json_file(self.config_file)
-        self.model_dir = 'data/models/textClassification/' + self.model_name
-        
-    def train(self, x_train=None, y_train=None):
-        '''
-        Train the classifier(s). We train fold_count classifiers if fold_count>1. 
-        '''
-        start = time.time()
-
-        # remove possible previous model(s)
-        for fold_number in range(0, self.fold_count):
-            if os.path.exists(self.model_dir+str(fold_number)):
-                shutil.rmtree(self.model_dir+str(fold_number))
-
-        train_examples = self.processor.get_train_examples(x_train=x_train, y_train=y_train)
-
-        if self.fold_count == 1:
-            self.train_fold(0, train_examples)
-        else:
-            fold_size = len(train_examples) // self.fold_count
-
-            for fold_id in range(0, self.fold_count):
-                tf.logging.info('\n------------------------ fold ' + str(fold_id) + '--------------------------------------')
-                fold_start = fold_size * fold_id
-                fold_end = fold_start + fold_size
-
-                if fold_id == fold_size - 1:
-                    fold_end = len(train_examples)
-
-                fold_train_examples = train_examples[:fold_start] + train_examples[fold_end:]
-
-                self.train_fold(fold_id, fold_train_examples)
-
-        end = time.time()
-        tf.logging.info("\nTotal training complete in " + str(end - start) + " seconds")
-
-
-    def train_fold(self, fold_number, train_examples):
-        '''
-        Train the classifier
-        '''
-        start = time.time()
-
-        print("len(train_examples): ", len(train_examples))
-        print("self.train_batch_size: ", self.train_batch_size)
-        print("self.num_train_epochs: ", self.num_train_epochs)
-
-        num_train_steps = int(len(train_examples) / self.train_batch_size * self.num_train_epochs)
-
-        print("num_train_steps: ", num_train_steps)
-        print("self.warmup_proportion: ", self.warmup_proportion)
-
-        num_warmup_steps = int(num_train_steps * self.warmup_proportion)
-
-        print("num_warmup_steps: ", num_warmup_steps)
-
-        model_fn = model_fn_builder(
-              bert_config=self.bert_config,
-              num_labels=len(self.labels),
-              init_checkpoint=self.weight_file,
-              learning_rate=self.learning_rate,
-              num_train_steps=num_train_steps,
-              num_warmup_steps=num_warmup_steps,
-              use_one_hot_embeddings=True)
-
-        run_config = self._get_run_config(fold_number)
-
-        estimator = tf.contrib.tpu.TPUEstimator(
-              use_tpu=False,
-              model_fn=model_fn,
-              config=run_config,
-              train_batch_size=self.train_batch_size)
-              
-        # create dir if does not exist
-        if not os.path.exists(self.model_dir+str(fold_number)):
-            os.makedirs(self.model_dir+str(fold_number))
-        
-        train_file = os.path.join(self.model_dir+str(fold_number), "train.tf_record")
-
-        file_based_convert_examples_to_features(train_examples, self.labels, 
-            self.max_seq_length, self.tokenizer, train_file)
-
-        tf.logging.info("***** Running training *****")
-        tf.logging.info("  Num examples = %d", len(train_examples))
-        tf.logging.info("  Batch size = %d", self.train_batch_size)
-        tf.logging.info("  Num steps = %d", num_train_steps)
-
-        print("self.max_seq_length: ", self.max_seq_length)
-        print("self.train_batch_size: ", self.train_batch_size)
-
-        train_input_fn = file_based_input_fn_builder(
-            input_file=train_file,
-            seq_length=self.max_seq_length,
-            is_training=True,
-            drop_remainder=False,
-            batch_size=self.train_batch_size)
-            
-        estimator.train(input_fn=train_input_fn, max_steps=num_train_steps)
-
-        end = time.time()
-        tf.logging.info("\nTraining complete in " + str(end - start) + " seconds")
-
-        # cleaning the training garbages
-        os.remove(train_file)
-
-        # the initial check point has prefix model.ckpt-0* and can be removed
-        # (given that it is 1.3GB file, it's preferable!) 
-        garbage = os.path.join(self.model_dir+str(fold_number), "model.ckpt-0.data-00000-of-00001")
-        if os.path.exists(garbage):
-            os.remove(garbage)
-        garbage = os.path.join(self.model_dir+str(fold_number), "model.ckpt-0.index")
-        if os.path.exists(garbage):
-            os.remove(garbage)
-        garbage = os.path.join(self.model_dir+str(fold_number), "model.ckpt-0.meta")
-        if os.path.exists(garbage):
-            os.remove(garbage)
-
-    def eval(self, x_test=None, y_test=None, run_number=0):
-        '''
-        Train and eval the nb_runs classifier(s) against holdout set. If nb_runs>1, the final
-        score are averaged over the nb_runs models. The best model against holdout is saved.
-        '''
-        start = time.time()
-        predict_examples, y_test = self.processor.get_test_examples(x_test=x_test, y_test=y_test)
-        #y_test_gold = np.asarray([np.argmax(line) for line in y_test])
-
-        y_predicts = self.eval_fold(predict_examples)
-        result_intermediate = np.asarray([np.argmax(line) for line in y_predicts])
-
-        def vectorize(index, size):
-            result = np.zeros(size)
-            if index < size:
-                result[index] = 1
-            return result
-        result_binary = np.array([vectorize(xi, len(self.labels)) for xi in result_intermediate])
-
-        precision, recall, fscore, support = precision_recall_fscore_support(y_test, result_binary, average=None)
-        print('\n')
-        print('{:>14}  {:>12}  {:>12}  {:>12}  {:>12}'.format(" ", "precision", "recall", "f-score", "support"))
-        p = 0
-        for the_class in self.labels:
-            the_class = the_class[:14]
-            print('{:>14}  {:>12}  {:>12}  {:>12}  {:>12}'.format(the_class, "{:10.4f}"
-                .format(precision[p]), "{:10.4f}".format(recall[p]), "{:10.4f}".format(fscore[p]), support[p]))
-            p += 1
-
-        runtime = round(time.time() - start, 3)
-
-        print("Total runtime for eval: " + str(runtime) + " seconds")
-
-    def eval_fold(self, predict_examples, fold_number=0):
-        
-        num_actual_predict_examples = len(predict_examples)
-
-        predict_file = os.path.join(self.model_dir+str(fold_number), "predict.tf_record")
-
-        file_based_convert_examples_to_features(predict_examples, self.labels,
-                                                self.max_seq_length, self.tokenizer,
-                                                predict_file)
-
-        tf.logging.info("***** Running holdout prediction*****")
-        tf.logging.info("  Num examples = %d (%d actual, %d padding)",
-                        len(predict_examples), num_actual_predict_examples,
-                        len(predict_examples) - num_actual_predict_examples)
-        tf.logging.info("  Batch size = %d", self.predict_batch_size)
-
-        predict_input_fn = file_based_input_fn_builder(
-            input_file=predict_file,
-            seq_length=self.max_seq_length,
-            is_training=False,
-            drop_remainder=False,
-            batch_size=self.predict_batch_size)
-
-        num_train_steps = int(31861 / self.train_batch_size * self.num_train_epochs)
-        num_warmup_steps = int(num_train_steps * self.warmup_proportion)
-
-        model_fn = model_fn_builder(
-              bert_config=self.bert_config,
-              num_labels=len(self.labels),
-              init_checkpoint=self.weight_file,
-              learning_rate=self.learning_rate,
-              num_train_steps=num_train_steps,
-              num_warmup_steps=num_warmup_steps,
-              #use_tpu=self.use_tpu,
-              use_one_hot_embeddings=True)
-
-        run_config = self._get_run_config(fold_number)
-
-        estimator = tf.contrib.tpu.TPUEstimator(
-              use_tpu=False,
-              model_fn=model_fn,
-              config=run_config,
-              predict_batch_size=self.predict_batch_size)
-
-        result = estimator.predict(input_fn=predict_input_fn)
-        
-        y_pred = np.zeros(shape=(len(predict_examples),len(self.labels)))
-
-        p = 0
-        for prediction in result:
-            probabilities = prediction["probabilities"]
-            q = 0
-            for class_probability in probabilities:
-                if self.class_weights is not None:
-                    y_pred[p,q] = class_probability * self.class_weights[q]
-                else:
-                    y_pred[p,q] = class_probability
-                q += 1
-            p += 1
-        
-        # cleaning the garbages
-        os.remove(predict_file)
-
-        return y_pred
-
-
-    def predict(self, texts, fold_number=0):
-        if self.loaded_estimator is None:
-            self.load_model(fold_number)        
-
-        # create the DeLFT json result remplate
-        '''
-        res = {
-            "software": "DeLFT",
-            "date": datetime.datetime.now().isoformat(),
-            "model": self.model_name,
-            "classifications": []
-        }
-        '''
-        if texts is None or len(texts) == 0:
-            return res
-
-        def chunks(l, n):
-            """Yield successive n-sized chunks from l."""
-            for i in range(0, len(l), n):
-                yield l[i:i + n]
-
-        y_pred = np.zeros(shape=(len(texts),len(self.labels)))
-        y_pos = 0
-
-        for text_batch in list(chunks(texts, self.predict_batch_size)):
-            if type(text_batch) is np.ndarray:
-                text_batch = text_batch.tolist()
-
-            # if the size of the last batch is less than the batch size, we need to fill it with dummy input
-            num_current_batch = len(text_batch)
-            if num_current_batch < self.predict_batch_size:
-                dummy_text = text_batch[-1]                
-                for p in range(0, self.predict_batch_size-num_current_batch):
-                    text_batch.append(dummy_text)
-
-            # segment in batches corresponding to self.predict_batch_size
-            input_examples = self.processor.create_inputs(text_batch, dummy_label=self.labels[0])
-            input_features = convert_examples_to_features(input_examples, self.labels, self.max_seq_length, self.tokenizer)
-
-            results = self.loaded_estimator.predict(input_features, self.max_seq_length, self.predict_batch_size)
-
-            #y_pred = np.zeros(shape=(num_current_batch,len(self.labels)))
-            p = 0
-            for prediction in results:
-                if p == num_current_batch:
-                    break
-                probabilities = prediction["probabilities"]
-                q = 0
-                for class_probability in probabilities:
-                    if self.class_weights and len(self.class_weights) == len(probabilities):    
-                        y_pred[y_pos+p,q] = class_probability * self.class_weights[q]
-                    else:
-                        y_pred[y_pos+p,q] = class_probability 
-                    q += 1
-                p += 1
-            y_pos += num_current_batch
-            '''
-            y_pred_best = np.asarray([np.argmax(line) for line in y_pred])            
-            
-            i = 0
-            for text in text_batch:
-                if i == num_current_batch:
-                    break
-                classification = {
-                    "text": text
-                }
-                j = 0
-                for cl in self.labels:
-                    classification[cl] = float(y_pred[i,j])
-                    j += 1
-                best = {
-                    "class": self.labels[y_pred_best[i]],
-                    "conf": float(y_pred[i][y_pred_best[i]])
-                }
-                classification['selection'] = best
-                res["classifications"].append(classification)
-                i += 1
-            '''
-
-        return y_pred
-
-    def _get_run_config(self, fold_number=0):
-        tpu_cluster_resolver = None
-        is_per_host = tf.contrib.tpu.InputPipelineConfig.PER_HOST_V2
-
-        run_config = tf.contrib.tpu.RunConfig(
-            cluster=tpu_cluster_resolver,
-            master=self.master,
-            model_dir=self.model_dir+str(fold_number),
-            save_checkpoints_steps=self.save_checkpoints_steps,
-            tpu_config=tf.contrib.tpu.TPUConfig(
-                iterations_per_loop=self.iterations_per_loop,
-                #num_shards=self.num_tpu_cores,
-                per_host_input_for_training=is_per_host)
-            )
-        return run_config
-
-    def load(self):
-        # default
-        num_train_steps = int(10000 / self.train_batch_size * self.num_train_epochs)
-        num_warmup_steps = int(num_train_steps * self.warmup_proportion)
-
-        model_fn = model_fn_builder(
-              bert_config=self.bert_config,
-              num_labels=len(self.labels),
-              init_checkpoint=self.weight_file,
-              learning_rate=self.learning_rate,
-              num_train_steps=num_train_steps,
-              num_warmup_steps=num_warmup_steps,
-              use_one_hot_embeddings=True)
-
-        run_config = self._get_run_config(0)
-
-        self.loaded_estimator = FastPredict(tf.contrib.tpu.TPUEstimator(
-              use_tpu=False,
-              model_fn=model_fn,
-              config=run_config,
-              predict_batch_size=self.predict_batch_size), input_fn_generator)   
-
-def _get_description(name, path="./embedding-registry.json"):
-    registry_json = open(path).read()
-    registry = json.loads(registry_json)
-    for emb in registry["embeddings-contextualized"]:
-        if emb["name"] == name:
-            return emb
-    return None
\ No newline at end of file
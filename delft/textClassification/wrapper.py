@@ -3,33 +3,26 @@ import os
 import numpy as np
 # seed is fixed for reproducibility
 np.random.seed(7)
-from tensorflow import set_random_seed
-set_random_seed(7)
+# TensorFlow and Keras are imported with the models and the data generator, only when a model 
+# is built, trained or applied (the models module fixes the TensorFlow seed)
 
 import datetime
 
 from delft.textClassification.config import ModelConfig, TrainingConfig
-from delft.textClassification.models import getModel
-from delft.textClassification.models import train_model
-from delft.textClassification.models import train_folds
-from delft.textClassification.models import predict
-from delft.textClassification.models import predict_folds
-from delft.textClassification.models import BERT_classifier
-from delft.textClassification.data_generator import DataGenerator
-from delft.textClassification.preprocess import to_vector_single, BERT_classifier_processor
+from delft.textClassification.preprocess import to_vector_single, clean_text
+from delft.utilities.Tokenizer import tokenizeAndFilterSimple
 
-from delft.utilities.Embeddings import Embeddings
+from delft.utilities.Embeddings import shared_embeddings, release_embeddings
 
 from sklearn.metrics import log_loss, roc_auc_score, accuracy_score, f1_score, r2_score, precision_score, precision_recall_fscore_support
 from sklearn.model_selection import train_test_split
 
-from keras.utils import plot_model
-
 
 class Classifier(object):
 
     config_file = 'config.json'
     weight_file = 'model_weights.hdf5'
+    embeddings_dir = 'embeddings'
 
     def __init__(self, 
                  model_name="",
@@ -59,10 +52,13 @@ class Classifier(object):
         self.models = None
         self.log_dir = log_dir
         self.embeddings_name = embeddings_name
+        # training texts, to save the subset of the embeddings covering their tokens
+        self.training_texts = None
 
         word_emb_size = 0
         if embeddings_name is not None:
-            self.embeddings = Embeddings(embeddings_name, use_ELMo=use_ELMo, use_BERT=use_BERT) 
+            # models of the process using the same embeddings share a single instance
+            self.embeddings = shared_embeddings(embeddings_name, use_ELMo=use_ELMo, use_BERT=use_BERT) 
             word_emb_size = self.embeddings.embed_size
 
         self.model_config = ModelConfig(model_name=model_name, 
@@ -86,14 +82,23 @@ class Classifier(object):
                                               class_weights=class_weights)
 
     def train(self, x_train, y_train, vocab_init=None):
+        from delft.textClassification.models import getModel, train_model
+        from delft.textClassification.data_generator import DataGenerator
+
         self.model = getModel(self.model_config, self.training_config)
+        self.training_texts = x_train
 
         # bert models
         if self.model_config.model_type.find("bert") != -1:     
+            from delft.textClassification.bert_classifier import BERT_classifier_processor
             self.model.processor = BERT_classifier_processor(labels=self.model_config.list_classes, x_train=x_train, y_train=y_train)
             self.model.train()
             return
 
+        self.embeddings.begin_training()
+        if self.embeddings.use_ELMo:
+            self.embeddings.dump_ELMo_token_embeddings(self._training_tokens())
+
         # create validation set in case we don't use k-folds
         xtr, val_x, y, val_y = train_test_split(x_train, y_train, test_size=0.1)
 
@@ -111,25 +116,38 @@ class Classifier(object):
             self.training_config.max_epoch, self.training_config.use_roc_auc, self.training_config.class_weights, 
             training_generator, validation_generator, val_y, use_ELMo=self.embeddings.use_ELMo, 
             use_BERT=self.embeddings.use_BERT)
-        if self.embeddings.use_ELMo:
-            self.embeddings.clean_ELMo_cache()
-        if self.embeddings.use_BERT:
-            self.embeddings.clean_BERT_cache()
+        # the training caches are deleted at the end of the last training using the embeddings
+        self.embeddings.end_training()
 
     def train_nfold(self, x_train, y_train, vocab_init=None):
-        self.models = train_folds(x_train, y_train, self.model_config, self.training_config, self.embeddings)
+        from delft.textClassification.models import train_folds
+
+        self.training_texts = x_train
+        self.embeddings.begin_training()
         if self.embeddings.use_ELMo:
-            self.embeddings.clean_ELMo_cache()
-        if self.embeddings.use_BERT:
-            self.embeddings.clean_BERT_cache()
+            self.embeddings.dump_ELMo_token_embeddings(self._training_tokens())
+        self.models = train_folds(x_train, y_train, self.model_config, self.training_config, self.embeddings)
+        # the training caches are deleted at the end of the last training using the embeddings
+        self.embeddings.end_training()
+
+    def _training_tokens(self):
+        # tokens of the training texts, as tokenized by the data generator
+        tokens = set()
+        for text in self.training_texts:
+            tokens.update(tokenizeAndFilterSimple(text))
+        return tokens
 
     # classification
     def predict(self, texts, output_format='json', use_main_thread_only=False):
+        from delft.textClassification.models import predict, predict_folds
+        from delft.textClassification.data_generator import DataGenerator
+
         if self.model_config.fold_number is 1:
             if self.model is not None:
                 # bert model?
                 if self.model_config.model_type.find("bert") != -1:
                     # be sure the input processor is instanciated
+                    from delft.textClassification.bert_classifier import BERT_classifier_processor
                     self.model.processor = BERT_classifier_processor(labels=self.model_config.list_classes)
                     result = self.model.predict(texts)
                 else:
@@ -146,6 +164,7 @@ class Classifier(object):
                 if self.model_config.model_type.find("bert") != -1:
                     # we don't support n classifiers for BERT (would be too large)
                     # be sure the input processor is instanciated
+                    from delft.textClassification.bert_classifier import BERT_classifier_processor
                     self.model.processor = BERT_classifier_processor(labels=self.model_config.list_classes)
                     result = self.models[0].predict(texts)
                 else:    
@@ -180,6 +199,9 @@ class Classifier(object):
             return result
 
     def eval(self, x_test, y_test, use_main_thread_only=False):
+        from delft.textClassification.models import predict, predict_folds
+        from delft.textClassification.data_generator import DataGenerator
+
         if self.model_config.fold_number is 1:
             if self.model is not None:
                 # bert model?
@@ -326,8 +348,10 @@ class Classifier(object):
             print("\taverage log-loss =", "{:10.4f}".format(total_loss))
             print("\taverage roc auc =", "{:10.4f}".format(total_roc_auc))
             '''
+
+        return total_f1
             
-    def save(self, dir_path='data/models/textClassification/'):
+    def save(self, dir_path='data/models/textClassification/', prune_embeddings=False, embeddings_top_n=10000):
         # create subfolder for the model if not already exists
         directory = os.path.join(dir_path, self.model_config.model_name)
         if not os.path.exists(directory):
@@ -341,6 +365,16 @@ class Classifier(object):
             print('model saved')
             return
 
+        if prune_embeddings:
+            # the static embeddings of the training tokens and of the embeddings_top_n most frequent 
+            # words are saved with the model, and used instead of the full embeddings when loading it
+            words = set()
+            if self.training_texts is not None:
+                for text in self.training_texts:
+                    words.update(tokenizeAndFilterSimple(clean_text(text)))
+            self.embeddings.save_subset(os.path.join(directory, self.embeddings_dir), words, embeddings_top_n)
+            print('embeddings subset saved')
+
         if self.model_config.fold_number is 1:
             if self.model is not None:
                 self.model.save(os.path.join(directory, self.model_config.model_type+"."+self.weight_file))
@@ -356,14 +390,24 @@ class Classifier(object):
                 print('nfolds model saved')
 
     def load(self, dir_path='data/models/textClassification/'):
+        from delft.textClassification.models import getModel
+
         self.model_config = ModelConfig.load(os.path.join(dir_path, self.model_config.model_name, self.config_file))
 
         if self.model_config.model_type.find("bert") != -1:
              self.model = getModel(self.model_config, self.training_config)
              self.model.load()
 
-        # load embeddings
-        self.embeddings = Embeddings(self.model_config.embeddings_name, use_ELMo=self.model_config.use_ELMo, use_BERT=self.model_config.use_BERT) 
+        # load embeddings, the pruned ones saved with the model if present
+        subset_path = os.path.join(dir_path, self.model_config.model_name, self.embeddings_dir)
+        if not os.path.isdir(subset_path):
+            subset_path = None
+        embeddings = shared_embeddings(self.model_config.embeddings_name, use_ELMo=self.model_config.use_ELMo, 
+            use_BERT=self.model_config.use_BERT, subset_path=subset_path) 
+        # the instance obtained at the creation of the model, usually the same one, is released
+        if getattr(self, 'embeddings', None) is not None:
+            release_embeddings(self.embeddings)
+        self.embeddings = embeddings
         self.model_config.word_embedding_size = self.embeddings.embed_size
 
         self.model = getModel(self.model_config, self.training_config)
@@ -375,3 +419,12 @@ class Classifier(object):
                 local_model = getModel(self.model_config, self.training_config)
                 local_model.load_weights(os.path.join(dir_path, self.model_config.model_name, self.model_config.model_type+".model{0}_weights.hdf5".format(i)))
                 self.models.append(local_model)
+
+    def close(self):
+        """
+        Release the embeddings of the model, they are closed when no other model of the process 
+        shares them
+        """
+        if getattr(self, 'embeddings', None) is not None:
+            release_embeddings(self.embeddings)
+            self.embeddings = None
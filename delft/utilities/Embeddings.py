@@ -1,6 +1,5 @@
 # Manage pre-trained embeddings 
 
-from keras.preprocessing import text, sequence
 import numpy as np
 import sys
 import os
@@ -10,28 +9,27 @@ import lmdb
 import io
 import pickle
 import hashlib, struct
+import time
+import bisect
 from tqdm import tqdm
 import mmap
 import codecs
-import tensorflow as tf
-import keras.backend as K
-
-# for fasttext binary embeddings
-fasttext_support = True
-try:
-    import fastText
-except ImportError as e:
-    fasttext_support = False
-
-# for ELMo embeddings
-from delft.utilities.bilm.data import Batcher, TokenBatcher
-from delft.utilities.bilm.model import BidirectionalLanguageModel, dump_token_embeddings
-from delft.utilities.bilm.elmo import weight_layers
+import shutil
+import argparse
+import gzip, bz2
+import h5py
+import multiprocessing
+import multiprocessing.util
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from itertools import islice, chain
 
 from delft.utilities.Tokenizer import tokenizeAndFilterSimple
 
-# for BERT extraction of word embeddings (not the fine tuning, this realized by a specific model)
-from keras_bert import load_trained_model_from_checkpoint, Tokenizer
+# tensorflow and keras, the ELMo biLM code (delft.utilities.bilm), keras_bert for the BERT 
+# extraction of word embeddings (not the fine tuning, this realized by a specific model) and 
+# fastText for the .bin embeddings are only imported when the corresponding mode is used
 
 
 # gensim is used to exploit .bin FastText embeddings, in particular the OOV with the provided ngrams
@@ -46,10 +44,84 @@ map_size = 100 * 1024 * 1024 * 1024
 ELMo_embed_size = 1024
 BERT_embed_size = 768
 BERT_sentence_size = 512
+# the BERT batches are padded to the longest retokenized sentence rounded up to one of these 
+# lengths, which bounds the number of distinct input shapes
+BERT_length_buckets = [16, 32, 64, 128, 256, BERT_sentence_size]
+# precomputed context-independent token layer of ELMo, stored under the "path-cache" of ELMo as
+# an embedding_weight_file of bilm (HDF5 'embedding' dataset) with its vocabulary file, the 
+# two first rows are the sentence boundaries
+ELMo_tokens_dir = 'tokens'
+ELMo_tokens_vocab_file = 'vocab.txt'
+ELMo_tokens_embeddings_file = 'embeddings.hdf5'
+ELMo_boundary_tokens = ['<S>', '</S>']
+# default number of the most frequent words of the static embeddings precomputed with the 
+# training vocabulary
+ELMo_tokens_top_n = 100000
+# pooling policies of the embeddings of the subtokens of a token extracted with BERT
+BERT_poolings = ['first', 'last', 'mean']
+
+# default maximum number of decoded static vectors kept in the in-process cache of the LMDB lookups
+default_cache_size = 20000
+
+# version of the layout of the vector values stored in the static embeddings LMDB:
+# 0 is the legacy layout (pickled numpy arrays), 1 stores the raw fixed-width little-endian 
+# values which are read directly from the LMDB memory map with np.frombuffer
+lmdb_format_version = 1
+
+# reserved key for the metadata of a compiled embeddings database - it starts with a null 
+# byte so that it cannot collide with a word
+lmdb_meta_key = b'\x00delft-embeddings-meta'
+
+# reserved key for the progress of a compilation, present only while it is not complete
+lmdb_progress_key = b'\x00delft-embeddings-progress'
+
+# supported value types for the raw vector layout, int8 values are quantized with one float32 
+# scale per vector
+lmdb_dtypes = ['float32', 'float16', 'int8']
+
+# files of a memory-mapped embeddings store: a dense matrix with one row per word, the words 
+# sorted by their UTF-8 bytes (same order as the matrix rows) and their offsets, and the metadata
+mmap_vectors_file = 'vectors.npy'
+mmap_words_file = 'words.bin'
+mmap_offsets_file = 'offsets.npy'
+mmap_meta_file = 'meta.json'
+# per-vector scales of a store with int8 quantized values
+mmap_scales_file = 'scales.npy'
+
+# header of the fastText .bin model files
+fasttext_magic = 793712314
+fasttext_args_size = 12 * 4 + 8
+
+# persistent cache of the contextual embeddings, under the "path-cache" of the contextual model,
+# with a budget given in MB by the attribute "persistent-cache-size" of its description
+contextual_cache_dir = 'persistent'
+# number of cache hits after which their recency is recorded without waiting for a write
+contextual_cache_touch_size = 1000
+
+# upper bounds in milliseconds of the buckets of the LMDB read latency histogram, the last bucket 
+# counting the slower reads
+lmdb_latency_buckets = [0.1, 0.5, 1, 5, 10, 50, 100]
+# the lookup counters of a process are merged into the shared counters at the first increment after 
+# lookup_stats_flush_size increments or lookup_stats_flush_interval seconds, when a snapshot is 
+# taken and at exit
+lookup_stats_flush_size = 256
+lookup_stats_flush_interval = 1.0
+
+def _import_fasttext():
+    """
+    fastText module for the .bin embeddings, None if it is not installed
+    """
+    try:
+        import fastText
+    except ImportError:
+        return None
+    return fastText
+
 
 class Embeddings(object):
 
-    def __init__(self, name, path='./embedding-registry.json', lang='en', extension='vec', use_ELMo=False, use_BERT=False):
+    def __init__(self, name, path='./embedding-registry.json', lang='en', extension='vec', use_ELMo=False, use_BERT=False, 
+                 subset_path=None, cache_size=default_cache_size, use_server=True):
         self.name = name
         self.embed_size = 0
         self.static_embed_size = 0
@@ -62,9 +134,38 @@ class Embeddings(object):
         if self.registry is not None:
             self.embedding_lmdb_path = self.registry["embedding-lmdb-path"]
         self.env = None
-        self.make_embeddings_simple(name)
+        # layout of the vectors in the LMDB database, updated with the metadata of the database
+        self.lmdb_format = lmdb_format_version
+        self.lmdb_dtype = 'float32'
+        # dense matrix of the vectors with its word to row index, when the embeddings are 
+        # not accessed via a LMDB database or the fastText model
+        self.matrix = None
+        self.vocabulary = None
+        # per-vector scales of the matrix rows, for int8 quantized values
+        self.scales = None
+        # cache of the vectors retrieved from the LMDB database
+        self.cache = VectorCache(cache_size)
+        # counters and timings of the lookups, see stats()
+        self.lookup_stats = LookupStats()
+        # char n-gram vectors for building the vectors of unknown words, when available
+        self.subwords = None
+        # client of the local embeddings server, when the embeddings are served (see EmbeddingsServer)
+        self.use_server = use_server
+        self.client = None
+        # pruned embeddings saved with a model, used instead of the full embeddings of the registry
+        self.subset_path = subset_path
+        if subset_path is not None:
+            self.make_embeddings_subset(subset_path)
+        else:
+            self.make_embeddings_simple(name)
         self.static_embed_size = self.embed_size
         self.bilm = None
+        # number of the model trainings in progress with these embeddings, the training caches of 
+        # ELMo and BERT are deleted at the end of the last one (see end_training)
+        self.trainings = 0
+        self.trainings_lock = threading.Lock()
+        self.embedding_ELMo_cache = None
+        self.embedding_BERT_cache = None
 
         # below init for using ELMo embeddings
         self.use_ELMo = use_ELMo
@@ -73,17 +174,21 @@ class Embeddings(object):
             self.embed_size = ELMo_embed_size + self.embed_size
             description = self._get_description('elmo-'+self.lang)
             self.env_ELMo = None
+            self.ELMo_persistent_cache = None
             if description:
+                self.ELMo_persistent_cache = self.make_contextual_cache(description, 
+                    [description["path-config"], description["path_weights"]], ELMo_embed_size)
                 self.embedding_ELMo_cache = os.path.join(description["path-cache"], "cache")
                 # clean possible remaining cache
                 self.clean_ELMo_cache()
                 # create and load a cache in write mode, it will be used only for training
-                self.env_ELMo = lmdb.open(self.embedding_ELMo_cache, map_size=map_size)
+                self.env_ELMo = ProcessLocalEnvironment(self.embedding_ELMo_cache, map_size=map_size)
 
         # below init for using BERT embeddings (extracted features only, not fine tuning), 
         # similar to ELMo for this usage
         self.use_BERT = use_BERT
         if use_BERT:
+            import tensorflow as tf
             # to avoid issue with tf graph and thread, we maintain in the class its own graph and session
             #self.session = tf.Session()
             self.graph = tf.get_default_graph()
@@ -92,12 +197,26 @@ class Embeddings(object):
             self.embed_size = BERT_embed_size + self.embed_size
             description = self._get_description('bert-base-'+self.lang)
             self.env_BERT = None
+            self.BERT_persistent_cache = None
+            self.BERT_cache_dtype = 'float32'
+            self.BERT_pooling = 'mean'
+            if description:
+                self.BERT_cache_dtype = description.get("cache-dtype", 'float32')
+                if self.BERT_cache_dtype not in lmdb_dtypes:
+                    raise ValueError('unsupported cache dtype for BERT embeddings: ' + str(self.BERT_cache_dtype))
+                self.BERT_pooling = description.get("subtoken-pooling", 'mean')
+                if self.BERT_pooling not in BERT_poolings:
+                    raise ValueError('unsupported subtoken pooling for BERT embeddings: ' + str(self.BERT_pooling))
+                # the pooling is part of the fingerprint, cached vectors depend on it
+                self.BERT_persistent_cache = self.make_contextual_cache(description, 
+                    [description["path-config"], description["path-weights"]], BERT_embed_size, 
+                    options=[self.BERT_pooling])
             if description and description["cache-training"]:
                 self.embedding_BERT_cache = os.path.join(description["path-cache"], "cache")
                 # clean possible remaining cache
                 self.clean_BERT_cache()
                 # create and load a cache in write mode, it will be used only for training
-                self.env_BERT = lmdb.open(self.embedding_BERT_cache, map_size=map_size)
+                self.env_BERT = ProcessLocalEnvironment(self.embedding_BERT_cache, map_size=map_size)
 
     def __getattr__(self, name):
         return getattr(self.model, name)
@@ -114,7 +233,6 @@ class Embeddings(object):
     def make_embeddings_simple_in_memory(self, name="fasttext-crawl", hasHeader=True):
         nbWords = 0
         print('loading embeddings...')
-        begin = True
         description = self._get_description(name)
         if description is not None:
             embeddings_path = description["path"]
@@ -122,35 +240,16 @@ class Embeddings(object):
             self.lang = description["lang"]
             print("path:", embeddings_path)
             if self.extension == 'bin':
-                self.model = fastText.load_model(embeddings_path)
+                self.model = _import_fasttext().load_model(embeddings_path)
                 nbWords = len(self.model.get_words())
                 self.embed_size = self.model.get_dimension()
             else:
                 if embeddings_type == "glove":
                     hasHeader = False
-                with open(embeddings_path, encoding='utf8') as f:
-                    for line in f:
-                        line = line.strip()
-                        line = line.split(' ')
-                        if begin:
-                            if hasHeader:
-                                # first line gives the nb of words and the embedding size
-                                nbWords = int(line[0])
-                                self.embed_size = int(line[1].replace("\n", ""))
-                                begin = False
-                                continue
-                            else:
-                                begin = False
-                        word = line[0]
-                        #if embeddings_type == 'glove':
-                        vector = np.array([float(val) for val in line[1:len(line)]], dtype='float32')
-                        #else:
-                        #    vector = np.array([float(val) for val in line[1:len(line)-1]], dtype='float32')
-                        if self.embed_size == 0:
-                            self.embed_size = len(vector)
-                        self.model[word] = vector
-                if nbWords == 0:
-                    nbWords = len(self.model)
+                # one float32 matrix and a word to row index, instead of one array per word
+                self.matrix, self.vocabulary = load_embeddings_matrix(embeddings_path, hasHeader)
+                nbWords = len(self.vocabulary)
+                self.embed_size = self.matrix.shape[1]
             print('embeddings loaded for', nbWords, "words and", self.embed_size, "dimensions")
 
     '''
@@ -165,10 +264,8 @@ class Embeddings(object):
         self.model = load_fasttext_format(embeddings_path)
     '''
 
-    def make_embeddings_lmdb(self, name="fasttext-crawl", hasHeader=True):
-        nbWords = 0
+    def make_embeddings_lmdb(self, name="fasttext-crawl", hasHeader=True, dtype='float32'):
         print('\nCompiling embeddings... (this is done only one time per embeddings at first launch)')
-        begin = True
         description = self._get_description(name)
         if description is not None:
             embeddings_path = description["path"]
@@ -177,67 +274,22 @@ class Embeddings(object):
             print("path:", embeddings_path)
             if embeddings_type == "glove":
                 hasHeader = False
-            txn = self.env.begin(write=True)
-            # batch_size = 1024
-            i = 0
-            nb_lines = 0
-            with open(embeddings_path, encoding='utf8') as f:
-                for line in f:
-                    nb_lines += 1
-
-            with open(embeddings_path, encoding='utf8') as f:
-                for line in tqdm(f, total=nb_lines):
-                    line = line.split(' ')
-                    if begin:
-                        if hasHeader:
-                            # first line gives the nb of words and the embedding size
-                            nbWords = int(line[0])
-                            self.embed_size = int(line[1].replace("\n", ""))
-                            begin = False
-                            continue
-                        else:
-                            begin = False
-                    word = line[0]
-                    #if embeddings_type == 'glove':
-                    try:
-                        if line[len(line)-1] == '\n':
-                            vector = np.array([float(val) for val in line[1:len(line)-1]], dtype='float32')
-                        else:
-                            vector = np.array([float(val) for val in line[1:len(line)]], dtype='float32')
-                    
-                        #vector = np.array([float(val) for val in line[1:len(line)]], dtype='float32')
-                    except:
-                        print(len(line))
-                        print(line[1:len(line)])
-                    #else:
-                    #    vector = np.array([float(val) for val in line[1:len(line)-1]], dtype='float32')
-                    if self.embed_size == 0:
-                        self.embed_size = len(vector)
-
-                    if len(word.encode(encoding='UTF-8')) < self.env.max_key_size():   
-                        txn.put(word.encode(encoding='UTF-8'), _serialize_pickle(vector))  
-                        #txn.put(word.encode(encoding='UTF-8'), _serialize_byteio(vector))
-                        i += 1
-
-                    # commit batch
-                    # if i % batch_size == 0:
-                    #     txn.commit()
-                    #     txn = self.env.begin(write=True)
-
-            #if i % batch_size != 0:
-            txn.commit()   
-            if nbWords == 0:
-                nbWords = i
-            self.vocab_size = nbWords
-            print('embeddings loaded for', nbWords, "words and", self.embed_size, "dimensions")
+            self.vocab_size, self.embed_size = compile_embeddings_lmdb(self.env, embeddings_path, hasHeader, dtype)
+            self.lmdb_format = lmdb_format_version
+            self.lmdb_dtype = dtype
+            print('embeddings loaded for', self.vocab_size, "words and", self.embed_size, "dimensions")
 
     def make_embeddings_simple(self, name="fasttext-crawl", hasHeader=True):
         description = self._get_description(name)
         if description is not None:
             self.extension = description["format"]
 
+        if self.use_server and description is not None and description.get("server") is not None:
+            if self.make_embeddings_client(name, description["server"]):
+                return
+
         if self.extension == "bin":
-            if fasttext_support == True:
+            if _import_fasttext() is not None:
                 print("embeddings are of .bin format, so they will be loaded in memory...")
                 self.make_embeddings_simple_in_memory(name, hasHeader)
             else:
@@ -249,6 +301,8 @@ class Embeddings(object):
         elif self.embedding_lmdb_path is None or self.embedding_lmdb_path == "None":
             print("embedding_lmdb_path is not specified in the embeddings registry, so the embeddings will be loaded in memory...")
             self.make_embeddings_simple_in_memory(name, hasHeader)
+        elif description is not None and description.get("storage", "lmdb") == "mmap":
+            self.make_embeddings_mmap(name, hasHeader)
         else:    
             # if the path to the lmdb database files does not exist, we create it
             if not os.path.isdir(self.embedding_lmdb_path):
@@ -265,35 +319,180 @@ class Embeddings(object):
                     self.lang = description["lang"]
 
                 # open the database in read mode
-                self.env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=4)
-                if self.env:
+                env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=4)
+                if env:
                     # we need to set self.embed_size and self.vocab_size
-                    with self.env.begin() as txn:
-                        stats = txn.stat()
-                        size = stats['entries']
-                        self.vocab_size = size
-
-                    with self.env.begin() as txn:
-                        cursor = txn.cursor()
-                        for key, value in cursor:
-                            vector = _deserialize_pickle(value)
-                            self.embed_size = vector.shape[0]
-                            break
-                        cursor.close()
-
+                    with env.begin() as txn:
+                        meta = _read_lmdb_meta(txn)
+                        if _read_lmdb_progress(txn) is not None:
+                            # interrupted compilation, it will be resumed
+                            print("embeddings database", envFilePath, "is incomplete")
+                        elif meta is not None:
+                            self.lmdb_format = meta["format"]
+                            self.lmdb_dtype = meta["dtype"]
+                            self.vocab_size = meta["vocab_size"]
+                            self.embed_size = meta["embed_size"]
+                            if description is not None and description.get("dtype", "float32") != self.lmdb_dtype:
+                                print("Warning: embeddings database", envFilePath, "uses", self.lmdb_dtype, "values, convert it with:")
+                                print("\tpython3 -m delft.utilities.Embeddings migrate --embedding", name, "--dtype", description.get("dtype", "float32"))
+                        else:
+                            # legacy database with pickled vectors and without metadata
+                            self.lmdb_format = 0
+                            stats = txn.stat()
+                            size = stats['entries']
+                            self.vocab_size = size
+
+                            cursor = txn.cursor()
+                            for key, value in cursor:
+                                vector = _deserialize_pickle(value)
+                                self.embed_size = vector.shape[0]
+                                break
+                            cursor.close()
+                            print("Warning: embeddings database", envFilePath, "uses the legacy pickle layout, migrate it for faster lookups with:")
+                            print("\tpython3 -m delft.utilities.Embeddings migrate --embedding", name)
+
+                    env.close()
                     if self.vocab_size != 0 and self.embed_size != 0:
                         load_db = False
-
-                        # no idea why, but we need to close and reopen the environment to avoid
-                        # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-                        # when opening new transaction !
-                        self.env.close()
-                        self.env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=2)
+                        # the lookups use an environment opened by each process
+                        self.env = ProcessLocalEnvironment(envFilePath, readonly=True, max_readers=2048)
 
             if load_db: 
                 # create and load the database in write mode
                 self.env = lmdb.open(envFilePath, map_size=map_size)
-                self.make_embeddings_lmdb(name, hasHeader)
+                dtype = 'float32'
+                if description is not None:
+                    dtype = description.get("dtype", "float32")
+                self.make_embeddings_lmdb(name, hasHeader, dtype)
+                self.env.close()
+                self.env = ProcessLocalEnvironment(envFilePath, readonly=True, max_readers=2048)
+
+        if self.extension != "bin" and self.embedding_lmdb_path is not None and self.embedding_lmdb_path != "None":
+            if description is not None and description.get("path-bin") is not None:
+                self.make_subwords(name)
+
+    def make_embeddings_client(self, name, socket_path):
+        """
+        Use the embeddings served by a local embeddings server on the given unix socket, if the 
+        server is running. Return False if it is not the case. 
+        """
+        if not os.path.exists(socket_path):
+            return False
+        from delft.utilities.EmbeddingsServer import EmbeddingsClient
+        try:
+            self.client = EmbeddingsClient(socket_path)
+        except OSError as e:
+            print("Warning: embeddings server", socket_path, "not available:", e)
+            return False
+        self.lang = self.client.info["lang"]
+        self.vocab_size = self.client.info["vocab_size"]
+        self.embed_size = self.client.info["embed_size"]
+        print('embeddings served by', socket_path, 'for', self.vocab_size, "words and", self.embed_size, "dimensions")
+        return True
+
+    def make_subwords(self, name="fasttext-crawl"):
+        """
+        Open the char n-gram vectors used to build the vectors of unknown words, compiling them 
+        first from the fastText .bin model of the embeddings (registry attribute "path-bin") if 
+        necessary. The n-gram vectors are memory-mapped, so the fastText model is never loaded.
+        """
+        description = self._get_description(name)
+        storeFilePath = os.path.join(self.embedding_lmdb_path, name + '.subwords')
+        if not os.path.isfile(os.path.join(storeFilePath, mmap_meta_file)):
+            print('\nCompiling subword vectors... (this is done only one time per embeddings at first launch)')
+            print("path:", description["path-bin"])
+            compile_subwords(description["path-bin"], storeFilePath, description.get("dtype", "float32"))
+        self.subwords = SubwordVectors(storeFilePath)
+        print('subword vectors mapped for', self.subwords.bucket, "n-gram buckets")
+
+    def make_embeddings_mmap(self, name="fasttext-crawl", hasHeader=True):
+        """
+        Open the memory-mapped matrix store of the embeddings, compiling it first if necessary. 
+        The matrix pages are shared via the page cache by all the processes using the same 
+        embeddings on a host.
+        """
+        description = self._get_description(name)
+        if description is None:
+            return
+        self.lang = description["lang"]
+        if not os.path.isdir(self.embedding_lmdb_path):
+            os.makedirs(self.embedding_lmdb_path)
+
+        storeFilePath = os.path.join(self.embedding_lmdb_path, name + '.mmap')
+        dtype = description.get("dtype", "float32")
+        metaFilePath = os.path.join(storeFilePath, mmap_meta_file)
+        if os.path.isfile(metaFilePath):
+            with open(metaFilePath) as f:
+                if json.load(f)["dtype"] != dtype:
+                    # the value type of the registry entry has changed, the store is compiled again
+                    print("embeddings store", storeFilePath, "does not use", dtype, "values")
+                    os.remove(metaFilePath)
+        if not os.path.isfile(metaFilePath):
+            print('\nCompiling embeddings... (this is done only one time per embeddings at first launch)')
+            embeddings_path = description["path"]
+            print("path:", embeddings_path)
+            if description["type"] == "glove":
+                hasHeader = False
+            compile_embeddings_mmap(embeddings_path, storeFilePath, hasHeader, dtype)
+
+        self.matrix, self.scales, self.vocabulary, meta = open_embeddings_mmap(storeFilePath)
+        self.vocab_size = meta["vocab_size"]
+        self.embed_size = meta["embed_size"]
+        print('embeddings mapped for', self.vocab_size, "words and", self.embed_size, "dimensions")
+
+    def make_embeddings_subset(self, subset_path):
+        """
+        Open a pruned subset of the static embeddings saved with a model (see save_subset())
+        """
+        self.matrix, self.scales, self.vocabulary, meta = open_embeddings_mmap(subset_path)
+        self.lang = meta.get("lang", self.lang)
+        self.vocab_size = meta["vocab_size"]
+        self.embed_size = meta["embed_size"]
+        print('embeddings subset mapped for', self.vocab_size, "words and", self.embed_size, "dimensions")
+
+    def save_subset(self, subset_path, words=(), top_n=0):
+        """
+        Save as a memory-mapped store the static embeddings of the given words (typically all 
+        the tokens seen in training) and of the top_n most frequent words of the source 
+        embeddings. Words without vector are not saved.
+        """
+        selected = set()
+        for word in words:
+            if (self.name == 'wiki.fr') or (self.name == 'wiki.fr.bin'):
+                # the pre-trained embeddings are not cased
+                word = word.lower()
+            selected.add(word)
+        selected.update(self.get_top_words(top_n))
+        selected = list(selected)
+
+        vectors = self.get_word_vectors(selected)
+        known = np.any(vectors != 0, axis=1)
+        selected = [word for word, is_known in zip(selected, known) if is_known]
+        write_embeddings_mmap(subset_path, selected, vectors[known], name=self.name, lang=self.lang)
+        print('embeddings subset saved for', len(selected), "words and", vectors.shape[1], "dimensions")
+
+    def get_top_words(self, top_n):
+        """
+        Return the top_n first words of the source embeddings, which are ranked by decreasing 
+        frequency in the usual distributions (fastText, GloVe, word2vec)
+        """
+        if top_n <= 0:
+            return []
+        if self.extension == 'bin' and self.subset_path is None:
+            return self.model.get_words()[:top_n]
+        description = self._get_description(self.name)
+        if description is None or not os.path.isfile(description["path"]):
+            print("Warning: source file of the embeddings", self.name, "not available, top words cannot be selected")
+            return []
+        embeddings_path = description["path"]
+        hasHeader = description["type"] != "glove"
+        nb_words, embed_size = _read_embeddings_header(embeddings_path, hasHeader)
+        words = []
+        for block_words, _ in _iter_vector_blocks(embeddings_path, embed_size, hasHeader, min(top_n, 10000)):
+            words.extend(block_words)
+            if len(words) >= top_n:
+                break
+        return words[:top_n]
 
     def make_ELMo(self):
         # Location of pretrained BiLM for the specified language
@@ -307,19 +506,187 @@ class Embeddings(object):
 
             print('init ELMo')
 
+            import tensorflow as tf
+            from delft.utilities.bilm.data import Batcher
+            from delft.utilities.bilm.model import BidirectionalLanguageModel
+            from delft.utilities.bilm.elmo import weight_layers
+
             # Create a Batcher to map text to character ids
             self.batcher = Batcher(vocab_file, 50)
 
-            # Build the biLM graph.
-            self.bilm = BidirectionalLanguageModel(options_file, weight_file)
+            # with "token-embeddings", the token layer is precomputed for the training and the 
+            # frequent words, see dump_ELMo_token_embeddings
+            self.ELMo_token_embeddings = description.get("token-embeddings", False)
+            self.ELMo_tokens_top_n = description.get("token-embeddings-top-n", ELMo_tokens_top_n)
+
+            # the biLM has its own graph and a session kept for all the batches
+            self.ELMo_graph = tf.Graph()
+            with self.ELMo_graph.as_default():
+                # Build the biLM graph.
+                self.bilm = BidirectionalLanguageModel(options_file, weight_file, 
+                    use_token_embedding_inputs=self.ELMo_token_embeddings)
+
+                # Input placeholders to the biLM.
+                self.character_ids = tf.placeholder('int32', shape=(None, None, 50))
+
+                with tf.variable_scope('', reuse=tf.AUTO_REUSE):
+                    # the reuse=True scope reuses weights from the whole context 
+                    self.embeddings_op = self.bilm(self.character_ids)
+                    self.elmo_input = weight_layers('input', self.embeddings_op, l2_coef=0.0)
+
+                # the LSTM of the biLM are stateful, the states after the warm-up are saved to 
+                # start each batch from the same states (see run_ELMo)
+                lm_graph = self.bilm._graphs[self.character_ids]
+                self.ELMo_lm_graph = lm_graph
+                self.ELMo_token_size = lm_graph.options['lstm']['projection_dim']
+                state_variables = []
+                for direction in ['forward', 'backward']:
+                    for states in lm_graph.lstm_init_states[direction]:
+                        state_variables.extend(states)
+                saved_states = [tf.Variable(tf.zeros(state.shape), trainable=False) for state in state_variables]
+                self.ELMo_save_states = tf.group(*[tf.assign(saved, state) for saved, state in zip(saved_states, state_variables)])
+                self.ELMo_restore_states = tf.group(*[tf.assign(state, saved) for saved, state in zip(saved_states, state_variables)])
+
+                config = tf.ConfigProto(
+                    intra_op_parallelism_threads=description.get("intra-op-threads", 0),
+                    inter_op_parallelism_threads=description.get("inter-op-threads", 0))
+                self.ELMo_session = tf.Session(graph=self.ELMo_graph, config=config)
+                # It is necessary to initialize variables once before running inference
+                self.ELMo_session.run(tf.global_variables_initializer())
+
+            self.ELMo_lock = threading.Lock()
+
+            self.ELMo_token_vocabulary = None
+            if self.ELMo_token_embeddings:
+                self.ELMo_tokens_path = os.path.join(description["path-cache"], ELMo_tokens_dir)
+                # constant token layer of the sentence boundaries and of the padding
+                boundary_ids = self.batcher.batch_sentences([[]])
+                self.ELMo_boundary_vectors = self.compute_ELMo_token_vectors(boundary_ids)[0]
+                padding_ids = np.zeros((1, 1, boundary_ids.shape[2]), dtype=boundary_ids.dtype)
+                self.ELMo_padding_vector = self.compute_ELMo_token_vectors(padding_ids)[0, 0]
+                self.load_ELMo_token_embeddings()
+
+            # heavy warm-up of the LSTM states, done only one time: as the first run of each 
+            # batch of the former new session per batch, on a fixed batch
+            warm_up_ids = self.batcher.batch_sentences([['This', 'is', 'a', 'warm', 'up', 'sentence', '.']] * self.bilm._max_batch_size)
+            self.ELMo_session.run(self.elmo_input['weighted_op'], feed_dict=self._ELMo_feed_dict(warm_up_ids))
+            self.ELMo_session.run(self.ELMo_save_states)
+
+    def compute_ELMo_token_vectors(self, local_token_ids):
+        """
+            Context-independent token layer of the biLM (char CNN) for a batch of character ids
+        """
+        with self.ELMo_lock:
+            return self.ELMo_session.run(self.embeddings_op['token_embeddings'], 
+                feed_dict=self._ELMo_feed_dict(local_token_ids))
 
-            # Input placeholders to the biLM.
-            self.character_ids = tf.placeholder('int32', shape=(None, None, 50))
+    def load_ELMo_token_embeddings(self):
+        """
+            Load the precomputed token layer of ELMo, if already dumped
+        """
+        vocab_path = os.path.join(self.ELMo_tokens_path, ELMo_tokens_vocab_file)
+        embeddings_path = os.path.join(self.ELMo_tokens_path, ELMo_tokens_embeddings_file)
+        if not os.path.isfile(vocab_path) or not os.path.isfile(embeddings_path):
+            return
+        with codecs.open(vocab_path, 'r', 'utf8') as vocab_file:
+            words = [line.rstrip('\n') for line in vocab_file]
+        with h5py.File(embeddings_path, 'r') as embeddings_file:
+            self.ELMo_token_vectors = embeddings_file['embedding'][...]
+        # the boundaries are not looked up as words
+        self.ELMo_token_vocabulary = {}
+        for row in range(len(ELMo_boundary_tokens), len(words)):
+            self.ELMo_token_vocabulary[words[row]] = row
+        print('ELMo token layer precomputed for', len(self.ELMo_token_vocabulary), 'words')
+
+    def dump_ELMo_token_embeddings(self, words=(), top_n=None, batch_size=1024):
+        """
+            Precompute the context-independent token layer of ELMo for the given words (e.g. the 
+            training vocabulary) and the top_n most frequent words of the static embeddings, in 
+            addition to the words already precomputed. ELMo then runs the char CNN only for the 
+            other words. Nothing is done if "token-embeddings" is not set for ELMo.
+        """
+        if not self.use_ELMo or not self.ELMo_token_embeddings:
+            return
+        if top_n is None:
+            top_n = self.ELMo_tokens_top_n
+        known_words = set(ELMo_boundary_tokens)
+        if self.ELMo_token_vocabulary is not None:
+            known_words.update(self.ELMo_token_vocabulary)
+        new_words = []
+        for word in chain(words, self.get_top_words(top_n)):
+            # one word per line in the vocabulary file
+            if len(word) == 0 or word in known_words or '\n' in word:
+                continue
+            known_words.add(word)
+            new_words.append(word)
+        if len(new_words) == 0:
+            return
 
-            with tf.variable_scope('', reuse=tf.AUTO_REUSE):
-                # the reuse=True scope reuses weights from the whole context 
-                self.embeddings_op = self.bilm(self.character_ids)
-                self.elmo_input = weight_layers('input', self.embeddings_op, l2_coef=0.0)
+        print('precomputing ELMo token layer for', len(new_words), 'words')
+        if self.ELMo_token_vocabulary is None:
+            all_words = list(ELMo_boundary_tokens)
+            vectors = [self.ELMo_boundary_vectors]
+        else:
+            all_words = [None] * len(self.ELMo_token_vectors)
+            for i, boundary in enumerate(ELMo_boundary_tokens):
+                all_words[i] = boundary
+            for word, row in self.ELMo_token_vocabulary.items():
+                all_words[row] = word
+            vectors = [self.ELMo_token_vectors]
+        for start in tqdm(range(0, len(new_words), batch_size)):
+            # each word as a sentence of one token, without the boundaries
+            local_token_ids = self.batcher.batch_sentences([[word] for word in new_words[start:start+batch_size]])
+            vectors.append(self.compute_ELMo_token_vectors(local_token_ids[:, 1:2, :])[:, 0, :])
+        all_words.extend(new_words)
+
+        if not os.path.exists(self.ELMo_tokens_path):
+            os.makedirs(self.ELMo_tokens_path)
+        with codecs.open(os.path.join(self.ELMo_tokens_path, ELMo_tokens_vocab_file), 'w', 'utf8') as vocab_file:
+            for word in all_words:
+                vocab_file.write(word + '\n')
+        with h5py.File(os.path.join(self.ELMo_tokens_path, ELMo_tokens_embeddings_file), 'w') as embeddings_file:
+            embeddings_file.create_dataset('embedding', data=np.concatenate(vectors).astype(np.float32))
+        self.load_ELMo_token_embeddings()
+
+    def _ELMo_feed_dict(self, local_token_ids, token_list=None):
+        """
+            Feed of the biLM for a batch of character ids. With precomputed token embeddings, the 
+            token layer of the sentence boundaries, the padding and the precomputed words of the 
+            token list is fed, the char CNN runs only for the other words.
+        """
+        feed_dict = {self.character_ids: local_token_ids}
+        if not self.ELMo_token_embeddings:
+            return feed_dict
+        shape = local_token_ids.shape[:2]
+        precomputed = np.zeros(shape, dtype=bool)
+        token_vectors = np.zeros(shape + (self.ELMo_token_size,), dtype=np.float32)
+        if token_list is not None:
+            lengths = np.array([len(tokens) for tokens in token_list], dtype=np.int64)
+            sentence_indices = np.arange(len(token_list))
+            token_vectors[sentence_indices, 0] = self.ELMo_boundary_vectors[0]
+            token_vectors[sentence_indices, lengths+1] = self.ELMo_boundary_vectors[1]
+            precomputed[sentence_indices, 0] = True
+            precomputed[sentence_indices, lengths+1] = True
+            padding = np.arange(shape[1])[None, :] > (lengths+1)[:, None]
+            token_vectors[padding] = self.ELMo_padding_vector
+            precomputed |= padding
+            if self.ELMo_token_vocabulary is not None:
+                sentence_indices = []
+                positions = []
+                rows = []
+                for i, tokens in enumerate(token_list):
+                    for j, token in enumerate(tokens):
+                        row = self.ELMo_token_vocabulary.get(token)
+                        if row is not None:
+                            sentence_indices.append(i)
+                            # the first position is the beginning of sentence
+                            positions.append(j+1)
+                            rows.append(row)
+                token_vectors[sentence_indices, positions] = self.ELMo_token_vectors[rows]
+                precomputed[sentence_indices, positions] = True
+        feed_dict[self.ELMo_lm_graph.precomputed_placeholder] = precomputed
+        feed_dict[self.ELMo_lm_graph.token_embeddings_placeholder] = token_vectors
+        return feed_dict
 
     def make_BERT(self):
         # Location of BERT model
@@ -332,13 +699,33 @@ class Embeddings(object):
 
             print('init BERT')
 
-            # load the pretrained model
+            import keras
+            import keras.backend as K
+            from keras_bert import get_model, load_model_weights_from_checkpoint, Tokenizer
+
+            # load the pretrained model, built with inputs of variable length (the checkpoint 
+            # loader of keras-bert fixes them to the 512 positions of the model)
+            with open(config_file, 'r') as reader:
+                config = json.load(reader)
             with self.graph.as_default():
             #    with self.session.as_default():
             #with tf.variable_scope('', reuse=tf.AUTO_REUSE):
-                self.bert_model = load_trained_model_from_checkpoint(config_file, weight_file)
+                inputs, outputs = get_model(
+                    token_num=config['vocab_size'],
+                    pos_num=config['max_position_embeddings'],
+                    seq_len=None,
+                    embed_dim=config['hidden_size'],
+                    transformer_num=config['num_hidden_layers'],
+                    head_num=config['num_attention_heads'],
+                    feed_forward_dim=config['intermediate_size'],
+                    training=False,
+                    trainable=False)
+                self.bert_model = keras.models.Model(inputs=inputs, outputs=outputs)
+                load_model_weights_from_checkpoint(self.bert_model, config, weight_file, training=False)
                 self.bert_model.summary(line_length=120)
                 self.bert_model._make_predict_function()
+            # None if the model accepts inputs of variable length
+            self.bert_input_size = K.int_shape(self.bert_model.inputs[0])[1]
 
             # init the tokenizer
             token_dict = {}
@@ -347,9 +734,21 @@ class Embeddings(object):
                     token = line.strip()
                     token_dict[token] = len(token_dict)
             print('token_dict size:', len(token_dict))
+            self.bert_token_dict = token_dict
             self.bert_tokenizer = Tokenizer(token_dict, cased=True)
 
 
+    def make_contextual_cache(self, description, model_paths, embed_size, options=()):
+        """
+            Open the persistent cache of a contextual model, if a budget is given in its description
+        """
+        max_size = description.get("persistent-cache-size", 0)
+        if max_size <= 0 or "path-cache" not in description:
+            return None
+        cache_path = os.path.join(description["path-cache"], contextual_cache_dir)
+        return ContextualCache(cache_path, contextual_model_fingerprint(model_paths, options), embed_size, 
+            int(max_size * 1024 * 1024), description.get("cache-dtype", 'float32'))
+
     def get_sentence_vector_only_ELMo(self, token_list):
         """
             Return the ELMo embeddings only for a full sentence
@@ -361,31 +760,55 @@ class Embeddings(object):
 
         # Create batches of data
         local_token_ids = self.batcher.batch_sentences(token_list)
+        return self.get_ELMo_vectors(token_list, local_token_ids)
+
+    def get_ELMo_vectors(self, token_list, local_token_ids):
+        """
+            ELMo embeddings of a batch of sentences, the sentences not in the caches are 
+            computed together and then cached
+        """
         max_size_sentence = local_token_ids[0].shape[0]
         # check lmdb cache
-        elmo_result = self.get_ELMo_lmdb_vector(token_list, max_size_sentence)
-        if elmo_result is not None:
+        elmo_result, missing = self.get_ELMo_lmdb_vector(token_list, max_size_sentence)
+        if len(missing) > 0 and self.ELMo_persistent_cache is not None:
+            results = self.ELMo_persistent_cache.get([token_list[i] for i in missing])
+            still_missing = []
+            for i, result in zip(missing, results):
+                if result is None:
+                    still_missing.append(i)
+                else:
+                    length = min(result.shape[0], max_size_sentence-2)
+                    elmo_result[i][:length] = result[:length]
+            missing = still_missing
+        self.lookup_stats.add(ELMo_sentences=len(token_list), ELMo_cache_hits=len(token_list)-len(missing))
+        if len(missing) == 0:
             return elmo_result
 
-        with tf.Session() as sess:
-            # weird, for this cpu is faster than gpu (1080Ti !)
-            with tf.device("/cpu:0"):
-                # It is necessary to initialize variables once before running inference
-                sess.run(tf.global_variables_initializer())
-
-                # Compute ELMo representations (2 times as a heavy warm-up)
-                elmo_result = sess.run(
-                    self.elmo_input['weighted_op'],
-                    feed_dict={self.character_ids: local_token_ids}
-                )
-                elmo_result = sess.run(
-                    self.elmo_input['weighted_op'],
-                    feed_dict={self.character_ids: local_token_ids}
-                )
-                #cache computation
-                self.cache_ELMo_lmdb_vector(token_list, elmo_result)
+        # Compute ELMo representations of the missing sentences only
+        missing_token_list = [token_list[i] for i in missing]
+        if len(missing) < len(token_list):
+            local_token_ids = self.batcher.batch_sentences(missing_token_list)
+        missing_result = self.run_ELMo(local_token_ids, missing_token_list)
+        elmo_result[missing, :missing_result.shape[1]] = missing_result
+        #cache computation
+        self.cache_ELMo_lmdb_vector(missing_token_list, missing_result)
+        self.cache_ELMo_persistent_vector(missing_token_list, missing_result)
         return elmo_result
 
+    def run_ELMo(self, local_token_ids, token_list=None):
+        """
+            Run the biLM once on a batch of character ids with the persistent session, starting 
+            from the saved warmed-up LSTM states. With the token list of the batch, the 
+            precomputed token embeddings are used for its known words.
+        """
+        feed_dict = self._ELMo_feed_dict(local_token_ids, token_list)
+        with self.ELMo_lock:
+            start = time.perf_counter()
+            self.ELMo_session.run(self.ELMo_restore_states)
+            result = self.ELMo_session.run(self.elmo_input['weighted_op'], feed_dict=feed_dict)
+            self.lookup_stats.add(ELMo_forward_calls=1, ELMo_forward_time=time.perf_counter()-start)
+        return result
+
     def get_sentence_vector_with_ELMo(self, token_list):
         """
             Return a concatenation of standard embeddings (e.g. Glove) and ELMo embeddings 
@@ -395,42 +818,10 @@ class Embeddings(object):
             print("Warning: ELMo embeddings requested but embeddings object wrongly initialised")
             return
 
-        #print("\ntoken_list:", token_list)
         local_token_ids = self.batcher.batch_sentences(token_list)
-        #print("local_token_ids:", local_token_ids)
-        max_size_sentence = local_token_ids[0].shape[0]
+        elmo_result = self.get_ELMo_vectors(token_list, local_token_ids)
 
-        elmo_result = self.get_ELMo_lmdb_vector(token_list, max_size_sentence) 
-        if elmo_result is None:
-            with tf.Session() as sess:
-                # weird, for this cpu is faster than gpu (1080Ti !)
-                with tf.device("/cpu:0"):
-                    # It is necessary to initialize variables once before running inference
-                    sess.run(tf.global_variables_initializer())
-
-                    # Compute ELMo representations (2 times as a heavy warm-up)
-                    elmo_result = sess.run(
-                        self.elmo_input['weighted_op'],
-                        feed_dict={self.character_ids: local_token_ids}
-                    )
-                    elmo_result = sess.run(
-                        self.elmo_input['weighted_op'],
-                        feed_dict={self.character_ids: local_token_ids}
-                    )
-                    #cache computation
-                    self.cache_ELMo_lmdb_vector(token_list, elmo_result)
-        
-        concatenated_result = np.zeros((len(token_list), max_size_sentence-2, self.embed_size), dtype=np.float32)
-        #concatenated_result = np.random.rand(elmo_result.shape[0], max_size_sentence-2, self.embed_size)
-        for i in range(0, len(token_list)):
-            for j in range(0, len(token_list[i])):
-                #if is_int(token_list[i][j]) or is_float(token_list[i][j]):
-                #dummy_result = np.zeros((elmo_result.shape[2]), dtype=np.float32)
-                #concatenated_result[i][j] = np.concatenate((dummy_result, self.get_word_vector(token_list[i][j])), )
-                #else:
-                concatenated_result[i][j] = np.concatenate((elmo_result[i][j], self.get_word_vector(token_list[i][j]).astype('float32')), )
-                #concatenated_result[i][j] = np.concatenate((self.get_word_vector(token_list[i][j]), elmo_result[i][j]), )
-        return concatenated_result
+        return self.concatenate_static_vectors(token_list, elmo_result)
 
 
     def get_sentence_vector_only_BERT(self, token_list):
@@ -441,70 +832,121 @@ class Embeddings(object):
             print("Warning: BERT embeddings requested but embeddings object wrongly initialised")
             return
 
-        #print("local_token_ids:", local_token_ids)
         max_size_token_list = 0
         for i, sentence in enumerate(token_list):
             if len(sentence) > max_size_token_list:
                 max_size_token_list = len(sentence)
 
-        # retokenize with BERT tokenizer
-        max_size = BERT_sentence_size
-        max_size_sentence = 0
-        new_token_list = []
-        bert_results = np.zeros((len(token_list), max_size, BERT_embed_size), dtype=np.float32)
-        for i, sentence in enumerate(token_list):                        
-            local_text = " ".join(sentence)
-            local_tokens = self.bert_tokenizer.tokenize(local_text)
-
-            bert_result = self.get_BERT_lmdb_vector(sentence) 
+        # vectors realigned on the provided tokens, cached vectors at the true length of the 
+        # sentences are padded directly in the batch tensor
+        bert_results = np.zeros((len(token_list), max_size_token_list, BERT_embed_size), dtype=np.float32)
+        cached_results = [None] * len(token_list)
+        if self.BERT_persistent_cache is not None:
+            cached_results = self.BERT_persistent_cache.get(token_list)
+        # the sentences not in the persistent cache are looked up together in the training cache
+        lookup = [i for i, bert_result in enumerate(cached_results) if bert_result is None]
+        for i, bert_result in zip(lookup, self.get_BERT_lmdb_vector([token_list[i] for i in lookup])):
+            cached_results[i] = bert_result
+        missing = []
+        for i, bert_result in enumerate(cached_results):
             if bert_result is None:
-                indices, segments = self.bert_tokenizer.encode(local_text, max_len=max_size)
-                with self.graph.as_default():
-                    bert_result = self.bert_model.predict([np.array([indices]), np.array([segments])])[0]
-                    #cache computation
-                    if bert_result is not None:
-                        self.cache_BERT_lmdb_vector(sentence, bert_result)
-            
-            # Realign BERT tokenization with the provided tokenization. Normally BERT segmenter always
-            # over-segment as compared to DeLFT segmenter. 
-            # There are two obvious possibilities to combine subtoken embeddings into token embeddings,
-            # either take the embeddings of the last subtoken, of use the average vector of the subtokens.
-            new_bert_result = np.zeros((max_size, BERT_embed_size), dtype=np.float32)
-            token_tensor = []
-            tid = 0
-            buffer = ''
-            #print(sentence)
-            #print(local_tokens)
-            for j, t in enumerate(local_tokens):
-                if j>=max_size:
-                    break
-                if t == '[CLS]' or t == '[SEP]':
-                    continue
-                else:
-                    if t.startswith('##'):
-                        t = t[2:]
-                    buffer += t
-                    #print(buffer)
-                    token_tensor.append(bert_result[j])
-                    if buffer == sentence[tid]:
-                        # average vector of the subtokens
-                        new_bert_result[tid] = np.stack(token_tensor).mean(axis=0)
-                        # or last subtoken vector
-                        #new_bert_result[tid] = token_tensor[-1]
-                        token_tensor = []
-                        buffer = ''
-                        tid += 1    
-            bert_result = new_bert_result
-
-            if bert_result is not None:
-                bert_results[i] = bert_result
-            
-        # we need to squeze the vector to max_size_token_list
-        squeezed_bert_results = np.zeros((len(token_list), max_size_token_list, BERT_embed_size), dtype=np.float32)
-        for i, sentence in enumerate(token_list):
-            squeezed_bert_results[i] = bert_results[i][:max_size_token_list]
-
-        return squeezed_bert_results
+                missing.append(i)
+            else:
+                bert_results[i][:bert_result.shape[0]] = bert_result
+        self.lookup_stats.add(BERT_sentences=len(token_list), BERT_cache_hits=len(token_list)-len(missing))
+
+        if len(missing) == 0:
+            return bert_results
+
+        # the sentences not cached are extracted together with a single prediction
+        new_sentences = [token_list[i] for i in missing]
+        local_tokens = []
+        token_maps = []
+        for sentence in new_sentences:
+            sentence_tokens, token_map = self.tokenize_BERT(sentence)
+            local_tokens.append(sentence_tokens)
+            token_maps.append(token_map)
+        new_results = self.realign_BERT(token_maps, self.extract_BERT(local_tokens), 
+            [len(sentence) for sentence in new_sentences])
+        bert_results[missing, :new_results.shape[1]] = new_results
+        new_results = [new_results[k][:len(sentence)] for k, sentence in enumerate(new_sentences)]
+        #cache computation
+        self.cache_BERT_lmdb_vector(new_sentences, new_results)
+        if self.BERT_persistent_cache is not None:
+            self.BERT_persistent_cache.put(new_sentences, new_results)
+
+        return bert_results
+
+    def tokenize_BERT(self, sentence):
+        """
+            Retokenize a sentence with the BERT tokenizer, including [CLS] and [SEP] and truncated 
+            to the maximum BERT sequence size. Return also the index of the provided token of each 
+            subtoken, -1 for [CLS] and [SEP].
+        """
+        local_tokens = ['[CLS]']
+        token_map = [-1]
+        for i, token in enumerate(sentence):
+            # the BERT tokenizer adds [CLS] and [SEP]
+            subtokens = self.bert_tokenizer.tokenize(token)[1:-1]
+            local_tokens.extend(subtokens)
+            token_map.extend([i] * len(subtokens))
+            if len(local_tokens) >= BERT_sentence_size-1:
+                break
+        local_tokens = local_tokens[:BERT_sentence_size-1] + ['[SEP]']
+        token_map = token_map[:BERT_sentence_size-1] + [-1]
+        return local_tokens, np.array(token_map, dtype=np.int64)
+
+    def extract_BERT(self, token_lists):
+        """
+            Run BERT on a batch of retokenized sentences, padded to the bucket length of the longest 
+            one when the model accepts variable length inputs, return the embeddings of the subtokens
+        """
+        max_length = self.bert_input_size
+        if max_length is None:
+            max_length = _bucket_length(max([len(local_tokens) for local_tokens in token_lists]), BERT_length_buckets)
+        unknown_index = self.bert_token_dict.get('[UNK]', 0)
+        # padding index is 0 as with the BERT tokenizer encoding, the padding is masked
+        indices = np.zeros((len(token_lists), max_length), dtype='int32')
+        for i, local_tokens in enumerate(token_lists):
+            indices[i, :len(local_tokens)] = [self.bert_token_dict.get(t, unknown_index) for t in local_tokens]
+        segments = np.zeros((len(token_lists), max_length), dtype='int32')
+        start = time.perf_counter()
+        with self.graph.as_default():
+            result = self.bert_model.predict([indices, segments], batch_size=len(token_lists))
+        self.lookup_stats.add(BERT_forward_calls=1, BERT_forward_time=time.perf_counter()-start)
+        return result
+
+    def realign_BERT(self, token_maps, bert_results, lengths):
+        """
+            Realign the BERT embeddings of the subtokens of a batch of sentences with their 
+            provided tokens, as a (nb sentences, max sentence length, BERT embed size) tensor. The 
+            subtokens of a token are pooled according to the "subtoken-pooling" policy: the first 
+            subtoken, the last one or the average of the subtokens (default).
+        """
+        max_length = max(lengths)
+        results = np.zeros((len(token_maps), max_length, BERT_embed_size), dtype=np.float32)
+        # positions of the subtokens of all the provided tokens, in sentence and token order
+        sentence_indices = np.concatenate([np.full(len(token_map), i, dtype=np.int64) for i, token_map in enumerate(token_maps)])
+        subtoken_indices = np.concatenate([np.arange(len(token_map)) for token_map in token_maps])
+        token_indices = np.concatenate(token_maps)
+        selected = token_indices >= 0
+        sentence_indices = sentence_indices[selected]
+        subtoken_indices = subtoken_indices[selected]
+        rows = sentence_indices * max_length + token_indices[selected]
+        if len(rows) == 0:
+            return results
+        # subtokens of the same token are contiguous, a segment starts at each change of row
+        starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+        ends = np.append(starts[1:], len(rows))
+        subtoken_vectors = bert_results[sentence_indices, subtoken_indices]
+        if self.BERT_pooling == 'first':
+            pooled = subtoken_vectors[starts]
+        elif self.BERT_pooling == 'last':
+            pooled = subtoken_vectors[ends-1]
+        else:
+            pooled = np.add.reduceat(subtoken_vectors, starts, axis=0) / (ends - starts)[:, None]
+        results.reshape((-1, BERT_embed_size))[rows[starts]] = pooled
+        return results
 
 
     def get_sentence_vector_with_BERT(self, token_list):
@@ -516,20 +958,28 @@ class Embeddings(object):
             print("Warning: BERT embeddings requested but embeddings object wrongly initialised")
             return
 
-        max_size_token_list = 0
-        for i, sentence in enumerate(token_list):
-            if len(sentence) > max_size_token_list:
-                max_size_token_list = len(sentence)
-           
         squeezed_bert_results = self.get_sentence_vector_only_BERT(token_list)
 
-        concatenated_squeezed_result = np.zeros((len(token_list), max_size_token_list, self.embed_size), dtype=np.float32)
-        for i, sentence in enumerate(token_list):
-            for j in range(0, len(token_list[i])):
-                concatenated_squeezed_result[i][j] = np.concatenate((squeezed_bert_results[i][j], 
-                    self.get_word_vector(token_list[i][j]).astype('float32')), )
+        return self.concatenate_static_vectors(token_list, squeezed_bert_results)
 
-        return concatenated_squeezed_result
+    def concatenate_static_vectors(self, token_list, contextual_result):
+        """
+            Concatenate to the (nb sentences, max length, contextual embed size) contextual 
+            embeddings of a batch the static embeddings of its tokens, retrieved with a single lookup
+        """
+        nb_sentences, max_length, contextual_size = contextual_result.shape
+        concatenated_result = np.zeros((nb_sentences, max_length, self.embed_size), dtype=np.float32)
+
+        lengths = np.array([min(len(tokens), max_length) for tokens in token_list], dtype=np.int64)
+        words = []
+        for tokens, length in zip(token_list, lengths):
+            words.extend(tokens[:length])
+        # positions of the actual tokens, the padding positions remain null, the static vectors 
+        # are in sentence and token order as the positions of the mask
+        mask = np.arange(max_length)[None, :] < lengths[:, None]
+        concatenated_result[:, :, :contextual_size][mask] = contextual_result[mask]
+        concatenated_result[:, :, contextual_size:][mask] = self.get_word_vectors(words)
+        return concatenated_result
 
 
     def _get_description(self, name):
@@ -548,142 +998,298 @@ class Embeddings(object):
         if (self.name == 'wiki.fr') or (self.name == 'wiki.fr.bin'):
             # the pre-trained embeddings are not cased
             word = word.lower()
+        if self.client is not None:
+            return self.get_word_vectors([word])[0]
         if self.env is None or self.extension == 'bin':
             # db not available or embeddings in bin format, the embeddings should be available in memory (normally!)
             return self.get_word_vector_in_memory(word)
-        try:    
-            with self.env.begin() as txn:
-                txn = self.env.begin()   
-                vector = txn.get(word.encode(encoding='UTF-8'))
-                if vector:
-                    word_vector = _deserialize_pickle(vector)
-                    vector = None
-                else:
-                    word_vector = np.zeros((self.static_embed_size,), dtype=np.float32)
-                    # alternatively, initialize with random negative values
-                    #word_vector = np.random.uniform(low=-0.5, high=0.0, size=(self.embed_size,))
-                    # alternatively use fasttext OOV ngram possibilities (if ngram available)
-        except lmdb.Error:
-            # no idea why, but we need to close and reopen the environment to avoid
-            # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-            # when opening new transaction !
-            self.env.close()
-            envFilePath = os.path.join(self.embedding_lmdb_path, self.name)
-            self.env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=2, lock=False)
-            return self.get_word_vector(word)
+        word_vector = self.cache.get(word)
+        if word_vector is not None:
+            self.lookup_stats.add(lookups=1, cache_hits=1)
+            return word_vector
+        with self.env.read() as txn:
+            start = time.perf_counter()
+            vector = txn.get(word.encode(encoding='UTF-8'))
+            self.lookup_stats.add(read_time=time.perf_counter()-start, lookups=1, oov=0 if vector else 1)
+            if vector:
+                # the value buffer is only valid within the transaction
+                word_vector = np.array(self._decode_vector(vector), dtype=np.float32)
+                vector = None
+            elif self.subwords is not None:
+                # unknown word, its vector is built from its char n-grams
+                word_vector = self.subwords.get_word_vectors([word])[0]
+            else:
+                word_vector = np.zeros((self.static_embed_size,), dtype=np.float32)
+                # alternatively, initialize with random negative values
+                #word_vector = np.random.uniform(low=-0.5, high=0.0, size=(self.embed_size,))
+        self.cache.put(word, word_vector)
         return word_vector
 
+    def get_word_vectors(self, words, out=None):
+        """
+            Get static embeddings for a list of tokens as a (nb tokens, static embed size) float32
+            matrix, written in out if provided. Each distinct token is looked up only once and,
+            with a LMDB database, all the lookups are done in key order within a single read
+            transaction, copying the values directly from the database memory map
+        """
+        if out is None:
+            out = np.zeros((len(words), self.static_embed_size), dtype=np.float32)
+        else:
+            out[:len(words)] = 0
+        if len(words) == 0:
+            return out
+
+        # positions of each distinct token in the list
+        positions = {}
+        for i, word in enumerate(words):
+            if (self.name == 'wiki.fr') or (self.name == 'wiki.fr.bin'):
+                # the pre-trained embeddings are not cased
+                word = word.lower()
+            if word in positions:
+                positions[word].append(i)
+            else:
+                positions[word] = [i]
+
+        if self.matrix is not None:
+            token_rows = np.full((len(words),), -1, dtype=np.int64)
+            for word, indices in positions.items():
+                row = self.vocabulary.get(word)
+                if row is not None:
+                    token_rows[indices] = row
+            found = token_rows >= 0
+            self.lookup_stats.add(lookups=len(positions), 
+                oov=len([indices for indices in positions.values() if token_rows[indices[0]] < 0]))
+            if np.any(found):
+                # sorted distinct rows for a sequential access to the matrix pages
+                rows, inverse = np.unique(token_rows[found], return_inverse=True)
+                out[:len(words)][found] = self._get_matrix_rows(rows)[inverse]
+            if self.subwords is not None and not np.all(found):
+                unknown_words = [word for word, indices in positions.items() if token_rows[indices[0]] < 0]
+                self._set_subword_vectors(unknown_words, positions, out)
+            return out
+
+        if self.client is not None:
+            # one request to the embeddings server for the tokens not in cache
+            missing_words = self._set_cached_vectors(positions, out)
+            if len(missing_words) > 0:
+                vectors = self.client.get_word_vectors(missing_words)
+                # the server returns zero vectors for the unknown words without subword vectors
+                self.lookup_stats.add(oov=int(np.sum(~np.any(vectors, axis=1))))
+                for word, vector in zip(missing_words, vectors):
+                    out[positions[word]] = vector
+                    self.cache.put(word, vector.copy())
+            return out
+
+        if self.env is None or self.extension == 'bin':
+            for word, indices in positions.items():
+                out[indices] = self.get_word_vector_in_memory(word)
+            return out
+
+        missing_words = self._set_cached_vectors(positions, out)
+        keys = sorted((word.encode(encoding='UTF-8'), word) for word in missing_words)
+        # quantized values are gathered and dequantized together
+        quantized = self.lmdb_format != 0 and self.lmdb_dtype != 'float32'
+        found_words = []
+        values = []
+        raw = None
+        start = time.perf_counter()
+        with self.env.read() as txn:
+            for key, word in keys:
+                value = txn.get(key)
+                if value is None:
+                    continue
+                found_words.append(word)
+                if quantized:
+                    values.append(value)
+                else:
+                    out[positions[word]] = self._decode_vector(value)
+            if len(values) > 0:
+                raw = np.frombuffer(b''.join(values), dtype=np.uint8).reshape((len(values), -1))
+                values = None
+        if len(keys) > 0:
+            self.lookup_stats.add(read_time=time.perf_counter()-start, oov=len(keys)-len(found_words))
+        if raw is not None:
+            vectors = _deserialize_vectors(raw, self.lmdb_dtype)
+            indices = [positions[word] for word in found_words]
+            rows = np.repeat(np.arange(len(found_words)), [len(word_indices) for word_indices in indices])
+            out[np.concatenate(indices)] = vectors[rows]
+        if self.subwords is not None and len(found_words) < len(missing_words):
+            found_words = set(found_words)
+            unknown_words = [word for word in missing_words if word not in found_words]
+            self._set_subword_vectors(unknown_words, positions, out)
+        for word in missing_words:
+            self.cache.put(word, out[positions[word][0]].copy())
+        return out
+
+    def _set_cached_vectors(self, positions, out):
+        """
+            Write in out the cached vectors of the distinct tokens, return the tokens not in cache
+        """
+        missing_words = []
+        for word, indices in positions.items():
+            vector = self.cache.get(word)
+            if vector is None:
+                missing_words.append(word)
+            else:
+                out[indices] = vector
+        self.lookup_stats.add(lookups=len(positions), cache_hits=len(positions)-len(missing_words))
+        return missing_words
+
+    def _set_subword_vectors(self, words, positions, out):
+        """
+            Write in out the vectors of unknown words built from their char n-grams
+        """
+        if len(words) == 0:
+            return
+        vectors = self.subwords.get_word_vectors(words)
+        indices = [positions[word] for word in words]
+        rows = np.repeat(np.arange(len(words)), [len(word_indices) for word_indices in indices])
+        out[np.concatenate(indices)] = vectors[rows]
+
+    def _get_matrix_rows(self, rows):
+        """
+            Float32 vectors of the given rows of the embeddings matrix, dequantized if needed
+        """
+        scales = None
+        if self.scales is not None:
+            scales = self.scales[rows]
+        return _dequantize_matrix(self.matrix[rows], scales)
+
+    def _decode_vector(self, value):
+        """
+            Decode a vector value stored in the static embeddings LMDB. With the raw layout, 
+            the float32 vector is a read-only view on the value buffer, without any copy
+        """
+        if self.lmdb_format == 0:
+            return _deserialize_pickle(value)
+        return _deserialize_vector(value, self.lmdb_dtype)
+
     def get_ELMo_lmdb_vector(self, token_list, max_size_sentence):
         """
-            Try to get the ELMo embeddings for a sequence cached in LMDB
+            Try to get the ELMo embeddings for a batch of sequences cached in LMDB, with a single 
+            read transaction. Return the (nb sequences, max_size_sentence-2, ELMo embed size) 
+            embeddings of the cached sequences and the indices of the missing sequences.
         """
+        ELMo_vector = np.zeros((len(token_list), max_size_sentence-2, ELMo_embed_size), dtype='float32')
         if self.env_ELMo is None:
             # db cache not available, we don't cache ELMo stuff
-            return None
-        try:    
-            ELMo_vector = np.zeros((len(token_list), max_size_sentence-2, ELMo_embed_size), dtype='float32')
-            with self.env_ELMo.begin() as txn:
-                for i in range(0, len(token_list)):
-                    txn = self.env_ELMo.begin()
-                    # get a hash for the token_list
-                    the_hash = list_digest(token_list[i])
-                    vector = txn.get(the_hash.encode(encoding='UTF-8'))
-                    if vector:
-                        # adapt expected shape/padding
-                        local_embeddings = _deserialize_pickle(vector)
-                        if local_embeddings.shape[0] > max_size_sentence-2:
-                            # squeeze the extra padding space
-                            ELMo_vector[i] = local_embeddings[:max_size_sentence-2,]
-                        elif local_embeddings.shape[0] == max_size_sentence-2:
-                            # bingo~!
-                            ELMo_vector[i] = local_embeddings
-                        else:
-                            # fill the missing space with padding
-                            filler = np.zeros((max_size_sentence-(local_embeddings.shape[0]+2), ELMo_embed_size), dtype='float32')
-                            ELMo_vector[i] = np.concatenate((local_embeddings, filler))
-                        vector = None
-                    else:
-                        return None
-        except lmdb.Error:
-            # no idea why, but we need to close and reopen the environment to avoid
-            # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-            # when opening new transaction !
-            self.env_ELMo.close()
-            self.env_ELMo = lmdb.open(self.embedding_ELMo_cache, readonly=True, max_readers=2048, max_spare_txns=2, lock=False)
-            return self.get_ELMo_lmdb_vector(token_list)
-        return ELMo_vector
+            return ELMo_vector, list(range(len(token_list)))
+        missing = []
+        with self.env_ELMo.read() as txn:
+            for i in range(0, len(token_list)):
+                # get a hash for the token_list
+                the_hash = list_digest(token_list[i])
+                vector = txn.get(the_hash.encode(encoding='UTF-8'))
+                if vector is None:
+                    missing.append(i)
+                    continue
+                # cached vectors are at the true length of the sequence, squeeze or pad
+                local_embeddings = _deserialize_matrix(vector, ELMo_embed_size)
+                length = min(local_embeddings.shape[0], max_size_sentence-2)
+                ELMo_vector[i][:length] = local_embeddings[:length]
+        return ELMo_vector, missing
 
-    def get_BERT_lmdb_vector(self, sentence):
+    def get_BERT_lmdb_vector(self, token_list):
         """
-            Try to get the BERT extracted embeddings for a sequence cached in LMDB
+            Try to get the BERT extracted embeddings for a batch of sequences cached in LMDB, with a 
+            single read transaction. Return for each sequence the realigned (sentence length, BERT 
+            embed size) float32 matrix, or None if the sequence is not cached.
         """
         if self.env_BERT is None:
-            # db cache not available, we don't cache ELMo stuff
-            return None
-        try:    
-            BERT_vector = np.zeros((BERT_sentence_size, BERT_embed_size), dtype='float32')
-            with self.env_BERT.begin() as txn:
-                txn = self.env_BERT.begin()
+            # db cache not available, we don't cache BERT stuff
+            return [None] * len(token_list)
+        results = []
+        with self.env_BERT.read() as txn:
+            for sentence in token_list:
                 # get a hash for the token_list
                 the_hash = list_digest(sentence)
                 vector = txn.get(the_hash.encode(encoding='UTF-8'))
-                
-                if vector:
-                    # adapt expected shape/padding
-                    BERT_vector = _deserialize_pickle(vector)
-                    '''
-                    if local_embeddings.shape[0] > max_size_sentence:
-                        # squeeze the extra padding space
-                        BERT_vector = local_embeddings[:max_size_sentence,]
-                    elif local_embeddings.shape[0] == max_size_sentence:
-                        # bingo~!
-                        BERT_vector = local_embeddings
-                    else:
-                        # fill the missing space with padding
-                        filler = np.zeros((max_size_sentence-(local_embeddings.shape[0]), BERT_embed_size), dtype='float32')
-                        BERT_vector = np.concatenate((local_embeddings, filler))
-                    '''
-                    vector = None
-                else:
-                    return None
-                
-        except lmdb.Error:
-            # no idea why, but we need to close and reopen the environment to avoid
-            # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-            # when opening new transaction !
-            self.env_BERT.close()
-            self.env_BERT = lmdb.open(self.embedding_BERT_cache, readonly=True, max_readers=2048, max_spare_txns=2, lock=False)
-            return self.get_BERT_lmdb_vector(sentence)
-        return BERT_vector
+                if vector is None:
+                    results.append(None)
+                    continue
+                # the value buffer is only valid within the transaction
+                results.append(np.array(_deserialize_matrix(vector, BERT_embed_size, self.BERT_cache_dtype)))
+        return results
+
 
+    def cache_ELMo_persistent_vector(self, token_list, ELMo_vector):
+        """
+            Cache the ELMo embeddings for a given sequence in the persistent cache
+        """
+        if self.ELMo_persistent_cache is None:
+            return
+        self.ELMo_persistent_cache.put(token_list, ELMo_vector)
 
     def cache_ELMo_lmdb_vector(self, token_list, ELMo_vector):
         """
-            Cache in LMDB the ELMo embeddings for a given sequence 
+            Cache in LMDB the ELMo embeddings for a batch of sequences, with a single write transaction
         """
         if self.env_ELMo is None:
             # db cache not available, we don't cache ELMo stuff
             return None
-        txn = self.env_ELMo.begin(write=True)
-        for i in range(0, len(token_list)):
-            # get a hash for the token_list
-            the_hash = list_digest(token_list[i])
-            txn.put(the_hash.encode(encoding='UTF-8'), _serialize_pickle(ELMo_vector[i]))  
-        txn.commit()
+        with self.env_ELMo.write() as txn:
+            for i in range(0, len(token_list)):
+                # get a hash for the token_list
+                the_hash = list_digest(token_list[i])
+                # only the vectors of the actual tokens are stored
+                txn.put(the_hash.encode(encoding='UTF-8'), _serialize_matrix(ELMo_vector[i][:len(token_list[i])]))
 
-    def cache_BERT_lmdb_vector(self, sentence, BERT_vector):
+    def cache_BERT_lmdb_vector(self, token_list, BERT_vector):
         """
-            Cache in LMDB the BERT embeddings for a given sequence 
+            Cache in LMDB the realigned BERT embeddings for a batch of sequences, with a single write transaction
         """
         if self.env_BERT is None:
             # db cache not available, we don't cache BERT stuff
             return None
-        txn = self.env_BERT.begin(write=True)
-        #for i in range(0, len(sentence)):
-        # get a hash for the token_list
-        the_hash = list_digest(sentence)
-        txn.put(the_hash.encode(encoding='UTF-8'), _serialize_pickle(BERT_vector))  
-        txn.commit()
+        with self.env_BERT.write() as txn:
+            for i in range(0, len(token_list)):
+                # get a hash for the token_list
+                the_hash = list_digest(token_list[i])
+                # only the vectors of the actual tokens are stored
+                txn.put(the_hash.encode(encoding='UTF-8'), _serialize_matrix(BERT_vector[i][:len(token_list[i])], self.BERT_cache_dtype))
+
+    def begin_training(self):
+        """
+            Register a model training with these embeddings, the ELMo and BERT training caches 
+            deleted at the end of a previous training are created again
+        """
+        with self.trainings_lock:
+            self.trainings += 1
+            if self.use_ELMo and self.env_ELMo is None and self.embedding_ELMo_cache is not None:
+                self.env_ELMo = ProcessLocalEnvironment(self.embedding_ELMo_cache, map_size=map_size)
+            if self.use_BERT and self.env_BERT is None and self.embedding_BERT_cache is not None:
+                self.env_BERT = ProcessLocalEnvironment(self.embedding_BERT_cache, map_size=map_size)
+
+    def end_training(self):
+        """
+            End a training registered with begin_training(), the ELMo and BERT training caches 
+            are deleted when no other model sharing these embeddings is being trained
+        """
+        with self.trainings_lock:
+            self.trainings -= 1
+            if self.trainings > 0:
+                return
+            if self.use_ELMo:
+                self.clean_ELMo_cache()
+            if self.use_BERT:
+                self.clean_BERT_cache()
+
+    def close(self):
+        """
+            Close the LMDB environments, the contextual caches and the ELMo session of the embeddings, 
+            called by release_embeddings() when no model uses them anymore
+        """
+        if self.env is not None:
+            self.env.close()
+            self.env = None
+        for name in ["env_ELMo", "env_BERT", "ELMo_persistent_cache", "BERT_persistent_cache"]:
+            resource = self.__dict__.get(name)
+            if resource is not None:
+                resource.close()
+                setattr(self, name, None)
+        if self.__dict__.get("ELMo_session") is not None:
+            self.ELMo_session.close()
+            self.ELMo_session = None
 
     def clean_ELMo_cache(self):
         """
@@ -695,6 +1301,9 @@ class Embeddings(object):
         else: 
             self.env_ELMo.close()
             self.env_ELMo = None
+            if not os.path.isdir(self.embedding_ELMo_cache):
+                # the cache was never opened
+                return
             for file in os.listdir(self.embedding_ELMo_cache): 
                 file_path = os.path.join(self.embedding_ELMo_cache, file)
                 if os.path.isfile(file_path):
@@ -727,7 +1336,18 @@ class Embeddings(object):
             # the pre-trained embeddings are not cased
             word = word.lower()
         if self.extension == 'bin':
+            # the fastText model builds the vectors of unknown words, they are not counted as oov
+            self.lookup_stats.add(lookups=1)
             return self.model.get_word_vector(word)
+        if self.matrix is not None:
+            row = self.vocabulary.get(word)
+            self.lookup_stats.add(lookups=1, oov=1 if row is None else 0)
+            if row is None:
+                if self.subwords is not None:
+                    return self.subwords.get_word_vectors([word])[0]
+                return np.zeros((self.static_embed_size,), dtype=np.float32)
+            return self._get_matrix_rows([row])[0]
+        self.lookup_stats.add(lookups=1, oov=0 if word in self.model else 1)
         if word in self.model:
             return self.model[word]
         else:
@@ -737,6 +1357,111 @@ class Embeddings(object):
             #return np.random.uniform(low=-0.5, high=0.0, size=(self.embed_size,))
             # alternatively use fasttext OOV ngram possibilities (if ngram available)
 
+    def stats(self, since=None):
+        """
+            Snapshot of the lookup counters and timings since the creation of the embeddings, 
+            or since an earlier self.lookup_stats.snapshot() given as since (e.g. taken at the 
+            beginning of an epoch), including the lookups of the data generator workers forked 
+            by the current process. The lookups are counted once per distinct token of a request, 
+            the oov rate is relative to the lookups not served by the cache.
+        """
+        values = self.lookup_stats.snapshot()
+        if since is not None:
+            values = LookupStats.difference(values, since)
+        lookups = values["lookups"]
+        stats = {
+            "lookups": lookups,
+            "cache_hits": values["cache_hits"],
+            "cache_hit_rate": _rate(values["cache_hits"], lookups),
+            "oov": values["oov"],
+            "oov_rate": _rate(values["oov"], lookups - values["cache_hits"]),
+            "lmdb_reads": values["lmdb_reads"],
+            "lmdb_read_time": values["lmdb_read_time"],
+            "lmdb_read_latency": values["lmdb_read_latency"],
+            "cache": self.cache.stats()
+        }
+        for name, enabled in [("ELMo", self.use_ELMo), ("BERT", self.use_BERT)]:
+            if not enabled:
+                continue
+            sentences = values[name + "_sentences"]
+            stats[name] = {
+                "forward_calls": values[name + "_forward_calls"],
+                "forward_time": values[name + "_forward_time"],
+                "sentences": sentences,
+                "cache_hits": values[name + "_cache_hits"],
+                "cache_hit_rate": _rate(values[name + "_cache_hits"], sentences)
+            }
+            persistent_cache = getattr(self, name + "_persistent_cache", None)
+            if persistent_cache is not None:
+                stats[name]["persistent_cache"] = persistent_cache.stats()
+        return stats
+
+    def print_stats(self, since=None):
+        """
+            Print a summary of stats(since), for instance at the end of each training epoch
+        """
+        stats = self.stats(since)
+        print("\tembeddings: {0} lookups, cache hit rate {1:.2%}, oov rate {2:.2%}, {3} LMDB reads in {4:.3f}s".format(
+            stats["lookups"], stats["cache_hit_rate"], stats["oov_rate"], stats["lmdb_reads"], stats["lmdb_read_time"]))
+        if stats["lmdb_reads"] > 0:
+            print("\tLMDB read latency:", ", ".join([bucket + " " + str(count) for bucket, count in stats["lmdb_read_latency"].items()]))
+        for name in ["ELMo", "BERT"]:
+            if name in stats:
+                print("\t{0}: {1} forward calls in {2:.3f}s, {3} sentences, contextual cache hit rate {4:.2%}".format(
+                    name, stats[name]["forward_calls"], stats[name]["forward_time"], stats[name]["sentences"], 
+                    stats[name]["cache_hit_rate"]))
+
+
+def _bucket_length(length, buckets):
+    """
+    Smallest of the sorted bucket lengths which is at least length, length itself if it exceeds them
+    """
+    index = bisect.bisect_left(buckets, length)
+    if index == len(buckets):
+        return length
+    return buckets[index]
+
+
+def _rate(count, total):
+    return float(count) / total if total > 0 else 0.0
+
+
+# Embeddings instances shared by the models of the process, with their number of users, keyed by 
+# the registry, the name of the embeddings and the loading options
+shared_embeddings_registry = {}
+shared_embeddings_lock = threading.Lock()
+
+def shared_embeddings(name, path='./embedding-registry.json', use_ELMo=False, use_BERT=False, subset_path=None):
+    """
+    Embeddings instance shared by the models of the process which use the same embeddings with 
+    the same options, created at the first request. Each request must be balanced by a call to 
+    release_embeddings() when the model does not use the embeddings anymore.
+    """
+    if subset_path is not None:
+        subset_path = os.path.abspath(subset_path)
+    key = (os.path.abspath(path), name, use_ELMo, use_BERT, subset_path)
+    with shared_embeddings_lock:
+        entry = shared_embeddings_registry.get(key)
+        if entry is None:
+            entry = [Embeddings(name, path=path, use_ELMo=use_ELMo, use_BERT=use_BERT, subset_path=subset_path), 0]
+            shared_embeddings_registry[key] = entry
+        entry[1] += 1
+        return entry[0]
+
+def release_embeddings(embeddings):
+    """
+    Release an instance obtained with shared_embeddings(), it is dropped from the registry and 
+    closed when no model uses it anymore
+    """
+    with shared_embeddings_lock:
+        for key, entry in shared_embeddings_registry.items():
+            if entry[0] is embeddings:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del shared_embeddings_registry[key]
+                    embeddings.close()
+                return
+
 
 def _serialize_byteio(array):
     memfile = io.BytesIO()
@@ -760,6 +1485,1367 @@ def _deserialize_pickle(serialized):
     return pickle.loads(serialized)
 
 
+def _serialize_vector(vector, dtype='float32'):
+    """
+    Raw fixed-width little-endian layout of a vector (format version 1)
+    """
+    return _serialize_vectors(np.asarray(vector).reshape((1, -1)), dtype).tobytes()
+
+
+def _deserialize_vector(serialized, dtype='float32'):
+    """
+    Float32 vector of a raw value, a read-only view on the value buffer for float32 values
+    """
+    if dtype == 'float32':
+        return np.frombuffer(serialized, dtype=np.dtype(dtype).newbyteorder('<'))
+    return _deserialize_vectors(np.frombuffer(serialized, dtype=np.uint8).reshape((1, -1)), dtype)[0]
+
+
+def _serialize_vectors(matrix, dtype='float32'):
+    """
+    Raw layouts of the rows of a (nb words, embed size) matrix, as a (nb words, value size) 
+    uint8 matrix. With int8 values, the little-endian float32 scale of the vector comes first.
+    """
+    values, scales = _quantize_matrix(matrix, dtype)
+    raw = values.astype(np.dtype(dtype).newbyteorder('<')).view(np.uint8).reshape((values.shape[0], -1))
+    if scales is not None:
+        raw = np.hstack([scales.astype('<f4').view(np.uint8).reshape((-1, 4)), raw])
+    return raw
+
+
+def _deserialize_vectors(raw, dtype='float32'):
+    """
+    Dequantize in one pass a (nb words, value size) uint8 matrix of raw values into a float32 matrix
+    """
+    if dtype == 'int8':
+        scales = np.ascontiguousarray(raw[:, :4]).view('<f4')[:, 0]
+        return _dequantize_matrix(raw[:, 4:].view(np.int8), scales)
+    return _dequantize_matrix(np.ascontiguousarray(raw).view(np.dtype(dtype).newbyteorder('<')))
+
+
+def _serialize_matrix(matrix, dtype='float32'):
+    """
+    Raw layout of a (nb vectors, embed size) matrix, the raw layouts of its rows concatenated
+    """
+    return _serialize_vectors(matrix, dtype).tobytes()
+
+
+def _deserialize_matrix(serialized, embed_size, dtype='float32'):
+    """
+    Float32 (nb vectors, embed size) matrix of a raw value
+    """
+    value_size = embed_size * np.dtype(dtype).itemsize
+    if dtype == 'int8':
+        value_size += 4
+    raw = np.frombuffer(serialized, dtype=np.uint8).reshape((-1, value_size))
+    return _deserialize_vectors(raw, dtype).reshape((-1, embed_size))
+
+
+def _quantize_matrix(matrix, dtype='float32'):
+    """
+    Convert a (nb words, embed size) matrix into dtype values. For int8, each vector is scaled by 
+    its maximum absolute value, and the float32 scales are returned with the values (None otherwise)
+    """
+    if dtype == 'int8':
+        scales = (np.abs(matrix).max(axis=1) / 127.0).astype(np.float32)
+        divisors = np.where(scales > 0, scales, 1)
+        values = np.rint(matrix / divisors[:, None]).clip(-127, 127).astype(np.int8)
+        return values, scales
+    return matrix.astype(dtype), None
+
+
+def _dequantize_matrix(values, scales=None):
+    """
+    Float32 matrix of quantized values, with their per-vector scales for int8
+    """
+    matrix = values.astype(np.float32, copy=False)
+    if scales is not None:
+        matrix = matrix * scales[:, None]
+    return matrix
+
+
+def _read_lmdb_meta(txn):
+    """
+    Return the metadata of a compiled embeddings database, or None for a legacy database
+    """
+    meta = txn.get(lmdb_meta_key)
+    if meta is None:
+        return None
+    return json.loads(bytes(meta).decode('UTF-8'))
+
+
+def _read_lmdb_progress(txn):
+    """
+    Return the progress of an interrupted compilation of an embeddings database, or None
+    """
+    progress = txn.get(lmdb_progress_key)
+    if progress is None:
+        return None
+    return json.loads(bytes(progress).decode('UTF-8'))
+
+
+def _write_lmdb_progress(txn, source, offset, dtype='float32'):
+    progress = {
+        "source": source,
+        "offset": offset,
+        "dtype": dtype
+    }
+    txn.put(lmdb_progress_key, json.dumps(progress).encode('UTF-8'))
+
+
+def _write_lmdb_meta(txn, vocab_size, embed_size, dtype='float32'):
+    meta = {
+        "format": lmdb_format_version,
+        "dtype": dtype,
+        "vocab_size": vocab_size,
+        "embed_size": embed_size
+    }
+    txn.put(lmdb_meta_key, json.dumps(meta).encode('UTF-8'))
+
+
+def migrate_embeddings_lmdb(envFilePath, dtype='float32', batch_size=100000):
+    """
+    Rewrite an existing embeddings LMDB database with the current raw value layout, 
+    for instance a legacy database with pickled vectors. The database is rewritten 
+    in a new environment which replaces the original one only when complete, so an 
+    interrupted migration leaves the original database untouched.
+    """
+    if dtype not in lmdb_dtypes:
+        raise ValueError('unsupported embeddings value type: ' + dtype + ', expected one of ' + str(lmdb_dtypes))
+    if not os.path.isdir(envFilePath):
+        raise OSError('Could not find the embeddings database ' + envFilePath)
+
+    env = lmdb.open(envFilePath, readonly=True, max_readers=2048)
+    with env.begin() as txn:
+        meta = _read_lmdb_meta(txn)
+        nb_entries = txn.stat()['entries']
+    if meta is not None and meta["format"] == lmdb_format_version and meta["dtype"] == dtype:
+        print(envFilePath, "is already in format", lmdb_format_version, "with", dtype, "values, nothing to migrate")
+        env.close()
+        return
+
+    tmpFilePath = envFilePath + '.migrating'
+    if os.path.isdir(tmpFilePath):
+        # remaining of a previous interrupted migration
+        shutil.rmtree(tmpFilePath)
+    new_env = lmdb.open(tmpFilePath, map_size=map_size)
+
+    nb_words = 0
+    embed_size = 0
+    new_txn = new_env.begin(write=True)
+    with env.begin() as txn:
+        cursor = txn.cursor()
+        for key, value in tqdm(cursor, total=nb_entries):
+            if key == lmdb_meta_key:
+                continue
+            if meta is None:
+                vector = _deserialize_pickle(value)
+            else:
+                vector = _deserialize_vector(value, meta["dtype"])
+            embed_size = vector.shape[0]
+            new_txn.put(key, _serialize_vector(vector, dtype))
+            nb_words += 1
+            if nb_words % batch_size == 0:
+                new_txn.commit()
+                new_txn = new_env.begin(write=True)
+        cursor.close()
+    _write_lmdb_meta(new_txn, nb_words, embed_size, dtype)
+    new_txn.commit()
+    new_env.close()
+    env.close()
+
+    # swap the databases
+    oldFilePath = envFilePath + '.old'
+    os.rename(envFilePath, oldFilePath)
+    os.rename(tmpFilePath, envFilePath)
+    shutil.rmtree(oldFilePath)
+    print(envFilePath, "migrated to format", lmdb_format_version, "with", dtype, "values for", nb_words, "words and", embed_size, "dimensions")
+
+
+def update_embeddings_lmdb(envFilePath, embeddings_path, hasHeader=True, overwrite=True, block_size=10000):
+    """
+    Merge the vectors of a .vec/.txt embeddings file, typically a small set of domain words, into 
+    an existing embeddings LMDB database without recompiling it. The vectors are stored with the 
+    value type of the database, the vectors of words already present are replaced only if 
+    overwrite is True. The update is done in a single write transaction with the metadata, so an 
+    interrupted update leaves the database untouched. Return the number of added and replaced words.
+    """
+    if not os.path.isdir(envFilePath):
+        raise OSError('Could not find the embeddings database ' + envFilePath)
+    if os.path.isfile(os.path.join(envFilePath, mmap_meta_file)):
+        raise ValueError(envFilePath + ' is a memory-mapped (mmap) embeddings store, not a LMDB database, ' + 
+            'it is updated with update_embeddings_mmap()')
+    _, embed_size = _read_embeddings_header(embeddings_path, hasHeader)
+
+    env = lmdb.open(envFilePath, map_size=map_size)
+    try:
+        with env.begin() as txn:
+            meta = _read_lmdb_meta(txn)
+            progress = _read_lmdb_progress(txn)
+        if progress is not None:
+            raise ValueError('the compilation of ' + envFilePath + ' is not complete, it cannot be updated')
+        if meta is None or meta["format"] != lmdb_format_version:
+            raise ValueError(envFilePath + ' has a previous layout, it must be migrated before being updated')
+        if meta["embed_size"] != embed_size:
+            raise ValueError('the vectors of ' + embeddings_path + ' have ' + str(embed_size) + 
+                ' dimensions, ' + str(meta["embed_size"]) + ' expected by ' + envFilePath)
+
+        max_key_size = env.max_key_size()
+        nb_added = 0
+        nb_replaced = 0
+        with env.begin(write=True) as txn:
+            for words, matrix in _iter_vector_blocks(embeddings_path, embed_size, hasHeader, block_size):
+                raw = _serialize_vectors(matrix, meta["dtype"])
+                for i, word in enumerate(words):
+                    key = word.encode(encoding='UTF-8')
+                    if len(key) >= max_key_size:
+                        continue
+                    if overwrite:
+                        if txn.replace(key, raw[i].tobytes()) is None:
+                            nb_added += 1
+                        else:
+                            nb_replaced += 1
+                    elif txn.put(key, raw[i].tobytes(), overwrite=False):
+                        nb_added += 1
+            _write_lmdb_meta(txn, meta["vocab_size"] + nb_added, embed_size, meta["dtype"])
+    finally:
+        env.close()
+    print(envFilePath, "updated with", nb_added, "new words and", nb_replaced, "replaced vectors")
+    return nb_added, nb_replaced
+
+
+def update_embeddings_mmap(storeFilePath, embeddings_path, hasHeader=True, overwrite=True, block_size=10000):
+    """
+    Merge the vectors of a .vec/.txt embeddings file into an existing memory-mapped embeddings 
+    store, as update_embeddings_lmdb() for a LMDB database. The rows of a memory-mapped store being 
+    sorted by word, the whole store is written again with the value type of the store, then 
+    replaces the previous one. Return the number of added and replaced words.
+    """
+    metaFilePath = os.path.join(storeFilePath, mmap_meta_file)
+    if not os.path.isfile(metaFilePath):
+        if os.path.isdir(storeFilePath):
+            raise ValueError(storeFilePath + ' is not a memory-mapped (mmap) embeddings store, ' + 
+                'a LMDB database is updated with update_embeddings_lmdb()')
+        raise OSError('Could not find the embeddings store ' + storeFilePath)
+    _, embed_size = _read_embeddings_header(embeddings_path, hasHeader)
+
+    matrix, scales, vocabulary, meta = open_embeddings_mmap(storeFilePath)
+    if meta["embed_size"] != embed_size:
+        raise ValueError('the vectors of ' + embeddings_path + ' have ' + str(embed_size) + 
+            ' dimensions, ' + str(meta["embed_size"]) + ' expected by ' + storeFilePath)
+    words = [vocabulary.words[int(vocabulary.offsets[i]):int(vocabulary.offsets[i+1])].decode('UTF-8') 
+        for i in range(len(vocabulary))]
+    vectors = np.array(_dequantize_matrix(matrix, scales), dtype=np.float32)
+
+    added = OrderedDict()
+    nb_replaced = 0
+    for new_words, new_matrix in _iter_vector_blocks(embeddings_path, embed_size, hasHeader, block_size):
+        for word, vector in zip(new_words, new_matrix):
+            row = vocabulary.get(word)
+            if row is None:
+                if overwrite or word not in added:
+                    added[word] = vector
+            elif overwrite:
+                vectors[row] = vector
+                nb_replaced += 1
+    extra = dict((key, value) for key, value in meta.items() if key not in ["format", "dtype", "vocab_size", "embed_size"])
+    if len(added) > 0:
+        words.extend(added.keys())
+        vectors = np.concatenate([vectors, np.array(list(added.values()), dtype=np.float32)])
+    write_embeddings_mmap(storeFilePath, words, vectors, meta["dtype"], **extra)
+    print(storeFilePath, "updated with", len(added), "new words and", nb_replaced, "replaced vectors")
+    return len(added), nb_replaced
+
+
+def _open_embeddings_file(embeddings_path):
+    """
+    Open a .vec/.txt embeddings file in binary mode, the file can be compressed with gzip or bzip2
+    """
+    if embeddings_path.endswith('.gz'):
+        return gzip.open(embeddings_path, 'rb')
+    if embeddings_path.endswith('.bz2'):
+        return bz2.open(embeddings_path, 'rb')
+    return open(embeddings_path, 'rb')
+
+
+def _read_embeddings_header(embeddings_path, hasHeader=True):
+    """
+    Return the number of words (0 if unknown) and the embedding size of a .vec/.txt embeddings file
+    """
+    with _open_embeddings_file(embeddings_path) as f:
+        line = f.readline().decode('utf8').rstrip().split(' ')
+    if hasHeader:
+        # first line gives the nb of words and the embedding size
+        return int(line[0]), int(line[1])
+    return 0, len(line) - 1
+
+
+def _parse_vector_lines(lines, embed_size):
+    """
+    Parse a block of lines of a .vec/.txt embeddings file into the list of words and a 
+    (nb words, embed_size) float32 matrix, converting all the values of the block with a 
+    single vectorized call. Malformed lines are ignored.
+    """
+    words = []
+    values = []
+    for line in lines:
+        line = line.rstrip()
+        if line.count(' ') == embed_size:
+            word = line[:line.find(' ')]
+        else:
+            # the word might contain spaces, the values are always the last embed_size pieces
+            pieces = line.rsplit(' ', embed_size)
+            if len(pieces) != embed_size + 1:
+                continue
+            word = pieces[0]
+        if len(word) == 0:
+            continue
+        words.append(word)
+        values.append(line[len(word):])
+
+    matrix = None
+    if len(words) > 0:
+        try:
+            matrix = np.fromstring(''.join(values), dtype=np.float32, sep=' ')
+        except ValueError:
+            matrix = None
+    if matrix is None or matrix.shape[0] != len(words) * embed_size:
+        # a non-numerical value somewhere in the block, fall back to line by line parsing
+        valid_words = []
+        vectors = []
+        for word, value in zip(words, values):
+            try:
+                vector = np.fromstring(value, dtype=np.float32, sep=' ')
+            except ValueError:
+                continue
+            if vector.shape[0] == embed_size:
+                valid_words.append(word)
+                vectors.append(vector)
+        words = valid_words
+        if len(vectors) == 0:
+            return words, np.zeros((0, embed_size), dtype=np.float32)
+        matrix = np.stack(vectors)
+    return words, matrix.reshape((len(words), embed_size))
+
+
+def _decode_lines(lines):
+    """
+    Decode a block of raw UTF-8 lines, the lines which are not valid UTF-8 are ignored
+    """
+    try:
+        return b''.join(lines).decode('utf8').split('\n')
+    except UnicodeDecodeError:
+        decoded = []
+        for line in lines:
+            try:
+                decoded.append(line.decode('utf8'))
+            except UnicodeDecodeError:
+                continue
+        return decoded
+
+
+def _parse_raw_lines(lines, embed_size):
+    return _parse_vector_lines(_decode_lines(lines), embed_size)
+
+
+def _encode_raw_lines(lines, embed_size, dtype, max_key_size):
+    """
+    Parse a block of raw lines into the (key, value) pairs to be stored in a LMDB database
+    """
+    words, matrix = _parse_raw_lines(lines, embed_size)
+    raw = _serialize_vectors(matrix, dtype)
+    items = []
+    for i, word in enumerate(words):
+        key = word.encode(encoding='UTF-8')
+        if len(key) < max_key_size:
+            items.append((key, raw[i].tobytes()))
+    return items
+
+
+def _default_nb_workers():
+    return max(1, multiprocessing.cpu_count() - 1)
+
+
+def _map_blocks(f, function, args=(), block_size=10000, nb_workers=1, offset=0):
+    """
+    Read blocks of raw lines from the binary file f and apply function(lines, *args) to them with 
+    a pool of nb_workers processes. The results are yielded in the file order, together with the 
+    file offset at the end of their block. The number of blocks in flight is bounded, so the file 
+    is streamed whatever its size.
+    """
+    pool = None
+    if nb_workers > 1:
+        pool = multiprocessing.Pool(nb_workers)
+    pending = deque()
+    end_of_file = False
+    try:
+        while True:
+            while not end_of_file and len(pending) < 2 * nb_workers:
+                lines = list(islice(f, block_size))
+                if len(lines) == 0:
+                    end_of_file = True
+                    break
+                offset += sum(len(line) for line in lines)
+                if pool is None:
+                    pending.append((offset, function(lines, *args)))
+                else:
+                    pending.append((offset, pool.apply_async(function, (lines,) + tuple(args))))
+            if len(pending) == 0:
+                break
+            block_offset, result = pending.popleft()
+            if pool is not None:
+                result = result.get()
+            yield block_offset, result
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _iter_vector_blocks(embeddings_path, embed_size, hasHeader=True, block_size=10000, nb_workers=1):
+    """
+    Stream a .vec/.txt embeddings file as parsed blocks of (words, matrix)
+    """
+    with _open_embeddings_file(embeddings_path) as f:
+        if hasHeader:
+            f.readline()
+        for _, block in _map_blocks(f, _parse_raw_lines, (embed_size,), block_size, nb_workers):
+            yield block
+
+
+def load_embeddings_matrix(embeddings_path, hasHeader=True, block_size=10000, nb_workers=None):
+    """
+    Load a .vec/.txt embeddings file in memory as a single float32 matrix with a word to row 
+    index. The file is read and parsed by large blocks, written directly in the preallocated 
+    matrix when the number of words is given by the header.
+    """
+    if nb_workers is None:
+        nb_workers = _default_nb_workers()
+    nb_words, embed_size = _read_embeddings_header(embeddings_path, hasHeader)
+
+    matrix = np.empty((nb_words if nb_words > 0 else 100000, embed_size), dtype=np.float32)
+    vocabulary = {}
+    nb_rows = 0
+    for words, block in _iter_vector_blocks(embeddings_path, embed_size, hasHeader, block_size, nb_workers):
+        if nb_rows + len(words) > matrix.shape[0]:
+            extended_matrix = np.empty((max(2 * matrix.shape[0], nb_rows + len(words)), embed_size), dtype=np.float32)
+            extended_matrix[:nb_rows] = matrix[:nb_rows]
+            matrix = extended_matrix
+        matrix[nb_rows:nb_rows+len(words)] = block
+        for i, word in enumerate(words):
+            # for duplicated words, the last vector is kept
+            vocabulary[word] = nb_rows + i
+        nb_rows += len(words)
+
+    if nb_rows < 0.9 * matrix.shape[0]:
+        # release the unused capacity
+        matrix = matrix[:nb_rows].copy()
+    else:
+        matrix = matrix[:nb_rows]
+    return matrix, vocabulary
+
+
+def compile_embeddings_lmdb(env, embeddings_path, hasHeader=True, dtype='float32', block_size=10000, 
+                            commit_size=200000, nb_workers=None):
+    """
+    Compile a .vec/.txt embeddings file, possibly compressed with gzip or bzip2, into the LMDB 
+    environment env in a single pass. Blocks of lines are parsed by a pool of processes and the 
+    vectors are committed in bounded write transactions, each one recording the position reached 
+    in the source file, so that an interrupted compilation is resumed where it stopped. 
+    Return the number of words and the embedding size.
+    """
+    if dtype not in lmdb_dtypes:
+        raise ValueError('unsupported embeddings value type: ' + dtype + ', expected one of ' + str(lmdb_dtypes))
+    if nb_workers is None:
+        nb_workers = _default_nb_workers()
+    source = os.path.abspath(embeddings_path)
+    _, embed_size = _read_embeddings_header(embeddings_path, hasHeader)
+
+    offset = 0
+    with env.begin() as txn:
+        progress = _read_lmdb_progress(txn)
+    if progress is not None and progress["source"] == source and progress["dtype"] == dtype:
+        offset = progress["offset"]
+        print("resuming compilation at byte", offset, "of", embeddings_path)
+    else:
+        # start from an empty database
+        with env.begin(write=True) as txn:
+            txn.drop(env.open_db(), delete=False)
+
+    # progress is displayed in bytes of the (uncompressed) source
+    total = None
+    if not (embeddings_path.endswith('.gz') or embeddings_path.endswith('.bz2')):
+        total = os.path.getsize(embeddings_path)
+    max_key_size = env.max_key_size()
+    txn = env.begin(write=True)
+    try:
+        with _open_embeddings_file(embeddings_path) as f, tqdm(total=total, initial=offset, unit='B', unit_scale=True) as pbar:
+            if offset > 0:
+                f.seek(offset)
+            elif hasHeader:
+                offset = len(f.readline())
+            nb_uncommitted = 0
+            for block_offset, items in _map_blocks(f, _encode_raw_lines, (embed_size, dtype, max_key_size), 
+                                                   block_size, nb_workers, offset):
+                for key, value in items:
+                    txn.put(key, value)
+                nb_uncommitted += len(items)
+                pbar.update(block_offset - offset)
+                offset = block_offset
+                if nb_uncommitted >= commit_size:
+                    _write_lmdb_progress(txn, source, offset, dtype)
+                    txn.commit()
+                    txn = env.begin(write=True)
+                    nb_uncommitted = 0
+        txn.delete(lmdb_progress_key)
+        vocab_size = txn.stat()['entries']
+        _write_lmdb_meta(txn, vocab_size, embed_size, dtype)
+        txn.commit()
+    except:
+        txn.abort()
+        raise
+    return vocab_size, embed_size
+
+
+def compile_embeddings_mmap(embeddings_path, storeFilePath, hasHeader=True, dtype='float32', block_size=10000, nb_workers=None):
+    """
+    Compile a .vec/.txt embeddings file into a memory-mapped store: a dense .npy matrix with 
+    the rows sorted by word, and the sorted words with their offsets as vocabulary index. The 
+    store is built in a temporary directory which is renamed only when complete.
+    """
+    if dtype not in lmdb_dtypes:
+        raise ValueError('unsupported embeddings value type: ' + dtype + ', expected one of ' + str(lmdb_dtypes))
+    if nb_workers is None:
+        nb_workers = _default_nb_workers()
+    nb_words, embed_size = _read_embeddings_header(embeddings_path, hasHeader)
+
+    tmpFilePath = storeFilePath + '.compiling'
+    if os.path.isdir(tmpFilePath):
+        # remaining of a previous interrupted compilation
+        shutil.rmtree(tmpFilePath)
+    os.makedirs(tmpFilePath)
+
+    # the vectors are first appended in file order to a raw file, keeping the row of each word
+    raw_path = os.path.join(tmpFilePath, 'vectors.raw')
+    word_rows = {}
+    raw_scales = []
+    nb_rows = 0
+    with open(raw_path, 'wb') as raw, tqdm(total=nb_words if nb_words > 0 else None) as pbar:
+        for words, matrix in _iter_vector_blocks(embeddings_path, embed_size, hasHeader, block_size, nb_workers):
+            values, scales = _quantize_matrix(matrix, dtype)
+            raw.write(values.tobytes())
+            if scales is not None:
+                raw_scales.append(scales)
+            for i, word in enumerate(words):
+                # for duplicated words, the last vector is kept like in the LMDB databases
+                word_rows[word.encode(encoding='UTF-8')] = nb_rows + i
+            nb_rows += len(words)
+            pbar.update(len(words))
+    if nb_rows == 0:
+        shutil.rmtree(tmpFilePath)
+        raise ValueError('no embeddings vector found in ' + embeddings_path)
+
+    # then written again in the order of the sorted words
+    keys = sorted(word_rows)
+    raw_matrix = np.memmap(raw_path, dtype=dtype, mode='r', shape=(nb_rows, embed_size))
+    matrix = np.lib.format.open_memmap(os.path.join(tmpFilePath, mmap_vectors_file), mode='w+', 
+        dtype=dtype, shape=(len(keys), embed_size))
+    for start in range(0, len(keys), block_size):
+        rows = np.array([word_rows[key] for key in keys[start:start+block_size]], dtype=np.int64)
+        matrix[start:start+rows.shape[0]] = raw_matrix[rows]
+    matrix.flush()
+    del matrix
+    del raw_matrix
+    os.remove(raw_path)
+    if len(raw_scales) > 0:
+        raw_scales = np.concatenate(raw_scales)
+        np.save(os.path.join(tmpFilePath, mmap_scales_file), raw_scales[[word_rows[key] for key in keys]])
+
+    _write_mmap_vocabulary(tmpFilePath, keys)
+    _write_mmap_meta(tmpFilePath, len(keys), embed_size, dtype)
+
+    if os.path.isdir(storeFilePath):
+        shutil.rmtree(storeFilePath)
+    os.rename(tmpFilePath, storeFilePath)
+    print('embeddings compiled for', len(keys), "words and", embed_size, "dimensions")
+
+
+def write_embeddings_mmap(storeFilePath, words, matrix, dtype='float32', **meta):
+    """
+    Write a list of words and their (nb words, embed size) matrix of vectors as a memory-mapped 
+    embeddings store. Additional metadata entries can be given as keyword arguments.
+    """
+    if dtype not in lmdb_dtypes:
+        raise ValueError('unsupported embeddings value type: ' + dtype + ', expected one of ' + str(lmdb_dtypes))
+    word_rows = {}
+    for i, word in enumerate(words):
+        word_rows[word.encode(encoding='UTF-8')] = i
+    keys = sorted(word_rows)
+    rows = np.array([word_rows[key] for key in keys], dtype=np.int64)
+
+    tmpFilePath = storeFilePath + '.compiling'
+    if os.path.isdir(tmpFilePath):
+        shutil.rmtree(tmpFilePath)
+    os.makedirs(tmpFilePath)
+    values, scales = _quantize_matrix(matrix[rows], dtype)
+    np.save(os.path.join(tmpFilePath, mmap_vectors_file), values)
+    if scales is not None:
+        np.save(os.path.join(tmpFilePath, mmap_scales_file), scales)
+    _write_mmap_vocabulary(tmpFilePath, keys)
+    _write_mmap_meta(tmpFilePath, len(keys), matrix.shape[1], dtype, **meta)
+
+    if os.path.isdir(storeFilePath):
+        shutil.rmtree(storeFilePath)
+    os.rename(tmpFilePath, storeFilePath)
+
+
+def _write_mmap_vocabulary(storeFilePath, keys):
+    """
+    Write the sorted UTF-8 words of a memory-mapped store with their offsets
+    """
+    offsets = np.zeros((len(keys)+1,), dtype=np.int64)
+    with open(os.path.join(storeFilePath, mmap_words_file), 'wb') as f:
+        for i, key in enumerate(keys):
+            f.write(key)
+            offsets[i+1] = offsets[i] + len(key)
+    np.save(os.path.join(storeFilePath, mmap_offsets_file), offsets)
+
+
+def _write_mmap_meta(storeFilePath, vocab_size, embed_size, dtype='float32', **extra):
+    meta = {
+        "format": lmdb_format_version,
+        "dtype": dtype,
+        "vocab_size": vocab_size,
+        "embed_size": embed_size
+    }
+    meta.update(extra)
+    with open(os.path.join(storeFilePath, mmap_meta_file), 'w') as f:
+        json.dump(meta, f)
+
+
+def open_embeddings_mmap(storeFilePath, with_vocabulary=True):
+    """
+    Open a memory-mapped embeddings store, return the read-only matrix, the per-vector scales 
+    of int8 values (None for the other value types), the vocabulary index (None if not requested) 
+    and the metadata of the store
+    """
+    with open(os.path.join(storeFilePath, mmap_meta_file)) as f:
+        meta = json.load(f)
+    matrix = np.load(os.path.join(storeFilePath, mmap_vectors_file), mmap_mode='r')
+    scales = None
+    if meta["dtype"] == 'int8':
+        scales = np.load(os.path.join(storeFilePath, mmap_scales_file), mmap_mode='r')
+    vocabulary = None
+    if with_vocabulary:
+        vocabulary = SortedVocabulary(os.path.join(storeFilePath, mmap_words_file), 
+            os.path.join(storeFilePath, mmap_offsets_file))
+    return matrix, scales, vocabulary, meta
+
+
+# LMDB environments inherited through a fork, kept referenced and never closed in the child 
+# process: closing them would release reader slots which belong to the parent process
+_inherited_environments = []
+
+
+def _open_environment(path, inherited=None, **kwargs):
+    """
+    Open the LMDB environment of path in the current process, inherited being the environment 
+    opened on the same path before the fork of the current process, if any
+    """
+    if inherited is None:
+        return lmdb.open(path, **kwargs)
+    _inherited_environments.append(inherited)
+    try:
+        return lmdb.open(path, **kwargs)
+    except lmdb.Error:
+        # recent py-lmdb versions refuse to open again the files of an environment still open 
+        # in the process. They do not abort the inherited transactions after a fork, and without 
+        # spare transactions closing the environment only releases the reader slots of this process
+        _inherited_environments.remove(inherited)
+        inherited.close()
+        return lmdb.open(path, **kwargs)
+
+
+class ProcessLocalEnvironment(object):
+    """
+    LMDB environment opened lazily by each process, as an environment must not be used across a 
+    fork (e.g. by the data generator workers with use_multiprocessing). Nested reads of a thread 
+    share the same transaction. Readahead is disabled by default, the lookups being random 
+    accesses. There are no spare transactions by default: the reader slot of a spare transaction 
+    would be released by a forked process closing its copy of the environment.
+    """
+    def __init__(self, path, **kwargs):
+        kwargs.setdefault('readahead', False)
+        kwargs.setdefault('max_spare_txns', 0)
+        self.path = path
+        self.kwargs = kwargs
+        self.pid = None
+        self.env = None
+        # held only while the environment of the current process is opened
+        self.open_lock = threading.Lock()
+
+    def _open(self):
+        if self.pid != os.getpid():
+            with self.open_lock:
+                # checked again, the environment may have been opened by another thread meanwhile
+                if self.pid != os.getpid():
+                    # self.env, if any, is the environment inherited from the parent process
+                    self.env = _open_environment(self.path, self.env, **self.kwargs)
+                    self.local = threading.local()
+                    self.pid = os.getpid()
+        return self.env
+
+    @contextmanager
+    def read(self):
+        """
+        Read transaction of the current thread, with buffers valid only within the transaction
+        """
+        env = self._open()
+        local = self.local
+        if getattr(local, 'depth', 0) > 0:
+            # nested read in the same thread
+            local.depth += 1
+            try:
+                yield local.txn
+            finally:
+                local.depth -= 1
+            return
+        local.txn = env.begin(buffers=True)
+        local.depth = 1
+        try:
+            yield local.txn
+        finally:
+            local.depth = 0
+            local.txn.abort()
+            local.txn = None
+
+    def write(self):
+        return self._open().begin(write=True)
+
+    def close(self):
+        if self.env is not None:
+            if self.pid == os.getpid():
+                self.env.close()
+            else:
+                # inherited from the parent process
+                _inherited_environments.append(self.env)
+        self.env = None
+        self.pid = None
+
+
+class LookupStats(object):
+    """
+    Counters and timings of the embeddings lookups, kept in shared memory so that the lookups done 
+    by the data generator workers forked by Keras are counted with the ones of the main process. 
+    Each process increments its own local counters without lock. They are merged into the shared 
+    counters by the first increment made after lookup_stats_flush_size increments or 
+    lookup_stats_flush_interval seconds since the last merge, by a snapshot taken in the process 
+    and when the process exits normally. A snapshot may thus miss the last increments of the 
+    other processes, for as long as a worker does not count a new lookup, and the last increments 
+    of a worker terminated by a signal are lost.
+    """
+    counters = ['lookups', 'cache_hits', 'oov', 'lmdb_reads', 'lmdb_read_time', 
+                'ELMo_forward_calls', 'ELMo_forward_time', 'ELMo_sentences', 'ELMo_cache_hits', 
+                'BERT_forward_calls', 'BERT_forward_time', 'BERT_sentences', 'BERT_cache_hits']
+
+    def __init__(self):
+        self.index = dict((name, i) for i, name in enumerate(self.counters))
+        # the counters are followed by the buckets of the LMDB read latency histogram
+        self.size = len(self.counters) + len(lmdb_latency_buckets) + 1
+        self.values = multiprocessing.RawArray('d', self.size)
+        self.lock = multiprocessing.Lock()
+        self.pid = os.getpid()
+        self._reset_local()
+
+    def _reset_local(self):
+        self.local_values = [0] * self.size
+        self.local_increments = 0
+        self.flush_time = time.monotonic()
+
+    def _check_process(self):
+        if self.pid != os.getpid():
+            # local counters inherited by a forked process are merged by the parent process
+            self.pid = os.getpid()
+            self._reset_local()
+            multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def flush(self):
+        """
+        Merge the local counters of the current process into the shared counters
+        """
+        self._check_process()
+        values = self.local_values
+        self._reset_local()
+        with self.lock:
+            for i, value in enumerate(values):
+                if value:
+                    self.values[i] += value
+
+    def add(self, read_time=None, **increments):
+        """
+        Increment the given counters, with read_time the duration in seconds of a LMDB read
+        """
+        if self.pid != os.getpid():
+            self._check_process()
+        values = self.local_values
+        index = self.index
+        for name, value in increments.items():
+            values[index[name]] += value
+        if read_time is not None:
+            values[index['lmdb_reads']] += 1
+            values[index['lmdb_read_time']] += read_time
+            bucket = bisect.bisect_left(lmdb_latency_buckets, read_time * 1000)
+            values[len(self.counters) + bucket] += 1
+        self.local_increments += 1
+        if self.local_increments >= lookup_stats_flush_size or time.monotonic() - self.flush_time >= lookup_stats_flush_interval:
+            self.flush()
+
+    def snapshot(self):
+        """
+        Values of the counters, with the ones of the current process up to date
+        """
+        self.flush()
+        with self.lock:
+            values = list(self.values)
+        snapshot = {}
+        for name, i in self.index.items():
+            snapshot[name] = values[i] if name.endswith('_time') else int(values[i])
+        histogram = OrderedDict()
+        for i, bound in enumerate(lmdb_latency_buckets):
+            histogram['<=' + str(bound) + 'ms'] = int(values[len(self.counters) + i])
+        histogram['>' + str(lmdb_latency_buckets[-1]) + 'ms'] = int(values[-1])
+        snapshot['lmdb_read_latency'] = histogram
+        return snapshot
+
+    @staticmethod
+    def difference(snapshot, since):
+        """
+        Increments of the counters of snapshot since an earlier snapshot
+        """
+        difference = dict((name, value - since[name]) for name, value in snapshot.items() if name != 'lmdb_read_latency')
+        difference['lmdb_read_latency'] = OrderedDict((bucket, count - since['lmdb_read_latency'][bucket]) 
+            for bucket, count in snapshot['lmdb_read_latency'].items())
+        return difference
+
+
+class VectorCache(object):
+    """
+    Bounded LRU cache of decoded static vectors, keyed by normalized token. Entries inherited by a 
+    forked process (e.g. a data generator worker) remain valid, but the lock is renewed in the new 
+    process. Its hits are counted by the LookupStats of the embeddings, over all the processes.
+    """
+    def __init__(self, max_size=default_cache_size):
+        self.max_size = max_size
+        self.vectors = OrderedDict()
+        self._init_process()
+
+    def _init_process(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def _check_process(self):
+        if self.pid != os.getpid():
+            self._init_process()
+
+    def get(self, word):
+        if self.max_size <= 0:
+            return None
+        self._check_process()
+        with self.lock:
+            vector = self.vectors.get(word)
+            if vector is None:
+                return None
+            self.vectors.move_to_end(word)
+            return vector
+
+    def put(self, word, vector):
+        if self.max_size <= 0:
+            return
+        # cached vectors are shared by the callers
+        vector.flags.writeable = False
+        self._check_process()
+        with self.lock:
+            self.vectors[word] = vector
+            self.vectors.move_to_end(word)
+            while len(self.vectors) > self.max_size:
+                self.vectors.popitem(last=False)
+
+    def clear(self):
+        self._check_process()
+        with self.lock:
+            self.vectors.clear()
+
+    def stats(self):
+        """
+        Size of the cache in the current process
+        """
+        return {
+            "size": len(self.vectors),
+            "max_size": self.max_size
+        }
+
+
+class ContextualCache(object):
+    """
+    Persistent cache of the contextual embeddings of sentences, with a budget in bytes and LRU 
+    eviction. The entries are the (sentence length, embed size) vectors of the tokens of a 
+    sentence, keyed by the fingerprint of the contextual model and the digest of the token list, 
+    so that the cache remains valid across runs and can be shared by several processes. 
+
+    The recency of the entries read is recorded with the next write, or every 
+    contextual_cache_touch_size reads, to avoid a write transaction per lookup.
+    """
+    def __init__(self, path, fingerprint, embed_size, max_size, dtype='float32'):
+        self.path = path
+        self.fingerprint = fingerprint.encode(encoding='UTF-8')
+        self.embed_size = embed_size
+        self.max_size = max_size
+        if dtype not in lmdb_dtypes:
+            raise ValueError('unsupported dtype for the contextual embeddings cache: ' + str(dtype))
+        self.dtype = dtype
+        self.pid = None
+        self.env = None
+        self.open_lock = threading.Lock()
+
+    def _open(self):
+        # an LMDB environment must not be used across a fork, each process opens its own
+        if self.pid != os.getpid():
+            with self.open_lock:
+                if self.pid != os.getpid():
+                    if not os.path.exists(self.path):
+                        os.makedirs(self.path)
+                    # self.env, if any, is the environment inherited from the parent process
+                    self.env = _open_environment(self.path, self.env, map_size=max(2 * self.max_size, 1 << 30), 
+                        max_dbs=4, max_readers=2048, max_spare_txns=0)
+                    self.entries_db = self.env.open_db(b'entries')
+                    self.stamps_db = self.env.open_db(b'stamps')
+                    self.lru_db = self.env.open_db(b'lru')
+                    self.meta_db = self.env.open_db(b'meta')
+                    self.lock = threading.Lock()
+                    self.touched = set()
+                    self.pid = os.getpid()
+        return self.env
+
+    def close(self):
+        if self.env is not None:
+            if self.pid == os.getpid():
+                self.env.close()
+            else:
+                # inherited from the parent process
+                _inherited_environments.append(self.env)
+        self.env = None
+        self.pid = None
+
+    def _key(self, tokens):
+        return self.fingerprint + list_digest(tokens).encode(encoding='UTF-8')
+
+    def get(self, token_list):
+        """
+        Cached vectors of each sentence of the list, None for the sentences not in the cache
+        """
+        env = self._open()
+        results = []
+        hits = []
+        with env.begin(db=self.entries_db) as txn:
+            for tokens in token_list:
+                key = self._key(tokens)
+                value = txn.get(key)
+                if value is None:
+                    results.append(None)
+                    continue
+                results.append(_deserialize_matrix(value, self.embed_size, self.dtype))
+                hits.append(key)
+        touched = self._take_touched(hits, contextual_cache_touch_size)
+        if len(touched) > 0:
+            try:
+                with env.begin(write=True) as txn:
+                    self._touch(txn, self._next_stamp(txn), touched)
+            except lmdb.MapFullError:
+                # the recency of these entries is not recorded, they are still cached
+                pass
+        return results
+
+    def put(self, token_list, vectors):
+        """
+        Cache the vectors of each sentence of the list, only the rows of the actual tokens are kept. 
+        When the map of the cache is full (e.g. fragmented, or smaller than the budget), the least 
+        recently used half of the entries is evicted before trying again. The cache being only an 
+        optimization, the vectors are not cached if they do not fit in the emptied map.
+        """
+        env = self._open()
+        while True:
+            try:
+                self._put(env, token_list, vectors)
+                return
+            except lmdb.MapFullError:
+                pass
+            try:
+                with env.begin(write=True) as txn:
+                    size = self._read_int(txn, b'size')
+                    if size > 0:
+                        size = self._evict(txn, size, size // 2)
+                        txn.put(b'size', struct.pack('<Q', size), db=self.meta_db)
+            except lmdb.MapFullError:
+                # no page left even to evict, the whole cache is cleared
+                size = self._clear(env)
+            if size == 0:
+                break
+        print("Warning: contextual embeddings cache", self.path, "is full, vectors not cached")
+
+    def _clear(self, env):
+        try:
+            with env.begin(write=True) as txn:
+                for db in [self.entries_db, self.stamps_db, self.lru_db, self.meta_db]:
+                    txn.drop(db, delete=False)
+        except lmdb.MapFullError:
+            pass
+        return 0
+
+    def _put(self, env, token_list, vectors):
+        with env.begin(write=True) as txn:
+            stamp = self._next_stamp(txn)
+            size = self._read_int(txn, b'size')
+            keys = []
+            for tokens, vector in zip(token_list, vectors):
+                key = self._key(tokens)
+                value = _serialize_matrix(vector[:len(tokens)], self.dtype)
+                previous = txn.get(key, db=self.entries_db)
+                if previous is not None:
+                    size -= len(previous)
+                txn.put(key, value, db=self.entries_db)
+                size += len(value)
+                keys.append(key)
+            self._touch(txn, stamp, self._take_touched(keys))
+            size = self._evict(txn, size)
+            txn.put(b'size', struct.pack('<Q', size), db=self.meta_db)
+
+    def _take_touched(self, keys, min_size=0):
+        # add the keys to the recently read ones and take them all if there are at least min_size
+        with self.lock:
+            self.touched.update(keys)
+            if len(self.touched) < min_size:
+                return set()
+            touched = self.touched
+            self.touched = set()
+            return touched
+
+    def _read_int(self, txn, key):
+        value = txn.get(key, db=self.meta_db)
+        if value is None:
+            return 0
+        return struct.unpack('<Q', value)[0]
+
+    def _next_stamp(self, txn):
+        # logical clock shared by the processes, incremented by each write transaction
+        stamp = self._read_int(txn, b'clock') + 1
+        txn.put(b'clock', struct.pack('<Q', stamp), db=self.meta_db)
+        return struct.pack('>Q', stamp)
+
+    def _touch(self, txn, stamp, keys):
+        # the keys of the lru database are the big-endian stamps followed by the entry keys, 
+        # so that a cursor iterates from the least recently used entry
+        for key in keys:
+            if txn.get(key, db=self.entries_db) is None:
+                # evicted meanwhile
+                continue
+            previous = txn.get(key, db=self.stamps_db)
+            if previous is not None:
+                txn.delete(previous + key, db=self.lru_db)
+            txn.put(key, stamp, db=self.stamps_db)
+            txn.put(stamp + key, b'', db=self.lru_db)
+
+    def _evict(self, txn, size, max_size=None):
+        # evict the least recently used entries until their size is at most max_size, by default 
+        # the budget of the cache
+        if max_size is None:
+            max_size = self.max_size
+        if size <= max_size:
+            return size
+        cursor = txn.cursor(db=self.lru_db)
+        cursor.first()
+        while size > max_size and cursor.key():
+            key = cursor.key()[8:]
+            value = txn.get(key, db=self.entries_db)
+            if value is not None:
+                size -= len(value)
+                txn.delete(key, db=self.entries_db)
+            txn.delete(key, db=self.stamps_db)
+            # deleting at the cursor position moves it to the next entry
+            cursor.delete()
+        return size
+
+    def stats(self):
+        """
+        Number of entries and size in bytes of the cached vectors
+        """
+        env = self._open()
+        with env.begin() as txn:
+            return {
+                "entries": txn.stat(self.entries_db)["entries"],
+                "size": self._read_int(txn, b'size'),
+                "max_size": self.max_size
+            }
+
+
+def contextual_model_fingerprint(paths, options=()):
+    """
+    Fingerprint of the files of a contextual model (configuration and weights), based on their 
+    path, size and modification time so that it is cheap to compute for large checkpoints. A 
+    TensorFlow checkpoint is given by its prefix, its index file is used. Options changing the 
+    embeddings computed with the model are added to the fingerprint.
+    """
+    hash = hashlib.sha1()
+    for path in paths:
+        if path is None:
+            continue
+        if not os.path.isfile(path) and os.path.isfile(path + '.index'):
+            path = path + '.index'
+        hash.update(os.path.abspath(path).encode(encoding='UTF-8'))
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            hash.update(struct.pack('<QQ', stat.st_size, int(stat.st_mtime)))
+    for option in options:
+        hash.update(str(option).encode(encoding='UTF-8'))
+    return hash.hexdigest()[:16]
+
+
+class QuantizedEmbeddings(object):
+    """
+    View of static embeddings with their vectors quantized and dequantized on the fly, to measure 
+    the effect of a quantized storage on a model without compiling the store
+    """
+    def __init__(self, embeddings, dtype='int8'):
+        if dtype not in lmdb_dtypes:
+            raise ValueError('unsupported embeddings value type: ' + dtype + ', expected one of ' + str(lmdb_dtypes))
+        self.embeddings = embeddings
+        self.dtype = dtype
+
+    def __getattr__(self, name):
+        if name == 'embeddings':
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def get_word_vector(self, word):
+        return self.get_word_vectors([word])[0]
+
+    def get_word_vectors(self, words, out=None):
+        out = self.embeddings.get_word_vectors(words, out)
+        values, scales = _quantize_matrix(out[:len(words)], self.dtype)
+        out[:len(words)] = _dequantize_matrix(values, scales)
+        return out
+
+    # the contextual embeddings are computed by the wrapped embeddings, their static part is 
+    # looked up with the quantized vectors
+
+    def get_sentence_vector_with_ELMo(self, token_list):
+        return Embeddings.get_sentence_vector_with_ELMo(self, token_list)
+
+    def get_sentence_vector_with_BERT(self, token_list):
+        return Embeddings.get_sentence_vector_with_BERT(self, token_list)
+
+    def concatenate_static_vectors(self, token_list, contextual_result):
+        return Embeddings.concatenate_static_vectors(self, token_list, contextual_result)
+
+
+def quantization_score_delta(model, x_test, y_test, dtype='int8'):
+    """
+    Evaluate a Sequence or Classifier model on held-out data, first with its static embeddings 
+    (normally a float32 store) then with these embeddings quantized as dtype values, and report 
+    the score delta
+    """
+    reference_score = model.eval(x_test, y_test)
+    embeddings = model.embeddings
+    model.embeddings = QuantizedEmbeddings(embeddings, dtype)
+    try:
+        quantized_score = model.eval(x_test, y_test)
+    finally:
+        model.embeddings = embeddings
+    delta = quantized_score - reference_score
+    print("\nscore with the original embeddings:", "{:10.4f}".format(reference_score))
+    print("score with", dtype, "embeddings:", "{:10.4f}".format(quantized_score))
+    print("delta:", "{:+10.4f}".format(delta))
+    return delta
+
+
+def compile_subwords(binFilePath, storeFilePath, dtype='float32', block_size=100000):
+    """
+    Extract from a fastText .bin model the vectors of the char n-gram buckets into a memory-mapped 
+    store, with the n-gram parameters of the model. Quantized (.ftz) models are not supported.
+    """
+    if dtype not in lmdb_dtypes:
+        raise ValueError('unsupported embeddings value type: ' + dtype + ', expected one of ' + str(lmdb_dtypes))
+    with open(binFilePath, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version = struct.unpack_from('<ii', data, 0)
+        if magic != fasttext_magic:
+            raise ValueError(binFilePath + ' is not a fastText .bin model')
+        # dim, ws, epoch, minCount, neg, wordNgrams, loss, model, bucket, minn, maxn, lrUpdateRate, t
+        args = struct.unpack_from('<12id', data, 8)
+        embed_size, bucket, minn, maxn = args[0], args[8], args[9], args[10]
+
+        # the dictionary is skipped, only its number of words is needed
+        offset = 8 + fasttext_args_size
+        size, nwords, nlabels, ntokens, pruneidx_size = struct.unpack_from('<iiiqq', data, offset)
+        offset += 4 * 3 + 8 * 2
+        for i in range(size):
+            # null-terminated word, int64 count and int8 entry type
+            offset = data.find(b'\x00', offset) + 1 + 8 + 1
+        # the size of the pruning index is -1 for a model which has not been pruned
+        offset += max(pruneidx_size, 0) * 8
+        quant_input = struct.unpack_from('<?', data, offset)[0]
+        offset += 1
+        if quant_input:
+            raise ValueError('quantized fastText models are not supported: ' + binFilePath)
+        m, n = struct.unpack_from('<qq', data, offset)
+        offset += 16
+        if n != embed_size or m != nwords + bucket:
+            raise ValueError('unexpected input matrix size in ' + binFilePath)
+
+        tmpFilePath = storeFilePath + '.compiling'
+        if os.path.isdir(tmpFilePath):
+            shutil.rmtree(tmpFilePath)
+        os.makedirs(tmpFilePath)
+
+        # the n-gram vectors are the rows of the input matrix after the word rows
+        input_matrix = np.memmap(binFilePath, dtype='<f4', mode='r', offset=offset, shape=(m, n))
+        matrix = np.lib.format.open_memmap(os.path.join(tmpFilePath, mmap_vectors_file), mode='w+', 
+            dtype=dtype, shape=(bucket, embed_size))
+        scales = None
+        if dtype == 'int8':
+            scales = np.zeros((bucket,), dtype=np.float32)
+        for start in tqdm(range(0, bucket, block_size)):
+            values, block_scales = _quantize_matrix(input_matrix[nwords+start:nwords+start+block_size], dtype)
+            matrix[start:start+values.shape[0]] = values
+            if scales is not None:
+                scales[start:start+values.shape[0]] = block_scales
+        matrix.flush()
+        del matrix
+        del input_matrix
+        if scales is not None:
+            np.save(os.path.join(tmpFilePath, mmap_scales_file), scales)
+        _write_mmap_meta(tmpFilePath, bucket, embed_size, dtype, minn=minn, maxn=maxn, bucket=bucket)
+    finally:
+        data.close()
+
+    if os.path.isdir(storeFilePath):
+        shutil.rmtree(storeFilePath)
+    os.rename(tmpFilePath, storeFilePath)
+    print('subword vectors compiled for', bucket, "n-gram buckets and", embed_size, "dimensions")
+
+
+def _fasttext_hash(ngram):
+    """
+    FNV-1a hash of the UTF-8 bytes of a n-gram as computed by fastText, where each byte is 
+    sign-extended (signed char) before being combined
+    """
+    h = 2166136261
+    for byte in bytearray(ngram):
+        if byte >= 0x80:
+            byte |= 0xFFFFFF00
+        h = ((h ^ byte) * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def _subword_buckets(word, minn, maxn, bucket):
+    """
+    Buckets of the char n-grams of a word like fastText: n-grams of minn to maxn characters of 
+    the word delimited by < and >, excluding the delimiters alone
+    """
+    word = ('<' + word + '>').encode(encoding='UTF-8')
+    size = len(word)
+    buckets = []
+    for i in range(size):
+        if word[i] & 0xC0 == 0x80:
+            # continuation byte of a UTF-8 character
+            continue
+        j = i
+        n = 1
+        while j < size and n <= maxn:
+            j += 1
+            while j < size and word[j] & 0xC0 == 0x80:
+                j += 1
+            if n >= minn and not (n == 1 and (i == 0 or j == size)):
+                buckets.append(_fasttext_hash(word[i:j]) % bucket)
+            n += 1
+    return buckets
+
+
+class SubwordVectors(object):
+    """
+    Memory-mapped char n-gram vectors of a fastText model: the vector of an unknown word is the 
+    average of the vectors of its n-grams, as fastText does
+    """
+    def __init__(self, storeFilePath):
+        self.matrix, self.scales, _, meta = open_embeddings_mmap(storeFilePath, with_vocabulary=False)
+        self.minn = meta["minn"]
+        self.maxn = meta["maxn"]
+        self.bucket = meta["bucket"]
+        self.embed_size = meta["embed_size"]
+
+    def get_word_vectors(self, words):
+        """
+        Vectors of a list of words as a (nb words, embed size) float32 matrix, the distinct n-gram 
+        rows of all the words being read and dequantized together
+        """
+        out = np.zeros((len(words), self.embed_size), dtype=np.float32)
+        owners = []
+        buckets = []
+        for i, word in enumerate(words):
+            word_buckets = _subword_buckets(word, self.minn, self.maxn, self.bucket)
+            owners.extend([i] * len(word_buckets))
+            buckets.extend(word_buckets)
+        if len(buckets) == 0:
+            return out
+        rows, inverse = np.unique(np.array(buckets, dtype=np.int64), return_inverse=True)
+        scales = None
+        if self.scales is not None:
+            scales = self.scales[rows]
+        vectors = _dequantize_matrix(self.matrix[rows], scales)
+        owners = np.array(owners, dtype=np.int64)
+        np.add.at(out, owners, vectors[inverse.reshape(-1)])
+        counts = np.bincount(owners, minlength=len(words))
+        out[counts > 0] /= counts[counts > 0, None]
+        return out
+
+
+class SortedVocabulary(object):
+    """
+    Read-only word to row index of a memory-mapped embeddings store: a binary search over the 
+    memory-mapped sorted UTF-8 words, so that the index is shared by the processes like the matrix
+    """
+    def __init__(self, words_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        self.size = self.offsets.shape[0] - 1
+        if self.size == 0:
+            # an empty file cannot be memory-mapped
+            self.words = b''
+        else:
+            with open(words_path, 'rb') as f:
+                self.words = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def get(self, word, default=None):
+        key = word.encode(encoding='UTF-8')
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self.words[int(self.offsets[middle]):int(self.offsets[middle+1])]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return middle
+        return default
+
+
 def _get_num_lines(file_path):
     fp = open(file_path, "r+")
     buf = mmap.mmap(fp.fileno(), 0)
@@ -812,3 +2898,48 @@ def test():
     vect = embeddings.get_sentence_vector_only_BERT(token_list)
 
     embeddings.clean_BERT_cache()
+
+
+if __name__ == "__main__":
+    # usage example - rewrite the compiled LMDB database of glove-840B with the current layout:
+    # > python3 -m delft.utilities.Embeddings migrate --embedding glove-840B
+    # add the vectors of a .vec file to the compiled LMDB database of glove-840B:
+    # > python3 -m delft.utilities.Embeddings update --embedding glove-840B --vectors domain.vec
+    parser = argparse.ArgumentParser(
+        description = "Management of the compiled static embeddings databases")
+
+    parser.add_argument("action", help="one of [migrate, update]")
+    parser.add_argument("--embedding", required=True, help="name of the embeddings as described in the embeddings registry") 
+    parser.add_argument("--registry", default='./embedding-registry.json', help="path to the embeddings registry") 
+    parser.add_argument("--dtype", default='float32', help="type of the stored vector values, one of " + str(lmdb_dtypes)) 
+    parser.add_argument("--vectors", default=None, help="path to the .vec/.txt file of the vectors to add with the update action") 
+    parser.add_argument("--no-header", action="store_true", help="the file of the vectors to add has no header line") 
+    parser.add_argument("--keep-existing", action="store_true", help="do not replace the vectors of the words already in the database") 
+
+    args = parser.parse_args()
+
+    if args.action == 'migrate' or args.action == 'update':
+        registry_json = open(args.registry).read()
+        registry = json.loads(registry_json)
+        embedding_lmdb_path = registry["embedding-lmdb-path"]
+        if embedding_lmdb_path is None or embedding_lmdb_path == "None":
+            raise ValueError('embedding-lmdb-path is not specified in the embeddings registry, there is no database to ' + args.action)
+        envFilePath = os.path.join(embedding_lmdb_path, args.embedding)
+        storage = "lmdb"
+        for description in registry["embeddings"]:
+            if description["name"] == args.embedding:
+                storage = description.get("storage", "lmdb")
+        if args.action == 'migrate':
+            if storage == "mmap":
+                raise ValueError('migrate applies to LMDB databases, the memory-mapped (mmap) store of ' + args.embedding + 
+                    ' is compiled again when its dtype changes in the registry')
+            migrate_embeddings_lmdb(envFilePath, dtype=args.dtype)
+        else:
+            if args.vectors is None:
+                raise ValueError('the vectors to add to the database are given with --vectors')
+            if storage == "mmap":
+                update_embeddings_mmap(envFilePath + '.mmap', args.vectors, hasHeader=not args.no_header, overwrite=not args.keep_existing)
+            else:
+                update_embeddings_lmdb(envFilePath, args.vectors, hasHeader=not args.no_header, overwrite=not args.keep_existing)
+    else:
+        raise ValueError('unknown action: ' + args.action)
@@ -0,0 +1,196 @@
+# Local embeddings lookup service: one process holds the static embeddings and serves batched
+# lookups over a unix socket to the Embeddings instances of all the processes of the host
+# which use the same embeddings (for instance a fleet of tagging workers)
+
+import os
+import json
+import socket
+import socketserver
+import struct
+import threading
+import argparse
+import numpy as np
+
+# request types
+request_info = b'I'
+request_vectors = b'V'
+
+
+def _recv_exactly(sock, size):
+    """
+    Read exactly size bytes from the socket, None if the connection is closed before
+    """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _encode_words(words):
+    """
+    Batch of words as: number of words, UTF-8 length of each word (uint32 little-endian),
+    then the concatenated UTF-8 words
+    """
+    keys = [word.encode(encoding='UTF-8') for word in words]
+    lengths = np.array([len(key) for key in keys], dtype='<u4')
+    return struct.pack('<I', len(keys)) + lengths.tobytes() + b''.join(keys)
+
+
+def _read_words(sock):
+    """
+    Batch of words encoded by _encode_words, None if the connection is closed before its end
+    """
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    nb_words = struct.unpack('<I', header)[0]
+    lengths = _recv_exactly(sock, 4 * nb_words)
+    if lengths is None:
+        return None
+    lengths = np.frombuffer(lengths, dtype='<u4')
+    data = _recv_exactly(sock, int(lengths.sum()))
+    if data is None:
+        return None
+    words = []
+    offset = 0
+    for length in lengths:
+        words.append(data[offset:offset+length].decode('UTF-8'))
+        offset += length
+    return words
+
+
+class EmbeddingsRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serve the requests of a client connection until it is closed. Responses are a uint32
+    length followed by the JSON information of the embeddings, or the float32 little-endian
+    matrix of the requested vectors.
+    """
+    def handle(self):
+        embeddings = self.server.embeddings
+        while True:
+            request_type = _recv_exactly(self.request, 1)
+            if request_type is None:
+                return
+            if request_type == request_info:
+                info = json.dumps({
+                    "name": embeddings.name,
+                    "lang": embeddings.lang,
+                    "vocab_size": embeddings.vocab_size,
+                    "embed_size": embeddings.static_embed_size
+                }).encode('UTF-8')
+                self.request.sendall(struct.pack('<I', len(info)) + info)
+            elif request_type == request_vectors:
+                words = _read_words(self.request)
+                if words is None:
+                    return
+                vectors = embeddings.get_word_vectors(words).astype('<f4', copy=False)
+                self.request.sendall(struct.pack('<I', vectors.nbytes) + vectors.tobytes())
+            else:
+                return
+
+
+def _is_listening(socket_path):
+    """
+    True if a server accepts connections on the unix socket
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except ConnectionRefusedError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class EmbeddingsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, embeddings):
+        self.embeddings = embeddings
+        if os.path.exists(socket_path):
+            if _is_listening(socket_path):
+                raise OSError('an embeddings server is already listening on ' + socket_path)
+            # remaining socket file of a previous server
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, EmbeddingsRequestHandler)
+
+
+class EmbeddingsClient(object):
+    """
+    Client of an embeddings server. Each thread of each process uses its own connection, so
+    a client can be shared by data generator threads and inherited by forked workers.
+    """
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.local = threading.local()
+        self.info = self._info()
+
+    def _connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.local.sock.connect(self.socket_path)
+            self.local.pid = os.getpid()
+        return self.local.sock
+
+    def _request(self, message):
+        sock = self._connection()
+        try:
+            sock.sendall(message)
+            header = _recv_exactly(sock, 4)
+            if header is None:
+                raise OSError('embeddings server closed the connection: ' + self.socket_path)
+            return _recv_exactly(sock, struct.unpack('<I', header)[0])
+        except OSError:
+            # the connection will be opened again at the next request
+            self.local.pid = None
+            sock.close()
+            raise
+
+    def _info(self):
+        return json.loads(self._request(request_info).decode('UTF-8'))
+
+    def get_word_vectors(self, words):
+        """
+        Vectors of a list of words as a (nb words, embed size) float32 matrix
+        """
+        if len(words) == 0:
+            return np.zeros((0, self.info["embed_size"]), dtype=np.float32)
+        data = self._request(request_vectors + _encode_words(words))
+        return np.frombuffer(data, dtype='<f4').reshape((len(words), self.info["embed_size"]))
+
+
+def serve(name, registry_path='./embedding-registry.json', socket_path=None):
+    from delft.utilities.Embeddings import Embeddings
+    embeddings = Embeddings(name, path=registry_path, use_server=False)
+    if socket_path is None:
+        description = embeddings._get_description(name)
+        if description is not None:
+            socket_path = description.get("server")
+    if socket_path is None:
+        raise ValueError('no socket path given for the embeddings server of ' + name)
+    server = EmbeddingsServer(socket_path, embeddings)
+    print('serving embeddings', name, 'on', socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local server of static embeddings")
+    parser.add_argument("--embedding", required=True, help="name of the embeddings to serve, as in the registry")
+    parser.add_argument("--registry", default='./embedding-registry.json', help="path to the embeddings registry")
+    parser.add_argument("--socket", default=None, help="path of the unix socket, by default the \"server\" attribute of the embeddings in the registry")
+    args = parser.parse_args()
+
+    try:
+        serve(args.embedding, args.registry, args.socket)
+    except KeyboardInterrupt:
+        print('embeddings server stopped')
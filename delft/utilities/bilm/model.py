@@ -11,6 +11,10 @@ from .data import UnicodeCharsVocabulary, Batcher
 DTYPE = 'float32'
 DTYPE_INT = 'int64'
 
+# layout of the files written by dump_bilm_embeddings, stored in their 'format' attribute.
+# The files of bilm-tf have no such attribute and one dataset per sentence.
+BILM_EMBEDDINGS_FORMAT = 2
+
 
 class BidirectionalLanguageModel(object):
     def __init__(
@@ -20,6 +24,7 @@ class BidirectionalLanguageModel(object):
             use_character_inputs=True,
             embedding_weight_file=None,
             max_batch_size=128,
+            use_token_embedding_inputs=False,
         ):
         '''
         Creates the language model computational graph and loads weights
@@ -40,6 +45,11 @@ class BidirectionalLanguageModel(object):
         use_character_inputs: if True, then use character ids as input,
             otherwise use token ids
         max_batch_size: the maximum allowable batch size 
+        use_token_embedding_inputs: with character inputs, if True the
+            token embeddings of a part of the tokens are fed precomputed
+            with the placeholders token_embeddings_placeholder and
+            precomputed_placeholder of the graph, the char CNN runs only
+            on the other tokens
         '''
         with open(options_file, 'r') as fin:
             options = json.load(fin)
@@ -56,6 +66,7 @@ class BidirectionalLanguageModel(object):
         self._embedding_weight_file = embedding_weight_file
         self._use_character_inputs = use_character_inputs
         self._max_batch_size = max_batch_size
+        self._use_token_embedding_inputs = use_token_embedding_inputs
 
         self._ops = {}
         self._graphs = {}
@@ -95,7 +106,8 @@ class BidirectionalLanguageModel(object):
                     ids_placeholder,
                     embedding_weight_file=self._embedding_weight_file,
                     use_character_inputs=self._use_character_inputs,
-                    max_batch_size=self._max_batch_size)
+                    max_batch_size=self._max_batch_size,
+                    use_token_embedding_inputs=self._use_token_embedding_inputs)
             else:
                 with tf.variable_scope('', reuse=True):
                     lm_graph = BidirectionalLanguageModelGraph(
@@ -104,7 +116,8 @@ class BidirectionalLanguageModel(object):
                         ids_placeholder,
                         embedding_weight_file=self._embedding_weight_file,
                         use_character_inputs=self._use_character_inputs,
-                        max_batch_size=self._max_batch_size)
+                        max_batch_size=self._max_batch_size,
+                        use_token_embedding_inputs=self._use_token_embedding_inputs)
 
             ops = self._build_ops(lm_graph)
             self._ops[ids_placeholder] = ops
@@ -250,12 +263,13 @@ class BidirectionalLanguageModelGraph(object):
     '''
     def __init__(self, options, weight_file, ids_placeholder,
                  use_character_inputs=True, embedding_weight_file=None,
-                 max_batch_size=128):
+                 max_batch_size=128, use_token_embedding_inputs=False):
 
         self.options = options
         self._max_batch_size = max_batch_size
         self.ids_placeholder = ids_placeholder
         self.use_character_inputs = use_character_inputs
+        self.use_token_embedding_inputs = use_token_embedding_inputs
 
         # this custom_getter will make all variables not trainable and
         # override the default initializer
@@ -325,6 +339,21 @@ class BidirectionalLanguageModelGraph(object):
         elif cnn_options['activation'] == 'relu':
             activation = tf.nn.relu
 
+        if self.use_token_embedding_inputs:
+            # the token embeddings are fed for the precomputed tokens (null
+            # for the others), the char CNN runs on the other tokens only,
+            # as a batch of one sequence
+            self.token_embeddings_placeholder = tf.placeholder(
+                DTYPE, shape=(None, None, projection_dim))
+            self.precomputed_placeholder = tf.placeholder(
+                tf.bool, shape=(None, None))
+            positions = tf.where(
+                tf.logical_not(self.precomputed_placeholder))
+            char_ids = tf.expand_dims(
+                tf.gather_nd(self.ids_placeholder, positions), 0)
+        else:
+            char_ids = self.ids_placeholder
+
         # the character embeddings
         with tf.device("/cpu:0"):
             self.embedding_weights = tf.get_variable(
@@ -334,7 +363,7 @@ class BidirectionalLanguageModelGraph(object):
             )
             # shape (batch_size, unroll_steps, max_chars, embed_dim)
             self.char_embedding = tf.nn.embedding_lookup(self.embedding_weights,
-                                                    self.ids_placeholder)
+                                                    char_ids)
 
         # the convolutions
         def make_convolutions(inp):
@@ -453,6 +482,12 @@ class BidirectionalLanguageModelGraph(object):
             shp = tf.concat([batch_size_n_tokens, [projection_dim]], axis=0)
             embedding = tf.reshape(embedding, shp)
 
+        if self.use_token_embedding_inputs:
+            embedding = self.token_embeddings_placeholder + tf.scatter_nd(
+                positions, embedding[0],
+                tf.shape(self.token_embeddings_placeholder, out_type=tf.int64))
+            embedding.set_shape([None, None, projection_dim])
+
         # at last assign attributes for remainder of the model
         self.embedding = embedding
 
@@ -598,11 +633,13 @@ class BidirectionalLanguageModelGraph(object):
         self.update_state_op = tf.group(*update_ops)
 
 
-def dump_token_embeddings(vocab_file, options_file, weight_file, outfile):
+def dump_token_embeddings(vocab_file, options_file, weight_file, outfile,
+                          batch_size=1024):
     '''
     Given an input vocabulary file, dump all the token embeddings to the
     outfile.  The result can be used as the embedding_weight_file when
-    constructing a BidirectionalLanguageModel.
+    constructing a BidirectionalLanguageModel. The tokens are processed
+    by batches of batch_size tokens.
     '''
     with open(options_file, 'r') as fin:
         options = json.load(fin)
@@ -625,13 +662,15 @@ def dump_token_embeddings(vocab_file, options_file, weight_file, outfile):
     config = tf.ConfigProto(allow_soft_placement=True)
     with tf.Session(config=config) as sess:
         sess.run(tf.global_variables_initializer())
-        for k in range(n_tokens):
-            token = vocab.id_to_word(k)
-            char_ids = batcher.batch_sentences([[token]])[0, 1, :].reshape(
-                1, 1, -1)
-            embeddings[k, :] = sess.run(
+        for start in range(0, n_tokens, batch_size):
+            end = min(start + batch_size, n_tokens)
+            # each token is a sentence of one token, without the
+            # sentence boundaries
+            tokens = [[vocab.id_to_word(k)] for k in range(start, end)]
+            char_ids = batcher.batch_sentences(tokens)[:, 1:2, :]
+            embeddings[start:end, :] = sess.run(
                 embedding_op, feed_dict={ids_placeholder: char_ids}
-            )
+            )[:, 0, :]
 
     with h5py.File(outfile, 'w') as fout:
         ds = fout.create_dataset(
@@ -639,36 +678,111 @@ def dump_token_embeddings(vocab_file, options_file, weight_file, outfile):
         )
 
 def dump_bilm_embeddings(vocab_file, dataset_file, options_file,
-                         weight_file, outfile):
+                         weight_file, outfile, batch_size=64,
+                         sort_window=100, chunk_size=4096):
+    '''
+    Dump the biLM embeddings of the sentences of the dataset file (one
+    sentence of space separated tokens per line) to the outfile.
+
+    The sentences are processed by batches of batch_size sentences of
+    similar lengths, sorted by length among sort_window batches. The
+    embeddings of all the tokens are stored in the chunked and resizable
+    dataset 'embeddings' of shape (nb tokens, nb layers, dim), the
+    embeddings of the sentence i being the rows offsets[i] to
+    offsets[i] + lengths[i] with the datasets 'offsets' and 'lengths'.
+    The file has the attribute 'format' BILM_EMBEDDINGS_FORMAT, use
+    load_bilm_embeddings to read it.
+    '''
     with open(options_file, 'r') as fin:
         options = json.load(fin)
     max_word_length = options['char_cnn']['max_characters_per_token']
 
-    vocab = UnicodeCharsVocabulary(vocab_file, max_word_length)
     batcher = Batcher(vocab_file, max_word_length)
 
     ids_placeholder = tf.placeholder('int32',
                                      shape=(None, None, max_word_length)
     )
-    model = BidirectionalLanguageModel(options_file, weight_file)
+    model = BidirectionalLanguageModel(options_file, weight_file,
+                                       max_batch_size=batch_size)
     ops = model(ids_placeholder)
+    # token layer and LSTM layers, concatenation of the two directions
+    n_layers = options['lstm']['n_layers'] + 1
+    embed_dim = 2 * options['lstm']['projection_dim']
 
     config = tf.ConfigProto(allow_soft_placement=True)
-    with tf.Session(config=config) as sess:
+    with tf.Session(config=config) as sess, \
+            open(dataset_file, 'r') as fin, \
+            h5py.File(outfile, 'w') as fout:
         sess.run(tf.global_variables_initializer())
-        sentence_id = 0
-        with open(dataset_file, 'r') as fin, h5py.File(outfile, 'w') as fout:
-            for line in fin:
-                sentence = line.strip().split()
-                char_ids = batcher.batch_sentences([sentence])
+        ds = fout.create_dataset(
+            'embeddings', (0, n_layers, embed_dim), dtype='float32',
+            maxshape=(None, n_layers, embed_dim),
+            chunks=(chunk_size, n_layers, embed_dim)
+        )
+        offsets_ds = fout.create_dataset(
+            'offsets', (0,), dtype=DTYPE_INT, maxshape=(None,),
+            chunks=(chunk_size,)
+        )
+        lengths_ds = fout.create_dataset(
+            'lengths', (0,), dtype=DTYPE_INT, maxshape=(None,),
+            chunks=(chunk_size,)
+        )
+        fout.attrs['format'] = BILM_EMBEDDINGS_FORMAT
+
+        def _dump_window(first_id, sentences):
+            n_rows = ds.shape[0]
+            lengths = np.array([len(sentence) for sentence in sentences],
+                               dtype=DTYPE_INT)
+            offsets = np.zeros(len(sentences), dtype=DTYPE_INT)
+            order = np.argsort(lengths, kind='mergesort')
+            # the sentences are written in length order
+            ds.resize(n_rows + int(lengths.sum()), axis=0)
+            for start in range(0, len(order), batch_size):
+                batch_ids = order[start:start + batch_size]
+                char_ids = batcher.batch_sentences(
+                    [sentences[k] for k in batch_ids])
                 embeddings = sess.run(
                     ops['lm_embeddings'], feed_dict={ids_placeholder: char_ids}
                 )
-                ds = fout.create_dataset(
-                    '{}'.format(sentence_id),
-                    embeddings.shape[1:], dtype='float32',
-                    data=embeddings[0, :, :, :]
-                )
-
-                sentence_id += 1
+                for i, k in enumerate(batch_ids):
+                    offsets[k] = n_rows
+                    if lengths[k] > 0:
+                        ds[n_rows:n_rows + lengths[k]] = np.transpose(
+                            embeddings[i, :, :lengths[k], :], (1, 0, 2))
+                    n_rows += lengths[k]
+            offsets_ds.resize(first_id + len(sentences), axis=0)
+            offsets_ds[first_id:] = offsets
+            lengths_ds.resize(first_id + len(sentences), axis=0)
+            lengths_ds[first_id:] = lengths
 
+        sentence_id = 0
+        window = []
+        for line in fin:
+            window.append(line.strip().split())
+            if len(window) == batch_size * sort_window:
+                _dump_window(sentence_id, window)
+                sentence_id += len(window)
+                window = []
+        if len(window) > 0:
+            _dump_window(sentence_id, window)
+
+
+def load_bilm_embeddings(fin, sentence_id):
+    '''
+    Embeddings of shape (nb layers, nb tokens, dim) of the sentence
+    sentence_id in the h5py file fin written by dump_bilm_embeddings,
+    or by bilm-tf with one dataset per sentence.
+    '''
+    file_format = fin.attrs.get('format')
+    if file_format is None:
+        if 'embeddings' in fin:
+            raise ValueError('biLM embeddings file without format attribute, '
+                             'it must be dumped again')
+        return fin[str(sentence_id)][...]
+    if file_format != BILM_EMBEDDINGS_FORMAT:
+        raise ValueError('unsupported format of biLM embeddings file: '
+                         + str(file_format) + ', expected '
+                         + str(BILM_EMBEDDINGS_FORMAT))
+    offset = int(fin['offsets'][sentence_id])
+    length = int(fin['lengths'][sentence_id])
+    return np.transpose(fin['embeddings'][offset:offset + length], (1, 0, 2))
@@ -0,0 +1,47 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+
+def write_vec(path, words, matrix, header=True):
+    """
+    Write the vectors of the words as a .vec embeddings file
+    """
+    with open(path, 'w', encoding='UTF-8') as f:
+        if header:
+            f.write(str(len(words)) + ' ' + str(matrix.shape[1]) + '\n')
+        for word, vector in zip(words, matrix):
+            f.write(word + ' ' + ' '.join(repr(float(value)) for value in vector) + '\n')
+
+
+def write_registry(path, lmdb_path, embeddings):
+    """
+    Write an embeddings registry with the given embeddings descriptions
+    """
+    registry = {
+        "embeddings": embeddings,
+        "embeddings-contextualized": [],
+        "embedding-lmdb-path": lmdb_path
+    }
+    with open(path, 'w') as f:
+        json.dump(registry, f)
+    return path
+
+
+@pytest.fixture
+def vectors():
+    """
+    Words, with a few non ASCII ones, and their vectors
+    """
+    words = ['the', 'of', 'été', 'naïve', '日本'] + ['w' + str(i) for i in range(295)]
+    matrix = np.random.RandomState(7).uniform(-1, 1, (len(words), 10)).astype(np.float32)
+    return words, matrix
+
+
+@pytest.fixture
+def vec_file(tmpdir, vectors):
+    path = os.path.join(str(tmpdir), 'vectors.vec')
+    write_vec(path, *vectors)
+    return path
@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+
+import numpy as np
+
+from delft.utilities.Embeddings import Embeddings, LookupStats, _bucket_length, BERT_length_buckets, \
+    BERT_sentence_size, BERT_embed_size
+
+
+class PieceTokenizer(object):
+    """
+    Tokenizer splitting the words in pieces of 3 characters, with [CLS] and [SEP] as the BERT tokenizer
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def tokenize(self, text):
+        self.calls += 1
+        return ['[CLS]'] + [text[i:i+3] for i in range(0, len(text), 3)] + ['[SEP]']
+
+
+class RecordingModel(object):
+    """
+    Model returning the index of each input subtoken as its embeddings, and recording its inputs
+    """
+    def __init__(self):
+        self.inputs = []
+
+    def predict(self, inputs, batch_size=None):
+        self.inputs.append(inputs)
+        indices = inputs[0]
+        return np.repeat(indices[:, :, None].astype(np.float32), BERT_embed_size, axis=2)
+
+
+class Graph(object):
+    @contextmanager
+    def as_default(self):
+        yield
+
+
+def BERT_embeddings(input_size=None):
+    embeddings = object.__new__(Embeddings)
+    embeddings.bert_tokenizer = PieceTokenizer()
+    embeddings.bert_model = RecordingModel()
+    embeddings.bert_input_size = input_size
+    embeddings.bert_token_dict = {'[PAD]': 0, '[UNK]': 1, '[CLS]': 2, '[SEP]': 3, 'abc': 4, 'def': 5}
+    embeddings.graph = Graph()
+    embeddings.lookup_stats = LookupStats()
+    return embeddings
+
+
+def test_bucket_length():
+    assert [_bucket_length(length, BERT_length_buckets) for length in [1, 16, 17, 100, 129, BERT_sentence_size]] == \
+        [16, 16, 32, 128, 256, BERT_sentence_size]
+    # lengths beyond the largest bucket are kept
+    assert _bucket_length(BERT_sentence_size + 1, BERT_length_buckets) == BERT_sentence_size + 1
+    assert _bucket_length(3, [4, 8]) == 4
+
+
+def test_tokenize():
+    embeddings = BERT_embeddings()
+    tokens, token_map = embeddings.tokenize_BERT(['abcdef', 'x', 'ghij'])
+    assert tokens == ['[CLS]', 'abc', 'def', 'x', 'ghi', 'j', '[SEP]']
+    assert list(token_map) == [-1, 0, 0, 1, 2, 2, -1]
+    # each token is tokenized once
+    assert embeddings.bert_tokenizer.calls == 3
+
+    # truncated to the BERT sequence size
+    tokens, token_map = embeddings.tokenize_BERT(['abcdef'] * BERT_sentence_size)
+    assert len(tokens) == len(token_map) == BERT_sentence_size
+    assert tokens[-1] == '[SEP]' and token_map[-1] == -1
+
+
+def test_extract():
+    embeddings = BERT_embeddings()
+    token_lists = [embeddings.tokenize_BERT(sentence)[0] for sentence in [['abcdef', 'x'], ['abc'] * 20]]
+    result = embeddings.extract_BERT(token_lists)
+    # a single prediction, padded to the bucket of the longest sentence
+    assert len(embeddings.bert_model.inputs) == 1
+    indices, segments = embeddings.bert_model.inputs[0]
+    assert indices.shape == segments.shape == (2, 32)
+    assert list(indices[0, :6]) == [2, 4, 5, 1, 3, 0]
+    assert not np.any(indices[0, 6:]) and not np.any(segments)
+    assert result.shape == (2, 32, BERT_embed_size)
+    assert embeddings.lookup_stats.snapshot()["BERT_forward_calls"] == 1
+
+    # models with a fixed input size are padded to it
+    embeddings = BERT_embeddings(input_size=BERT_sentence_size)
+    embeddings.extract_BERT(token_lists)
+    assert embeddings.bert_model.inputs[0][0].shape == (2, BERT_sentence_size)
+
+
+def test_realign():
+    embeddings = BERT_embeddings()
+    sentences = [['abcdef', 'x', 'ghij'], ['abcdefghi'], []]
+    token_maps = [embeddings.tokenize_BERT(sentence)[1] for sentence in sentences]
+    # the embeddings of each subtoken are its position in the batch, plus one
+    bert_results = np.arange(1, 3 * 8 + 1, dtype=np.float32).reshape((3, 8, 1)) * np.ones(BERT_embed_size, dtype=np.float32)
+    expected = {
+        'first': [[2, 4, 5], [10, 0, 0], [0, 0, 0]],
+        'last': [[3, 4, 6], [12, 0, 0], [0, 0, 0]],
+        'mean': [[2.5, 4, 5.5], [11, 0, 0], [0, 0, 0]]
+    }
+    for pooling, values in expected.items():
+        embeddings.BERT_pooling = pooling
+        result = embeddings.realign_BERT(token_maps, bert_results, [len(sentence) for sentence in sentences])
+        assert result.shape == (3, 3, BERT_embed_size)
+        assert np.array_equal(result, np.array(values, dtype=np.float32)[:, :, None] * np.ones(BERT_embed_size))
+
+    # tokens truncated by the BERT sequence size are left at zero
+    embeddings.BERT_pooling = 'mean'
+    token_map = embeddings.tokenize_BERT(['abcdef'] * BERT_sentence_size)[1]
+    result = embeddings.realign_BERT([token_map], np.ones((1, BERT_sentence_size, BERT_embed_size), dtype=np.float32), [BERT_sentence_size])
+    nb_tokens = (BERT_sentence_size - 2 + 1) // 2
+    assert np.all(result[0, :nb_tokens] == 1) and not np.any(result[0, nb_tokens:])
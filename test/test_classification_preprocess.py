@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+preprocess = pytest.importorskip('delft.textClassification.preprocess')
+
+
+def test_length_buckets():
+    lengths = [5, 0, 12, 3, 6, 300, 7, 1]
+    buckets = preprocess._length_buckets(lengths)
+    # in length order, empty sequences left out, no bucket spanning more than twice its shortest length
+    assert buckets == [[7], [3, 0, 4], [6, 2], [5]]
+    for bucket in buckets:
+        assert max(lengths[i] for i in bucket) <= 2 * min(lengths[i] for i in bucket)
+    assert preprocess._length_buckets([]) == []
+
+
+def test_to_vector_contextual():
+    tokens = [['a'] * 20, [], ['b', 'c'], ['d'] * 400, ['e'] * 3]
+    calls = []
+    def encode(token_lists):
+        calls.append(token_lists)
+        # the encoder gets the actual tokens, and returns vectors up to the longest one
+        length = max(len(token_list) for token_list in token_lists)
+        return np.stack([np.pad(np.ones((len(token_list), 4), dtype=np.float32), ((0, length - len(token_list)), (0, 0)), 'constant') 
+            for token_list in token_lists])
+    x = preprocess._to_vector_contextual(tokens, encode, 4, maxlen=300)
+    assert x.shape == (5, 300, 4)
+    assert sorted(len(token_list) for token_lists in calls for token_list in token_lists) == [2, 3, 20, 300]
+    assert all(' ' not in token_list for token_lists in calls for token_list in token_lists)
+    for i, length in enumerate([20, 0, 2, 300, 3]):
+        assert np.all(x[i, :length] == 1) and not np.any(x[i, length:])
@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+
+from delft.utilities import Embeddings as embeddings_module
+from delft.utilities.Embeddings import Embeddings, ContextualCache, ProcessLocalEnvironment, contextual_model_fingerprint, BERT_embed_size
+
+
+def sentences(start, end, length=4):
+    return [['w' + str(i), 'of', 'sentence', str(i)][:length] for i in range(start, end)]
+
+
+def test_get_put(tmpdir):
+    cache = ContextualCache(os.path.join(str(tmpdir), 'cache'), 'model', 8, 1 << 20)
+    token_list = [['a', 'b'], ['c'], ['d', 'e', 'f']]
+    vectors = np.random.RandomState(0).uniform(-1, 1, (3, 5, 8)).astype(np.float32)
+    assert cache.get(token_list) == [None, None, None]
+    cache.put(token_list, vectors)
+    results = cache.get(token_list + [['g']])
+    for tokens, result, vector in zip(token_list, results, vectors):
+        # only the rows of the actual tokens are cached
+        assert np.array_equal(result, vector[:len(tokens)])
+    assert results[3] is None
+    assert cache.stats()["entries"] == 3
+    cache.close()
+
+    # the entries are keyed by the fingerprint of the model
+    other = ContextualCache(os.path.join(str(tmpdir), 'cache'), 'other model', 8, 1 << 20)
+    assert other.get(token_list) == [None, None, None]
+    other.close()
+
+
+def test_eviction(tmpdir):
+    # budget of 10 sentences of 4 float32 vectors of 8 dimensions
+    entry_size = 4 * 8 * 4
+    cache = ContextualCache(os.path.join(str(tmpdir), 'cache'), 'model', 8, 10 * entry_size)
+    vectors = np.ones((5, 4, 8), dtype=np.float32)
+    cache.put(sentences(0, 5), vectors)
+    cache.put(sentences(5, 10), vectors)
+    # the first sentences are read again, their recency being recorded with the next write, 
+    # so the next ones are the least recently used
+    assert all(result is not None for result in cache.get(sentences(0, 5)))
+    cache.put(sentences(10, 15), vectors)
+
+    stats = cache.stats()
+    assert stats["size"] == 10 * entry_size
+    assert stats["entries"] == 10
+    assert all(result is None for result in cache.get(sentences(5, 10)))
+    assert all(result is not None for result in cache.get(sentences(0, 5) + sentences(10, 15)))
+    cache.close()
+
+
+def test_full_map(tmpdir, monkeypatch, capsys):
+    # a map much smaller than the budget of the cache
+    open_environment = embeddings_module._open_environment
+    def small_environment(path, inherited=None, **kwargs):
+        kwargs["map_size"] = 1 << 20
+        return open_environment(path, inherited, **kwargs)
+    monkeypatch.setattr(embeddings_module, '_open_environment', small_environment)
+    cache = ContextualCache(os.path.join(str(tmpdir), 'cache'), 'model', 256, 1 << 30)
+    vectors = np.ones((10, 4, 256), dtype=np.float32)
+    for start in range(0, 1000, 10):
+        cache.put(sentences(start, start + 10), vectors)
+    # the most recent sentences are cached, the least recent ones were evicted to make room
+    assert all(result is not None for result in cache.get(sentences(990, 1000)))
+    assert cache.get(sentences(0, 1))[0] is None
+    assert cache.stats()["size"] < 1 << 20
+
+    # sentences larger than the map are not cached
+    cache.put([['t' + str(i) for i in range(1100)]], np.ones((1, 1100, 256), dtype=np.float32))
+    assert 'vectors not cached' in capsys.readouterr().out
+    cache.put(sentences(0, 1), vectors[:1])
+    assert cache.get(sentences(0, 1))[0] is not None
+    cache.close()
+
+
+def test_fingerprint(tmpdir):
+    path = os.path.join(str(tmpdir), 'weights')
+    with open(path, 'wb') as f:
+        f.write(b'weights')
+    fingerprint = contextual_model_fingerprint([path, os.path.join(str(tmpdir), 'missing')])
+    assert fingerprint == contextual_model_fingerprint([path, os.path.join(str(tmpdir), 'missing')])
+    assert fingerprint != contextual_model_fingerprint([path], options=['first'])
+    with open(path, 'wb') as f:
+        f.write(b'other weights')
+    assert fingerprint != contextual_model_fingerprint([path, os.path.join(str(tmpdir), 'missing')])
+
+
+def test_BERT_training_cache(tmpdir):
+    embeddings = object.__new__(Embeddings)
+    embeddings.env_BERT = ProcessLocalEnvironment(os.path.join(str(tmpdir), 'bert'), map_size=1 << 26)
+    embeddings.BERT_cache_dtype = 'float16'
+    transactions = []
+    read, write = embeddings.env_BERT.read, embeddings.env_BERT.write
+    embeddings.env_BERT.read = lambda: transactions.append('read') or read()
+    embeddings.env_BERT.write = lambda: transactions.append('write') or write()
+
+    token_list = [['a', 'b'], ['c'], ['d', 'e', 'f']]
+    vectors = np.random.RandomState(0).uniform(-1, 1, (3, 5, BERT_embed_size)).astype(np.float32)
+    assert embeddings.get_BERT_lmdb_vector(token_list) == [None, None, None]
+    embeddings.cache_BERT_lmdb_vector(token_list[:2], vectors[:2])
+    results = embeddings.get_BERT_lmdb_vector(token_list)
+    for tokens, result, vector in zip(token_list[:2], results, vectors):
+        assert np.allclose(result, vector[:len(tokens)], atol=1e-3)
+    assert results[2] is None
+    # one transaction per batch
+    assert transactions == ['read', 'write', 'read']
+    embeddings.env_BERT.close()
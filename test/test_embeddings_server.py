@@ -0,0 +1,102 @@
+import os
+import socket
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+from delft.utilities.Embeddings import Embeddings
+from delft.utilities.EmbeddingsServer import EmbeddingsServer, EmbeddingsClient, request_vectors, _encode_words
+from conftest import write_registry
+
+
+@pytest.fixture
+def server(tmpdir, vec_file):
+    """
+    Embeddings server running in a thread, with the registry of its embeddings
+    """
+    socket_path = os.path.join(str(tmpdir), 'embeddings.sock')
+    description = {"name": "test", "path": vec_file, "type": "fasttext", "format": "vec", "lang": "en",
+        "storage": "mmap", "server": socket_path}
+    registry = write_registry(os.path.join(str(tmpdir), 'registry.json'), os.path.join(str(tmpdir), 'db'), [description])
+    embeddings = Embeddings('test', path=registry, use_server=False)
+    server = EmbeddingsServer(socket_path, embeddings)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield socket_path, registry
+    server.shutdown()
+    server.server_close()
+    embeddings.close()
+
+
+def test_client(server, vectors):
+    words, matrix = vectors
+    socket_path, _ = server
+    client = EmbeddingsClient(socket_path)
+    assert client.info == {"name": "test", "lang": "en", "vocab_size": len(words), "embed_size": matrix.shape[1]}
+
+    tokens = words[::-1] + ['unknown', 'été']
+    result = client.get_word_vectors(tokens)
+    assert np.array_equal(result[:len(words)], matrix[::-1])
+    assert not np.any(result[len(words)])
+    assert np.array_equal(result[-1], matrix[words.index('été')])
+    assert client.get_word_vectors([]).shape == (0, matrix.shape[1])
+
+
+def test_served_embeddings(server, vectors):
+    words, matrix = vectors
+    _, registry = server
+    embeddings = Embeddings('test', path=registry)
+    assert embeddings.client is not None
+    assert embeddings.vocab_size == len(words)
+
+    # the second lookup is served by the cache of the client embeddings
+    for i in range(2):
+        result = embeddings.get_word_vectors(words + ['unknown', 'the'])
+        assert np.array_equal(result[:len(words)], matrix)
+        assert not np.any(result[len(words)])
+        assert np.array_equal(result[-1], matrix[0])
+    assert embeddings.stats()["cache_hits"] == len(words) + 1
+
+    # each process uses its own connection
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if np.array_equal(embeddings.get_word_vectors(['naïve', 'unknown2'])[0], matrix[3]) else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    embeddings.close()
+
+
+def test_live_socket(server, tmpdir):
+    socket_path, _ = server
+    with pytest.raises(OSError, match='already listening'):
+        EmbeddingsServer(socket_path, None)
+    # the running server is still reachable
+    assert EmbeddingsClient(socket_path).info["name"] == "test"
+
+
+def test_stale_socket(tmpdir):
+    socket_path = os.path.join(str(tmpdir), 'stale.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    sock.close()
+    server = EmbeddingsServer(socket_path, None)
+    server.server_close()
+
+
+def test_interrupted_request(server, vectors, monkeypatch):
+    words, matrix = vectors
+    socket_path, _ = server
+    errors = []
+    monkeypatch.setattr(EmbeddingsServer, 'handle_error', lambda self, request, address: errors.append(address))
+
+    # a client closing its connection in the middle of a request
+    for message in [request_vectors + struct.pack('<I', 2), request_vectors + _encode_words(['the', 'of'])[:10]]:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        sock.sendall(message)
+        sock.close()
+    client = EmbeddingsClient(socket_path)
+    assert np.array_equal(client.get_word_vectors(['the']), matrix[:1])
+    assert errors == []
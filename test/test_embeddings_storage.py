@@ -0,0 +1,94 @@
+import os
+
+import lmdb
+import numpy as np
+import pytest
+
+from delft.utilities import Embeddings as embeddings_module
+from delft.utilities.Embeddings import Embeddings, compile_embeddings_lmdb, _read_lmdb_meta, _read_lmdb_progress
+from conftest import write_registry
+
+
+def tolerance(matrix, dtype):
+    """
+    Maximal absolute error of the stored values of each vector
+    """
+    if dtype == 'int8':
+        # one scale per vector, values rounded to the nearest of 127 steps
+        return np.abs(matrix).max(axis=1, keepdims=True) / 127 / 2 + 1e-6
+    if dtype == 'float16':
+        return np.abs(matrix) * 1e-3 + 1e-6
+    return 1e-6
+
+
+@pytest.mark.parametrize('storage', ['lmdb', 'mmap'])
+@pytest.mark.parametrize('dtype', ['float32', 'float16', 'int8'])
+def test_round_trip(tmpdir, vectors, vec_file, storage, dtype):
+    words, matrix = vectors
+    description = {"name": "test", "path": vec_file, "type": "fasttext", "format": "vec", "lang": "en", "dtype": dtype}
+    if storage == 'mmap':
+        description["storage"] = "mmap"
+    registry = write_registry(os.path.join(str(tmpdir), 'registry.json'), os.path.join(str(tmpdir), 'db'), [description])
+
+    # compiled at the first opening, then opened directly
+    for i in range(2):
+        embeddings = Embeddings('test', path=registry, use_server=False)
+        assert embeddings.vocab_size == len(words)
+        assert embeddings.embed_size == matrix.shape[1]
+
+        # tokens repeated, in random order and with an unknown one
+        order = np.random.RandomState(i).permutation(len(words))
+        tokens = [words[j] for j in order] + ['unknown', words[order[0]]]
+        result = embeddings.get_word_vectors(tokens)
+        assert result.dtype == np.float32
+        assert np.all(np.abs(result[:len(words)] - matrix[order]) <= tolerance(matrix[order], dtype))
+        assert not np.any(result[len(words)])
+        assert np.array_equal(result[-1], result[0])
+        assert np.array_equal(embeddings.get_word_vector(words[3]), result[list(order).index(3)])
+        embeddings.close()
+
+
+def test_resume_interrupted_compilation(tmpdir, vectors, vec_file, monkeypatch, capsys):
+    words, matrix = vectors
+    envFilePath = os.path.join(str(tmpdir), 'db', 'test')
+    os.makedirs(envFilePath)
+
+    # the compilation is interrupted after the commit of the first blocks
+    encode_raw_lines = embeddings_module._encode_raw_lines
+    calls = []
+    def interrupted_encode_raw_lines(lines, *args):
+        calls.append(len(lines))
+        if len(calls) > 6:
+            raise KeyboardInterrupt()
+        return encode_raw_lines(lines, *args)
+    monkeypatch.setattr(embeddings_module, '_encode_raw_lines', interrupted_encode_raw_lines)
+    env = lmdb.open(envFilePath, map_size=1 << 26)
+    with pytest.raises(KeyboardInterrupt):
+        compile_embeddings_lmdb(env, vec_file, block_size=20, commit_size=40, nb_workers=1)
+    with env.begin() as txn:
+        progress = _read_lmdb_progress(txn)
+        assert progress is not None and progress["offset"] > 0
+        assert _read_lmdb_meta(txn) is None
+        nb_committed = txn.stat()['entries'] - 1
+    env.close()
+    assert 0 < nb_committed < len(words)
+    monkeypatch.undo()
+
+    # the next opening of the embeddings resumes the compilation where it stopped
+    description = {"name": "test", "path": vec_file, "type": "fasttext", "format": "vec", "lang": "en"}
+    registry = write_registry(os.path.join(str(tmpdir), 'registry.json'), os.path.join(str(tmpdir), 'db'), [description])
+    capsys.readouterr()
+    embeddings = Embeddings('test', path=registry, use_server=False)
+    output = capsys.readouterr().out
+    assert 'is incomplete' in output
+    assert 'resuming compilation at byte ' + str(progress["offset"]) in output
+    assert embeddings.vocab_size == len(words)
+    assert np.allclose(embeddings.get_word_vectors(words), matrix, atol=1e-6)
+    embeddings.close()
+
+    env = lmdb.open(envFilePath, readonly=True)
+    with env.begin() as txn:
+        assert _read_lmdb_progress(txn) is None
+        assert _read_lmdb_meta(txn)["vocab_size"] == len(words)
+        assert txn.stat()['entries'] == len(words) + 1
+    env.close()
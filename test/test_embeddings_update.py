@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from delft.utilities.Embeddings import Embeddings, update_embeddings_lmdb, update_embeddings_mmap
+from conftest import write_vec, write_registry
+
+
+def open_embeddings(tmpdir, vec_file, storage, dtype='float32'):
+    description = {"name": "test", "path": vec_file, "type": "fasttext", "format": "vec", "lang": "en", "dtype": dtype}
+    if storage == 'mmap':
+        description["storage"] = "mmap"
+    registry = write_registry(os.path.join(str(tmpdir), 'registry.json'), os.path.join(str(tmpdir), 'db'), [description])
+    embeddings = Embeddings('test', path=registry, use_server=False)
+    embeddings.close()
+    return registry
+
+
+def update(tmpdir, storage, path, **kwargs):
+    if storage == 'mmap':
+        return update_embeddings_mmap(os.path.join(str(tmpdir), 'db', 'test.mmap'), path, **kwargs)
+    return update_embeddings_lmdb(os.path.join(str(tmpdir), 'db', 'test'), path, **kwargs)
+
+
+@pytest.fixture
+def delta(tmpdir, vectors):
+    """
+    Vectors of 2 new words and of 2 words already in the embeddings
+    """
+    words, matrix = vectors
+    delta_words = ['pyrrolidine', 'the', 'électrode', 'w10']
+    delta_matrix = np.random.RandomState(11).uniform(-1, 1, (len(delta_words), matrix.shape[1])).astype(np.float32)
+    path = os.path.join(str(tmpdir), 'delta.vec')
+    write_vec(path, delta_words, delta_matrix)
+    return path, delta_words, delta_matrix
+
+
+@pytest.mark.parametrize('storage', ['lmdb', 'mmap'])
+@pytest.mark.parametrize('dtype', ['float32', 'int8'])
+def test_update(tmpdir, vectors, vec_file, delta, storage, dtype):
+    words, matrix = vectors
+    path, delta_words, delta_matrix = delta
+    registry = open_embeddings(tmpdir, vec_file, storage, dtype)
+    before = Embeddings('test', path=registry, use_server=False)
+    unchanged = [word for word in words if word not in delta_words]
+    unchanged_vectors = before.get_word_vectors(unchanged).copy()
+    before.close()
+
+    # existing vectors are kept
+    assert update(tmpdir, storage, path, overwrite=False) == (2, 0)
+    embeddings = Embeddings('test', path=registry, use_server=False)
+    assert embeddings.vocab_size == len(words) + 2
+    atol = 0.01 if dtype == 'int8' else 1e-6
+    assert np.allclose(embeddings.get_word_vectors(['pyrrolidine', 'électrode']), delta_matrix[[0, 2]], atol=atol)
+    assert np.allclose(embeddings.get_word_vectors(['the', 'w10']), matrix[[0, words.index('w10')]], atol=atol)
+    embeddings.close()
+
+    # existing vectors are replaced
+    assert update(tmpdir, storage, path) == (0, 4)
+    embeddings = Embeddings('test', path=registry, use_server=False)
+    assert embeddings.vocab_size == len(words) + 2
+    assert np.allclose(embeddings.get_word_vectors(delta_words), delta_matrix, atol=atol)
+    assert np.array_equal(embeddings.get_word_vectors(unchanged), unchanged_vectors)
+    embeddings.close()
+
+
+def test_update_store_type(tmpdir, vec_file, delta):
+    path = delta[0]
+    open_embeddings(tmpdir, vec_file, 'lmdb')
+    with pytest.raises(ValueError, match='not a memory-mapped'):
+        update_embeddings_mmap(os.path.join(str(tmpdir), 'db', 'test'), path)
+
+    open_embeddings(tmpdir, vec_file, 'mmap')
+    with pytest.raises(ValueError, match='memory-mapped'):
+        update_embeddings_lmdb(os.path.join(str(tmpdir), 'db', 'test.mmap'), path)
+
+
+@pytest.mark.parametrize('storage', ['lmdb', 'mmap'])
+def test_update_embed_size(tmpdir, vec_file, storage):
+    open_embeddings(tmpdir, vec_file, storage)
+    path = os.path.join(str(tmpdir), 'delta.vec')
+    write_vec(path, ['pyrrolidine'], np.ones((1, 4), dtype=np.float32))
+    with pytest.raises(ValueError, match='4 dimensions, 10 expected'):
+        update(tmpdir, storage, path)
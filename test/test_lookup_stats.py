@@ -0,0 +1,52 @@
+import multiprocessing
+
+from delft.utilities.Embeddings import LookupStats, lookup_stats_flush_size
+
+
+def count_lookups(stats, nb_lookups, counted=None, release=None):
+    for i in range(nb_lookups):
+        stats.add(lookups=1, read_time=0.0002)
+    if counted is not None:
+        counted.set()
+        release.wait()
+
+
+def test_forked_processes():
+    stats = LookupStats()
+    stats.add(lookups=2, oov=1)
+    context = multiprocessing.get_context('fork')
+
+    # the counters of the workers are merged at their exit
+    workers = [context.Process(target=count_lookups, args=(stats, lookup_stats_flush_size + 10)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    snapshot = stats.snapshot()
+    assert snapshot["lookups"] == 2 + 3 * (lookup_stats_flush_size + 10)
+    assert snapshot["oov"] == 1
+    assert snapshot["lmdb_reads"] == 3 * (lookup_stats_flush_size + 10)
+    assert snapshot["lmdb_read_latency"]["<=0.5ms"] == 3 * (lookup_stats_flush_size + 10)
+
+    # the last increments of an idle worker are only merged at its exit
+    counted, release = context.Event(), context.Event()
+    worker = context.Process(target=count_lookups, args=(stats, 5, counted, release))
+    worker.start()
+    counted.wait()
+    assert stats.snapshot()["lookups"] == snapshot["lookups"]
+    release.set()
+    worker.join()
+    assert stats.snapshot()["lookups"] == snapshot["lookups"] + 5
+
+
+def test_difference():
+    stats = LookupStats()
+    stats.add(lookups=3, cache_hits=1)
+    since = stats.snapshot()
+    stats.add(lookups=4, read_time=0.02)
+    difference = LookupStats.difference(stats.snapshot(), since)
+    assert difference["lookups"] == 4
+    assert difference["cache_hits"] == 0
+    assert difference["lmdb_reads"] == 1
+    assert abs(difference["lmdb_read_time"] - 0.02) < 1e-9
+    assert sum(difference["lmdb_read_latency"].values()) == 1
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import lmdb
+import numpy as np
+
+from delft.utilities import Embeddings as embeddings_module
+from delft.utilities.Embeddings import ProcessLocalEnvironment, ContextualCache
+
+
+def count_openings(monkeypatch):
+    """
+    Record the openings of LMDB environments, made slow so that concurrent openings overlap
+    """
+    open_environment = embeddings_module._open_environment
+    openings = []
+    def slow_open_environment(path, inherited=None, **kwargs):
+        openings.append(path)
+        time.sleep(0.05)
+        return open_environment(path, inherited, **kwargs)
+    monkeypatch.setattr(embeddings_module, '_open_environment', slow_open_environment)
+    return openings
+
+
+def run_threads(target, nb_threads=8):
+    errors = []
+    def run():
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for i in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_first_reads(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'db')
+    env = lmdb.open(path, map_size=1 << 20)
+    with env.begin(write=True) as txn:
+        txn.put(b'key', b'value')
+    env.close()
+    openings = count_openings(monkeypatch)
+    environment = ProcessLocalEnvironment(path, readonly=True)
+
+    # the first reads of several threads open the environment once
+    def read():
+        with environment.read() as txn:
+            assert bytes(txn.get(b'key')) == b'value'
+    run_threads(read)
+    assert openings == [path]
+
+    # and once again in a forked process
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_threads(read)
+            os._exit(0 if len(openings) == 2 else 1)
+        except BaseException:
+            os._exit(1)
+    assert os.waitpid(pid, 0)[1] == 0
+    read()
+    assert openings == [path]
+    environment.close()
+
+
+def test_first_cache_lookups(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'cache')
+    openings = count_openings(monkeypatch)
+    cache = ContextualCache(path, 'model', 8, 1 << 20)
+    vectors = np.ones((1, 2, 8), dtype=np.float32)
+    run_threads(lambda: cache.put([['a', 'b']], vectors))
+    assert openings == [path]
+    assert cache.get([['a', 'b']])[0] is not None
+    cache.close()
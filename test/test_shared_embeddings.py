@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from delft.utilities.Embeddings import shared_embeddings, release_embeddings, shared_embeddings_registry
+from conftest import write_registry
+
+
+def test_shared_embeddings(tmpdir, vectors, vec_file):
+    words, matrix = vectors
+    description = {"name": "test", "path": vec_file, "type": "fasttext", "format": "vec", "lang": "en"}
+    registry = write_registry(os.path.join(str(tmpdir), 'registry.json'), os.path.join(str(tmpdir), 'db'), [description])
+
+    # the models using the same embeddings with the same options share one instance
+    first = shared_embeddings('test', path=registry)
+    second = shared_embeddings('test', path=os.path.relpath(registry))
+    assert second is first
+    assert len(shared_embeddings_registry) == 1
+
+    # the instance is closed when the last model releases it
+    release_embeddings(first)
+    assert first.env is not None
+    assert np.allclose(second.get_word_vectors(words[:3]), matrix[:3], atol=1e-6)
+    release_embeddings(second)
+    assert first.env is None
+    assert len(shared_embeddings_registry) == 0
+
+    # and created again at the next request
+    third = shared_embeddings('test', path=registry)
+    assert third is not first
+    assert np.allclose(third.get_word_vectors(words[:3]), matrix[:3], atol=1e-6)
+    release_embeddings(third)
+    assert len(shared_embeddings_registry) == 0
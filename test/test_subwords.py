@@ -0,0 +1,73 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from delft.utilities.Embeddings import Embeddings, _fasttext_hash, _subword_buckets, fasttext_magic
+from conftest import write_registry
+
+
+def write_fasttext_bin(path, words, matrix, ngram_matrix, minn, maxn):
+    """
+    Write a minimal fastText .bin model with the given word vectors followed by the n-gram buckets
+    """
+    dim = matrix.shape[1]
+    bucket = ngram_matrix.shape[0]
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<ii', fasttext_magic, 12))
+        # dim, ws, epoch, minCount, neg, wordNgrams, loss, model, bucket, minn, maxn, lrUpdateRate, t
+        f.write(struct.pack('<12id', dim, 5, 5, 1, 5, 1, 2, 2, bucket, minn, maxn, 100, 1e-4))
+        f.write(struct.pack('<iiiqq', len(words), len(words), 0, 1000, -1))
+        for word in words:
+            f.write(word.encode('UTF-8') + b'\x00' + struct.pack('<qb', 10, 0))
+        f.write(struct.pack('<?', False))
+        f.write(struct.pack('<qq', len(words) + bucket, dim))
+        f.write(np.concatenate([matrix, ngram_matrix]).astype('<f4').tobytes())
+
+
+def test_fasttext_hash():
+    # reference values of the fastText hash, as computed by gensim ft_hash_bytes
+    assert _fasttext_hash(b'') == 2166136261
+    assert _fasttext_hash('a'.encode('UTF-8')) == 3826002220
+    assert _fasttext_hash('<the>'.encode('UTF-8')) == 4243648960
+    # bytes beyond ASCII are sign-extended
+    assert _fasttext_hash('été'.encode('UTF-8')) == 200187927
+    assert _fasttext_hash('<日本>'.encode('UTF-8')) == 3315313759
+
+
+def test_subword_buckets():
+    # n-grams of 3 and 4 characters of <été>, not of bytes, and the word itself is too long
+    ngrams = ['<ét', '<été', 'été', 'été>', 'té>']
+    assert _subword_buckets('été', 3, 4, 2000000) == [_fasttext_hash(ngram.encode('UTF-8')) % 2000000 for ngram in ngrams]
+    assert sorted(_subword_buckets('été', 3, 4, 2000000)) == [59617, 187927, 196363, 1291535, 1908133]
+    # the delimiters alone are not n-grams
+    assert _subword_buckets('a', 1, 3, 1000) == [_fasttext_hash(ngram.encode('UTF-8')) % 1000 for ngram in ['<a', '<a>', 'a', 'a>']]
+    assert _subword_buckets('', 3, 6, 1000) == []
+
+
+@pytest.mark.parametrize('storage', ['lmdb', 'mmap'])
+@pytest.mark.parametrize('dtype', ['float32', 'int8'])
+def test_subword_vectors(tmpdir, vectors, vec_file, storage, dtype):
+    words, matrix = vectors
+    minn, maxn, bucket = 3, 6, 5000
+    ngram_matrix = np.random.RandomState(3).uniform(-1, 1, (bucket, matrix.shape[1])).astype(np.float32)
+    bin_file = os.path.join(str(tmpdir), 'vectors.bin')
+    write_fasttext_bin(bin_file, words, matrix, ngram_matrix, minn, maxn)
+    description = {"name": "test", "path": vec_file, "path-bin": bin_file, "type": "fasttext", "format": "vec",
+        "lang": "en", "dtype": dtype}
+    if storage == 'mmap':
+        description["storage"] = "mmap"
+    registry = write_registry(os.path.join(str(tmpdir), 'registry.json'), os.path.join(str(tmpdir), 'db'), [description])
+    embeddings = Embeddings('test', path=registry, use_server=False)
+    assert embeddings.subwords.bucket == bucket
+
+    # the vectors of the unknown words are the average of their n-gram vectors
+    unknown = ['pyrrolidine', 'électrode']
+    result = embeddings.get_word_vectors(['the'] + unknown)
+    atol = 0.01 if dtype == 'int8' else 1e-6
+    assert np.allclose(result[0], matrix[0], atol=atol)
+    for i, word in enumerate(unknown):
+        expected = ngram_matrix[_subword_buckets(word, minn, maxn, bucket)].mean(axis=0)
+        assert np.allclose(result[i+1], expected, atol=atol)
+    embeddings.close()